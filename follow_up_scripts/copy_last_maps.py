@@ -1,4 +1,10 @@
 import grass.script as grass
+import os
+import sys
+
+#the mmllite package is in the directory above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from mmllite import catalogue
 
 ###############################
 #  EDIT VALS BELOW THIS LINE  #
@@ -11,8 +17,12 @@ YEAR = 300									#Number of the year (infixed to map name) to copy all maps
 # DO NOT EDIT BELOW THIS LINE #
 ###############################
 
-#use g.mlist to generate a list of all the maps in all mapsets to copy
-maplist = grass.read_command('g.list', flags='m', type='rast', pattern="*%s*" % YEAR, separator=',').strip().split(',')
+#update the catalogue of simulation outputs in all the mapsets of this location (only new or changed maps are read), and look up all the maps of this year
+env = grass.gisenv()
+cat = catalogue.Catalogue(env['GISDBASE'], env['LOCATION_NAME'])
+cat.scan(checksums=False)
+maplist = cat.names(year=YEAR, prefix=PREFIX)
+cat.close()
 #Now loop through that list, and run g.copy, but change the name a bit to make it clear what maps are what
 for inmap in maplist:
 	outmap = "%s_%s" % (inmap.split('@')[0], inmap.split('@')[1])
@@ -1,7 +1,11 @@
-import fnmatch
 import os
+import sys
 import numpy as np
 
+#the mmllite package is in the directory above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from mmllite import ensemble
+
 ###############################
 #EDIT VALS BELOW THIS LINE
 BASEPATH = '/home/mdlpd/GIS_DataBase/Exp_2/stats_files'
@@ -9,18 +13,14 @@ FILEPATTERN = '30pmx_*_erdep_stats.txt'
 COLUMN = 2,3,4,6,7,8	#Comma separated list of columns to loop through. Columns should match the names on OUTPUTFILE.
 SKIPHEADER = 3
 OUTPUTFILE = "mean_erosion.csv","mean_deposition.csv","mean_soil_depth.csv","stdev_erosion.csv","stdev_deposition.csv","stdev_soil_depth.csv"	#Comma separated list of output text file names. Should match the columns in COLUMN.
+PROCESSES = None	#Number of files to read at once (None uses all the CPUs)
 ##############################
 
-matches = []
-for root, dirnames, filenames in os.walk(BASEPATH):
-  for filename in fnmatch.filter(filenames, FILEPATTERN):
-    matches.append(os.path.join(root, filename))
-for col,fname in zip(COLUMN, OUTPUTFILE):
-  print col, fname
-  all_data = np.genfromtxt(matches.pop(0), dtype=float, delimiter=',', skip_header=SKIPHEADER, usecols=(col))
-  print len(all_data)
-  for match in matches:
-    data = np.genfromtxt(match, dtype=float, delimiter=',', skip_header=SKIPHEADER, usecols=(col))
-    print match, len(data)
-    all_data = np.vstack((all_data, data))
-  np.savetxt("%s%s%s" % (BASEPATH, os.sep, fname), all_data.T, delimiter=",")
+#Every file is read only once, for all the columns, by PROCESSES worker processes. Files are in the order they were found in, and are the rows of the output files.
+if __name__ == "__main__":
+  matches = ensemble.find(BASEPATH, FILEPATTERN)
+  all_data = ensemble.accumulate(matches, COLUMN, SKIPHEADER, PROCESSES)
+  print("%s files, %s years" % (all_data.shape[0], all_data.shape[1]))
+  for i, fname in enumerate(OUTPUTFILE):
+    print(COLUMN[i], fname)
+    np.savetxt("%s%s%s" % (BASEPATH, os.sep, fname), all_data[:, :, i].T, delimiter=",")
@@ -54,10 +54,21 @@
 #% answer: 300
 #% required : no
 #%END
+#%option
+#% key: processes
+#% type: integer
+#% description: Number of maps to read at once (defaults to the number of CPUs)
+#% required : no
+#%END
 
 import grass.script as grass
 import numpy as np
 import os
+import sys
+
+#the mmllite package is in the directory above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from mmllite import zonal
 
 
 def main():
@@ -71,33 +82,21 @@ def main():
     VBMAP = options["vbmap"]                                    #Full name of the valley bottom map
     BASEPATH = options["basepath"]
     OUTPUTFILE = options["outputfile"]                            #Name stem for the output stats files. One file will be made for each interval.
+    PROCESSES = int(options["processes"]) if options["processes"] else None
 
     ###############################
     # DO NOT EDIT BELOW THIS LINE #
     ###############################
 
-    #calculate the number of iterations.
-    iterations = FINALYEAR / INTERVAL
-    #setup the loop, and start looping
-    looper = INTERVAL
-    ###################################
-    for iteration in range(iterations):
+    #read the valley bottom map once, and then each CUMERDEP map once, with the stats made in memory (cells where VBMAP is 0 are outside of the valley bottom)
+    masks = {"notvb": zonal.readmap(VBMAP) == 0}
+    rows = np.array(zonal.STATS)
+    for looper in range(INTERVAL, FINALYEAR + 1, INTERVAL):
         namestem = PATTERN % str(looper).zfill(DIGITS)
         cumerdeplist = grass.read_command('g.list', flags='m', type='raster', pattern=namestem, separator=',').strip().split(',')
-        statslist = []
-        rows = np.array(['summed erosion','summed deposition','mean erosion','mean deposition','max erosion','max deposition'], dtype='|S20')
-        for map1 in cumerdeplist:
-            grass.mapcalc("${OUT}=if(${VBMAP}, null(), if(${CUMERDEP} < 0, ${CUMERDEP}, null()))", quiet = 'True', overwrite="True", OUT = "temporary_notvb_EROSION_%s_" % map1.split("@")[0], VBMAP = VBMAP, CUMERDEP = map1)
-            grass.mapcalc("${OUT}=if(${VBMAP}, null(), if(${CUMERDEP} > 0, ${CUMERDEP}, null()))", quiet = 'True', overwrite="True", OUT = "temporary_notvb_DEPOSITION_%s_" % map1.split("@")[0], VBMAP = VBMAP, CUMERDEP = map1)
-            a = grass.parse_command('r.univar', flags = 'g', map = "temporary_notvb_EROSION_%s_" % map1.split("@")[0])
-            b = grass.parse_command('r.univar', flags = 'g', map = "temporary_notvb_DEPOSITION_%s_" % map1.split("@")[0])
-            statslist.append([float(a['sum']), float(b['sum']), float(a['mean']), float(b['mean']), float(a['min']), float(b['max'])])
-        statsarray = np.array(statslist)
-        np.savetxt("%s%sYear_%s_%s.csv" % (BASEPATH, os.sep, str(looper).zfill(DIGITS), OUTPUTFILE), np.vstack((rows, statsarray)), delimiter=",", fmt = "%s")
-        if looper == FINALYEAR:
-          break
-        else:
-          looper = looper + INTERVAL
+        statsarray = zonal.cumerdepstats(cumerdeplist, None, masks, processes=PROCESSES)["notvb"]
+        np.savetxt("%s%sYear_%s_%s.csv" % (BASEPATH, os.sep, str(looper).zfill(DIGITS), OUTPUTFILE), np.vstack((rows, statsarray.astype(str))), delimiter=",", fmt = "%s")
+
 if __name__ == "__main__":
     options, flags = grass.parser()
     main()
@@ -1,8 +1,12 @@
 import fnmatch
 import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import stats
+
+#the mmllite package is in the directory above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from mmllite import ensemble
 
 ###############################
 #  EDIT VALS BELOW THIS LINE  #
@@ -12,6 +16,9 @@ BASEPATH = '/home/mdlpd/GIS_DataBase/New_penag/records'
 FILEPATTERN = '30pf10sim_*_yields_stats.txt'
 COLUMN = 1
 SKIPHEADER = 35
+PERMUTATIONS = None #number of random reshufflings of the runs (None does one per run)
+CHUNK = 100 #number of reshufflings to compute at once (lower this if memory runs out)
+SEED = None #seed for the reshufflings (None gives different ones every time)
 OUTPUTFILE = "MEAN_POP.csv"
 
 ###############################
@@ -32,32 +39,7 @@ for match in matches:
 
 np.savetxt("%s%s%s" % (BASEPATH, os.sep, OUTPUTFILE), all_data.T, delimiter=",")
 
-#compute standard error of an array, first randomly shuffle the rows (actually columns), and do this 100 times so that the data are bootstrapped, then loop through the shuffled dataset and calculate the sum SE for every n in the sequence
-
-#first get the standard errors for the unshuffled data, and make that an array
-loopctrl = range(len(all_data))
-el = []
-for x in loopctrl:
-  #z = stats.sem(all_data[0:x+1], axis=None, ddof=0)
-  z = stats.sem(all_data[0:x+1])
-  #z = np.mean(all_data[0:x+1])
-  #el.append(np.mean(z))
-  el.append(np.sum(z))
-
-errorlist = [el]
-
-#now do a nested loop of this, but reshuffling each time 
-for n in loopctrl:
-  a2 = np.random.permutation(all_data)
-  el2 = []
-  for x in loopctrl:
-    #z = stats.sem(a2[0:x+1], axis=None, ddof=0)
-    z = stats.sem(a2[0:x+1])
-    el2.append(np.sum(z))
-    #z = np.mean(a2[0:x+1])
-    #el2.append(np.mean(z))
-  errorlist.append(el2)
-
-errorarray = np.array(errorlist)
+#compute standard error of an array, first randomly shuffle the rows (actually columns), and do this many times so that the data are bootstrapped, then calculate the sum SE for every n in the sequence. The first row of errors is for the unshuffled data. All the n's of all the shuffles are done at once from running sums and sums of squares (see mmllite.ensemble.semcurves)
+errorarray = ensemble.semcurves(all_data, permutations=PERMUTATIONS, chunk=CHUNK, seed=SEED)
 
 np.savetxt("%s%s%s_errors.csv" % (BASEPATH, os.sep, OUTPUTFILE), errorarray.T, delimiter=",")
@@ -0,0 +1,42 @@
+import grass.script as grass
+import numpy as np
+import os
+import sys
+
+#the mmllite package is in the directory above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from mmllite import zonal
+
+###############################
+#  EDIT VALS BELOW THIS LINE  #
+###############################
+
+ELEVPATTERN = '*_Year_%s_Elevation_Map*'			#Name stem for elevation maps. Use standard wild card search operators for prefix/suffix, and string substitution operator for infixed year number
+INTERVAL = 50 										#Interval for the routine (routine will only run for years that are a multiple of this number
+DIGITS = 3											#Number of digits in the infixed year number. Will use zfill to pad zeros to this number of digits.
+FINALYEAR = 300										#Number of the last year to include in the analysis
+INITDEM = "DEM@PERMANENT"							#Full name (with @'mapset') of the initial dem used in the sim
+STREAM = "masdis_stream_extract_costs@PERMANENT"	#Full name of the stream map (each stream segment has its own number)
+BASEPATH = '/home/medland/GIS_Database/Exp6/exp6_records'
+OUTPUTFILE = "STREAM_SEGMENT_STATS"					#Name stem for the output stats files. One file will be made for each interval and stat.
+PERCENTILES = 10, 50, 90							#Percentiles of cumulative erosion/deposition to compute along each segment
+PROCESSES = None									#Number of replicates to run at once (None uses all the CPUs)
+
+###############################
+# DO NOT EDIT BELOW THIS LINE #
+###############################
+
+#Per-segment cumulative erosion/deposition stats of every replicate. The cells of each stream segment are indexed once, and then every replicate's final dem is read once, and all of the values along all the segments are gathered from it at once. Each stat gets a file with one row per segment (the first column is the segment number) and one column per replicate, and all the stats of a year are also saved together as a (replicates x segments x stats) .npy array.
+if __name__ == "__main__":
+	initdem = zonal.readmap(INITDEM)
+	index = zonal.ZoneIndex(zonal.readmap(STREAM))
+	statnames = ["sum", "mean"] + ["percentile%s" % q for q in PERCENTILES]
+	print("%s stream segments" % len(index))
+	for looper in range(INTERVAL, FINALYEAR + 1, INTERVAL):
+		year = str(looper).zfill(DIGITS)
+		elevmaps = grass.read_command('g.list', flags='m', type='rast', pattern=ELEVPATTERN % year, separator=',').strip().split(',')
+		print("Year %s: %s replicates" % (year, len(elevmaps)))
+		statsarray = zonal.segmentstats(elevmaps, initdem, index, PERCENTILES, PROCESSES)
+		np.save("%s%sYear_%s_%s.npy" % (BASEPATH, os.sep, year, OUTPUTFILE), statsarray)
+		for i, stat in enumerate(statnames):
+			np.savetxt("%s%sYear_%s_%s_%s.csv" % (BASEPATH, os.sep, year, OUTPUTFILE, stat), np.column_stack((index.ids, statsarray[:, :, i].T)), delimiter=",", header="segment," + ",".join(elevmaps), comments="")
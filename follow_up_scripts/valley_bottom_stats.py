@@ -1,6 +1,11 @@
 import grass.script as grass
 import numpy as np
 import os
+import sys
+
+#the mmllite package is in the directory above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from mmllite import zonal
 
 ###############################
 #  EDIT VALS BELOW THIS LINE  #
@@ -14,39 +19,30 @@ FINALYEAR = 300                                        #Number of the last year
 INITDEM = "filledDEM@PERMANENT"                            #Full name (with @'mapset') of the initial dem used in the sim
 VBMAP = "TRUE_valley_bottom@stats"    #Full name of the valley bottom map
 BASEPATH = '/home/mdlpd/GIS_DataBase/Exp_2/stats_files'
-OUTPUTFILE = "VB_ERDEP_STATS"                            #Name stem for the output stats files. One file will be made for each interval.
+OUTPUTFILE = "VB_ERDEP_STATS"                            #Name stem for the output stats files. One file will be made for each interval. Stats outside of the valley bottom (where VBMAP is 0) go to files named "NON_" + OUTPUTFILE.
+STREAM = None                                          #Full name of a stream map, to also make stats for the stream cells (in files named "STREAM_" + OUTPUTFILE). None skips them.
+WRITECUMERDEP = False                                  #If True, also write the cumulative erosion/deposition (CUMERDEP) maps of each replicate (other_erdep_stats.py needs them).
+PROCESSES = None                                       #Number of replicates to run at once (None uses all the CPUs)
 
 ###############################
 # DO NOT EDIT BELOW THIS LINE #
 ###############################
 
-#calculate the number of iterations.
-iterations = FINALYEAR / INTERVAL
-#setup the loop, and start looping
-looper = INTERVAL
-###################################
-for iteration in range(iterations):
-    namestem = ELEVPATTERN % str(looper).zfill(DIGITS)
-    elevmaps = grass.read_command('g.list', flags='m', type='rast', pattern=namestem, separator=',').strip().split(',')
-    cumerdeplist = []
-    for map1 in elevmaps:
-        print map1
-        #print namestem.strip('*')
-        outname = "YEAR%s_%s_CUMERDEP_%s" % (str(looper).zfill(DIGITS), map1.split('%s@' % namestem.strip('*'))[1], map1.split('%s@' % namestem.strip('*'))[0].strip(PREFIX))
-        print outname
-        grass.mapcalc("${outname}=(${elevmap} - ${dem})", quiet = 'True', overwrite="True", outname = outname, dem = INITDEM, elevmap = map1)
-        cumerdeplist.append(outname)
-    statslist = []
-    rows = np.array(['summed erosion','summed deposition','mean erosion','mean deposition','max erosion','max deposition'], dtype='|S20')
-    for map1 in cumerdeplist:
-        grass.mapcalc("${OUT}=if(isnull(${VBMAP}), null(), if(${CUMERDEP} < 0, ${CUMERDEP}, null()))", quiet = 'True', overwrite="True", OUT = "temporary_EROSION_%s_" % map1.split("@")[0], VBMAP = VBMAP, CUMERDEP = map1)
-        grass.mapcalc("${OUT}=if(isnull(${VBMAP}), null(), if(${CUMERDEP} > 0, ${CUMERDEP}, null()))", quiet = 'True', overwrite="True", OUT = "temporary_DEPOSITION_%s_" % map1.split("@")[0], VBMAP = VBMAP, CUMERDEP = map1)
-        a = grass.parse_command('r.univar', flags = 'g', map = "temporary_EROSION_%s_" % map1.split("@")[0])
-        b = grass.parse_command('r.univar', flags = 'g', map = "temporary_DEPOSITION_%s_" % map1.split("@")[0])
-        statslist.append([float(a['sum']), float(b['sum']), float(a['mean']), float(b['mean']), float(a['min']), float(b['max'])])
-    statsarray = np.array(statslist)
-    np.savetxt("%s%sYear_%s_%s.csv" % (BASEPATH, os.sep, str(looper).zfill(DIGITS), OUTPUTFILE), np.vstack((rows, statsarray)), delimiter=",", fmt = "%s")
-    if looper == FINALYEAR:
-      break
-    else:
-      looper = looper + INTERVAL
+if __name__ == "__main__":
+    #read the initial dem and the zones once. Each replicate's final dem is then read once, and all the zone stats are made from it in memory
+    initdem = zonal.readmap(INITDEM)
+    vb = zonal.readmap(VBMAP)
+    masks = {OUTPUTFILE: ~np.isnan(vb), "NON_%s" % OUTPUTFILE: vb == 0}
+    if STREAM:
+        masks["STREAM_%s" % OUTPUTFILE] = ~np.isnan(zonal.readmap(STREAM))
+    rows = np.array(zonal.STATS)
+    for looper in range(INTERVAL, FINALYEAR + 1, INTERVAL):
+        namestem = ELEVPATTERN % str(looper).zfill(DIGITS)
+        elevmaps = grass.read_command('g.list', flags='m', type='rast', pattern=namestem, separator=',').strip().split(',')
+        outnames = []
+        for map1 in elevmaps:
+            print(map1)
+            outnames.append("YEAR%s_%s_CUMERDEP_%s" % (str(looper).zfill(DIGITS), map1.split('%s@' % namestem.strip('*'))[1], map1.split('%s@' % namestem.strip('*'))[0].strip(PREFIX)))
+        allstats = zonal.cumerdepstats(elevmaps, initdem, masks, outnames if WRITECUMERDEP else None, PROCESSES)
+        for zone, statsarray in allstats.items():
+            np.savetxt("%s%sYear_%s_%s.csv" % (BASEPATH, os.sep, str(looper).zfill(DIGITS), zone), np.vstack((rows, statsarray.astype(str))), delimiter=",", fmt = "%s")
@@ -0,0 +1,7 @@
+"""
+Shared helpers for the MML-Lite GRASS scripts.
+
+The scripts are installed as stand-alone GRASS addon scripts, so this package
+has to be copied into the same directory (usually ~/.grass8/addons/scripts).
+Each script puts its own directory on sys.path before importing from here.
+"""
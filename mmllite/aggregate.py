@@ -0,0 +1,184 @@
+"""
+Live ensemble statistics shared by many replicate runs.
+
+Each run of an ensemble can push every year's stats rows into one shared
+SQLite database (in WAL mode, so it can be read while runs are writing to it).
+For every stats file, column, and year, the database keeps the number of
+replicates that have reached that year, the running mean and sum of squared
+deviations (Welford's algorithm, so the variance and standard error are
+always available), the minimum and maximum, and a P-square sketch of a few
+quantiles. Nothing has to wait for the whole ensemble to finish before it
+can be summarized, or checked for convergence.
+
+Runs write through an Aggregator attached to their stats.StatsSink, so rows
+are sent in one transaction whenever the sink flushes. summary() reads the
+current statistics of one column back out.
+"""
+
+import json
+import math
+import sqlite3
+
+import numpy as np
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    tbl TEXT, col TEXT, year INTEGER,
+    n INTEGER, mean REAL, m2 REAL, min REAL, max REAL, sketch TEXT,
+    PRIMARY KEY (tbl, col, year)
+);
+CREATE TABLE IF NOT EXISTS runs (run TEXT PRIMARY KEY, years INTEGER);
+"""
+
+
+class P2Quantile(object):
+    """
+    P-square estimate of one quantile of a stream of values (Jain and
+    Chlamtac, 1985), kept in five markers whatever the number of values.
+    p = quantile to estimate (0-1)
+    state = saved state (see state()) to continue from
+    """
+
+    def __init__(self, p, state=None):
+        self.p = p
+        if state:
+            self.q, self.n, self.nd = state
+        else:
+            self.q, self.n, self.nd = [], [0, 1, 2, 3, 4], [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.dn = [0, p / 2.0, p, (1 + p) / 2.0, 1]
+
+    def state(self):
+        return [self.q, self.n, self.nd]
+
+    def add(self, x):
+        q, n = self.q, self.n
+        # The first five values are kept as they are
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = max(i for i in range(4) if q[i] <= x)
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.nd[i] += self.dn[i]
+        # Move the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.nd[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / float(n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if not self.q:
+            return float("nan")
+        if len(self.q) < 5:
+            return float(np.percentile(self.q, 100 * self.p))
+        return self.q[2]
+
+
+class Aggregator(object):
+    """
+    Writer of one run's stats rows into a shared ensemble statistics database.
+    path = path of the SQLite database (made if it does not exist)
+    run = name of this run, recorded in the runs table
+    quantiles = quantiles to sketch for every column
+    timeout = seconds to wait for other runs to finish writing
+    """
+
+    def __init__(self, path, run, quantiles=QUANTILES, timeout=600):
+        self.run = run
+        self.quantiles = tuple(quantiles)
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._rows = []
+        self._years = 0
+
+    def add(self, table, year, columns, values):
+        """
+        Buffer a stats row of a year. Spacer (unnamed) columns, and values that
+        are not numbers, are left out.
+        """
+        self._years = max(self._years, year)
+        for column, value in zip(columns, values):
+            if not column:
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            if not math.isnan(value):
+                self._rows.append((table, column, year, value))
+
+    def flush(self):
+        """Fold the buffered rows into the running statistics, in one transaction."""
+        if not self._rows:
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for table, column, year, x in self._rows:
+                row = self.db.execute("SELECT n, mean, m2, min, max, sketch FROM stats WHERE tbl = ? AND col = ? AND year = ?", (table, column, year)).fetchone()
+                if row is None:
+                    n, mean, m2, lo, hi, sketch = 0, 0.0, 0.0, x, x, {}
+                else:
+                    n, mean, m2, lo, hi, sketch = row[:5] + (json.loads(row[5]),)
+                # Welford's update of the running mean and sum of squared deviations
+                n += 1
+                delta = x - mean
+                mean += delta / n
+                m2 += delta * (x - mean)
+                for p in self.quantiles:
+                    estimate = P2Quantile(p, sketch.get(str(p)))
+                    estimate.add(x)
+                    sketch[str(p)] = estimate.state()
+                self.db.execute(
+                    "INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (table, column, year, n, mean, m2, min(lo, x), max(hi, x), json.dumps(sketch)),
+                )
+            self.db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (self.run, self._years))
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def summary(path, table, column, quantiles=QUANTILES):
+    """
+    Current ensemble statistics of one column of one stats file. Returns a
+    structured array with one row per year, with the number of replicates,
+    mean, variance, standard error of the mean, minimum, maximum, and the
+    sketched quantiles (as "q0.5" etc).
+    path = path of the SQLite database
+    table = name of the stats output (e.g. "yields", "erdep")
+    column = name of the column (e.g. "Population")
+    """
+    db = sqlite3.connect(path)
+    rows = db.execute("SELECT year, n, mean, m2, min, max, sketch FROM stats WHERE tbl = ? AND col = ? ORDER BY year", (table, column)).fetchall()
+    db.close()
+    names = ["year", "n", "mean", "var", "sem", "min", "max"] + ["q%s" % p for p in quantiles]
+    out = np.zeros(len(rows), dtype=[(name, "f8") for name in names])
+    for i, (year, n, mean, m2, lo, hi, sketch) in enumerate(rows):
+        var = m2 / (n - 1) if n > 1 else float("nan")
+        sketch = json.loads(sketch)
+        qs = [P2Quantile(p, sketch.get(str(p))).value() for p in quantiles]
+        out[i] = tuple([year, n, mean, var, math.sqrt(var / n) if n > 1 else float("nan"), lo, hi] + qs)
+    return out
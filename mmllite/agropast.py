@@ -0,0 +1,168 @@
+"""
+Common core of the agropastoral models.
+
+r.agropast.adaptive, r.agropast.adaptive2.py, r.agropast.adaptive-fire.py,
+r.agropast.semiadaptive.py, and r.agropast.nonadaptive.py each grew their own
+copy of the population draws, the cereal yield and soil fertility
+r.mapcalc expressions, and the call to the landscape evolution module, and
+the copies drifted apart (some still called r.landscape.evol.py,
+r.landscape.evol7.py, or r.landscape.evol2, which are long gone). The stages
+that the scripts share are kept here once, as numpy functions of in-memory
+arrays (with NaN for null cells) in the style of mmllite.landcover, so that
+every variant runs the same engine. The scripts read and write the maps, and
+keep only the rules of their own variant.
+
+Evolution runs the landscape evolution step of the legacy scripts in process,
+with mmllite.landscape, taking the options of the old r.landscape.evol
+interface. Options that the current engine has no use for (kappa, cutoff1-3,
+speed, kt, loadexp) are ignored, and the scripts warn when they are given
+anything but their defaults (see ignoredoptions). The ones it has that the old
+interface did not are taken from the defaults of r.landscape.evol
+(LEVOL_DEFAULTS).
+GRASS is only imported by Evolution, so the rest can be used without it.
+"""
+
+import numpy as np
+
+# r.landscape.evol options (and their defaults) that the legacy scripts do not set
+LEVOL_DEFAULTS = {"k": 0.05, "p": 1.0, "sdensity": 1218.4, "transp_eq": "StreamPower", "exp_m": "500,1,1000,1.2", "exp_n": "20,1,45,1.3", "manningn": 0.03, "flowcontrib": 100, "convergence": 5, "initbdrk": "", "outdem": "Elevation", "outsoil": "Soil_Depth", "number": 1}
+
+# Flags of the landscape evolution step
+LEVOL_FLAGS = ("p", "k", "d", "r", "s", "t", "e", "m")
+
+
+def ignoredoptions(options, defaults):
+    """
+    Names of the options of the old r.landscape.evol interface that Evolution
+    ignores, but that were given a value other than their default.
+    options = dictionary of the options of a script (as g.parser gives them)
+    defaults = dictionary of the defaults of the ignored options of the script
+    """
+    changed = []
+    for key in sorted(defaults):
+        value = options.get(key)
+        if value not in (None, "") and float(value) != float(defaults[key]):
+            changed.append(key)
+    return changed
+
+
+def babymaker(p, n):
+    """
+    Births of the year in a village, as a Poisson draw of the rate (of p *
+    100, divided by 100) times the population, truncated to whole people.
+    p = per capita birth rate
+    n = population size
+    """
+    babys = (np.random.poisson(p * 100) / 100.0) * n
+    return int(babys)
+
+
+def deathdealer(p, n):
+    """
+    Deaths of the year in a village, as a Poisson draw of the rate (of p *
+    100, divided by 100) times the population, truncated to whole people.
+    p = per capita death rate
+    n = population size
+    """
+    deaths = (np.random.poisson(p * 100) / 100.0) * n
+    return int(deaths)
+
+
+def cerealyield(precip, fert, sdepth, maxwheat, maxbarley, agmix, perhectare):
+    """
+    Potential cereal yield (kg per field or cell) of the wheat and barley mix.
+    precip = total precipitation of the year (m)
+    fert, sdepth = arrays of soil fertility and soil depth
+    maxwheat, maxbarley = maximum yields (kg/ha)
+    agmix = share of barley in the mix (0 to 1)
+    perhectare = number of fields (or cells) per hectare
+    """
+    def crop(ax, bx, ay, by, az, bz, maxyield):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x = (ax * np.log(precip)) + bx if precip > 0 else 0
+            y = np.where(fert > 0, (ay * np.log(fert)) + by, 0)
+            z = np.where(sdepth > 0, (az * np.log(sdepth)) + bz, 0)
+            a = np.where((x <= 0) | (z <= 0), 0, ((((x * y * z) / 3) * maxyield) / perhectare))
+            a = np.where(a < 0, 0, a)
+        return np.where(np.isnan(fert) | np.isnan(sdepth), np.nan, a)
+
+    fert = np.asarray(fert, dtype=float)
+    sdepth = np.asarray(sdepth, dtype=float)
+    wheat = crop(0.51, 1.03, 0.28, 0.87, 0.19, 1, maxwheat)
+    barley = crop(0.48, 1.51, 0.34, 1.09, 0.18, 0.98, maxbarley)
+    return ((1 - agmix) * wheat) + (agmix * barley)
+
+
+def fertility(oldfert, fields, grazeimpacts, grazeimpact, regain, manurerate, maxfert, stubble=True):
+    """
+    This year's soil fertility: last year's, less the farming impacts in the
+    fields, plus the natural regain, and manure where there was grazing,
+    capped at the maximum fertility (as the r.mapcalc expressions of the
+    scripts, and their null cells).
+    oldfert = array of last year's soil fertility
+    fields = array of farming impacts (NaN outside of the fields)
+    grazeimpacts = array of grazing impacts (NaN where there was no grazing)
+    grazeimpact = array of the potential grazing impacts of every cell
+    regain = array of the natural fertility regain of every cell
+    manurerate = fertility gained per unit of grazing impact
+    maxfert = array (or number) of the maximum fertility
+    stubble = the fields were grazed too (so they are manured, and fertility
+        does not go below 0)
+    """
+    with np.errstate(invalid="ignore"):
+        if stubble:
+            manured = ~(np.isnan(grazeimpacts) & np.isnan(fields))
+        else:
+            manured = ~np.isnan(grazeimpacts)
+        a = np.where(manured, regain + (manurerate * grazeimpact), regain)
+        b = np.where(np.isnan(fields), oldfert, oldfert - fields)
+        fert = np.where(b <= maxfert - a, b + a, maxfert)
+        if stubble:
+            fert = np.where(fert < 0, 0, fert)
+        return np.where(np.isnan(b) | np.isnan(a), np.nan, fert)
+
+
+class Evolution(object):
+    """
+    Yearly landscape evolution of the legacy scripts, run in process with
+    mmllite.landscape instead of as the r.landscape.evol module.
+    statsout = path of the erosion/deposition stats file
+    res = resolution of the region
+    options = dictionary of the r.landscape.evol options of the script
+        (elev, initbdrk, k, sdensity, manningn, outdem, outsoil, smoothing)
+    flags = list (or string) of the r.landscape.evol flags of the script
+    """
+
+    def __init__(self, statsout, res, options, flags=()):
+        from mmllite import landscape, stats
+
+        self.statsout = statsout
+        self.res = res
+        self.options = dict(LEVOL_DEFAULTS)
+        self.options.update((key, value) for key, value in options.items() if key in LEVOL_DEFAULTS or key == "elev")
+        self.flags = dict((flag, flag in flags) for flag in LEVOL_FLAGS)
+        # "smoothing" of the old interface is the -m flag of the current one
+        self.flags["m"] = self.flags["m"] or str(options.get("smoothing", "no")).lower() not in ("", "no")
+        self.sink = stats.StatsSink()
+        landscape.addStats(self.sink, statsout)
+
+    def step(self, prefx, elev, c, r, rain, storms, stormlength, flowcontrib=None, stormi=0.05):
+        """
+        Run one year of landscape evolution, writing the prefx + outdem and
+        prefx + outsoil maps.
+        elev = elevation map of last year
+        c = C-factor map (or array, or constant) of this year
+        r, rain, storms, stormlength, stormi = climate of this year
+        flowcontrib = rainfall excess map (or array) of this year
+        """
+        from mmllite import landscape
+
+        options = dict(self.options, prefx=prefx, elev=elev, c=c)
+        if flowcontrib is not None:
+            options["flowcontrib"] = flowcontrib
+        landscape.landscapeEvol(0, 1, prefx, self.statsout, self.res, [[r], [rain], [stormlength], [storms], [stormi]], self.sink, options, self.flags)
+        self.sink.step()
+
+    def close(self):
+        """Write out the rest of the stats."""
+        self.sink.close()
@@ -0,0 +1,152 @@
+"""
+Compact storage of the yearly output maps of long runs.
+
+Writing full Elevation, Soil_Depth, Landcover, etc. rasters for every year of
+a long run takes hundreds of GB per replicate. An Archive instead keeps a full
+copy (a keyframe) of a map every few years, and for the years in between only
+stores the cells whose values differ from the last keyframe, with their new
+values (so every year is kept exactly, not approximately). As most cells of
+most maps change little or not at all from year to year, the in-between years
+are small, and everything is written as compressed .npz files, one per map
+and year, in a directory per variable:
+
+    ARCHIVE/Elevation/0010.npz   (keyframe)
+    ARCHIVE/Elevation/0011.npz   (changed cells since year 10)
+
+Any year can be read back as an array with Archive.read(), or as a raster in
+the current GRASS session with Archive.restore(), or from the command line:
+
+    python3 -m mmllite.archive ARCHIVE Elevation 11 restored_elevation_0011
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+
+class Archive(object):
+    """
+    Keyframe and sparse-change storage of yearly maps.
+    path = directory of the archive (made if it does not exist)
+    keyframes = number of years between keyframes
+    """
+
+    def __init__(self, path, keyframes=10):
+        self.path = path
+        self.keyframes = max(int(keyframes), 1)
+        self._keys = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, variable, year):
+        return os.path.join(self.path, variable, "%04d.npz" % int(year))
+
+    def add(self, variable, year, data, region=None):
+        """
+        Store a year of a map. The first year of a variable, and every year
+        that is a multiple of keyframes, is stored in full.
+        variable = name of the variable (e.g. "Elevation")
+        year = year of the simulation
+        data = array of the map (NaN for null cells)
+        region = dictionary of the region of the map (stored with keyframes)
+        """
+        data = np.asarray(data)
+        folder = os.path.join(self.path, variable)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        key = self._keys.get(variable)
+        if key is None or int(year) % self.keyframes == 0 or key[1].shape != data.shape:
+            np.savez_compressed(self._file(variable, year), data=data, region=json.dumps(region or {}, default=str))
+            self._keys[variable] = (int(year), data.copy())
+            return
+        keyyear, keydata = key
+        # Cells whose values differ from the keyframe (null cells are equal to each other)
+        if data.dtype.kind == "f":
+            changed = ~((data == keydata) | (np.isnan(data) & np.isnan(keydata)))
+        else:
+            changed = data != keydata
+        index = np.flatnonzero(changed)
+        index = index.astype(np.uint32 if data.size < 2 ** 32 else np.uint64)
+        np.savez_compressed(self._file(variable, year), keyframe=keyyear, index=index, values=data.ravel()[index])
+
+    def years(self, variable):
+        """Years of a variable that are stored in the archive."""
+        folder = os.path.join(self.path, variable)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(folder) if name.endswith(".npz"))
+
+    def read(self, variable, year):
+        """
+        Reconstruct a year of a map. Returns the array of the map, and the
+        region dictionary stored with its keyframe.
+        """
+        with np.load(self._file(variable, year)) as f:
+            if "data" in f:
+                return f["data"], json.loads(str(f["region"]))
+            keyyear, index, values = int(f["keyframe"]), f["index"], f["values"]
+        data, region = self.read(variable, keyyear)
+        data = data.copy()
+        data.ravel()[index] = values
+        return data, region
+
+    def archivemap(self, variable, year, mapname, remove=True, env=None):
+        """
+        Store a year of a GRASS raster map (read in the current region), and
+        then remove the raster unless asked not to. Maps that do not exist
+        are skipped. Returns True if the map was stored.
+        env = environment to run GRASS in (e.g. that of a writer.BackgroundWriter)
+        """
+        import grass.script as grass
+
+        from mmllite import zonal
+
+        if not grass.find_file(mapname, element="cell", env=env)["file"]:
+            return False
+        region = grass.region(env=env)
+        region["datatype"] = grass.raster_info(mapname, env=env)["datatype"]
+        data = zonal.readmap(mapname, env=env)
+        # FCELL maps are stored at their own precision (which also halves their size)
+        if region["datatype"] == "FCELL":
+            data = data.astype(np.float32)
+        self.add(variable, year, data, region)
+        if remove:
+            grass.run_command("g.remove", quiet=True, flags="f", type="raster", name=mapname, env=env)
+        return True
+
+    def restore(self, variable, year, mapname):
+        """
+        Write a year of a map back out as a GRASS raster, of the same data
+        type as the original map. The region of the map is set from its
+        keyframe for the write.
+        """
+        import grass.script as grass
+
+        from mmllite import zonal
+
+        data, region = self.read(variable, year)
+        grass.use_temp_region()
+        try:
+            if region:
+                grass.run_command("g.region", n=region["n"], s=region["s"], e=region["e"], w=region["w"], rows=region["rows"], cols=region["cols"])
+            if region.get("datatype") == "FCELL":
+                data = data.astype(np.float32)
+            zonal.writemap(mapname, data, integer=region.get("datatype") == "CELL")
+        finally:
+            grass.del_temp_region()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 4:
+        sys.stderr.write("Usage: python3 -m mmllite.archive ARCHIVE VARIABLE YEAR OUTPUT_MAP\n")
+        return 1
+    path, variable, year, mapname = argv
+    Archive(path).restore(variable, int(year), mapname)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
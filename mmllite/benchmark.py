@@ -0,0 +1,296 @@
+"""
+Benchmarks of r.landscape.evol and r.agropast.adaptive on synthetic landscapes.
+
+Builds a synthetic DEM, bedrock, landcover, soil fertility, agricultural and
+grazing catchments, and a cost surface at each of several sizes, and times a
+few years of landscapeEvol() with each transport equation and of
+r.agropast.adaptive with each tenure type. Every run is reported as the time
+per year, the throughput in cells per second, and the peak memory use, and all
+results are appended to a JSON file so that runs on different GRASS versions
+or code changes can be compared with --compare.
+
+The synthetic maps are made with r.mapcalc from fixed formulas (no random
+surfaces), so every run times the same landscape. Run from the directory that
+holds the scripts and the mmllite folder:
+
+    python3 -m mmllite.benchmark --sizes 256,1024 --years 3
+
+Outside of a GRASS session, the benchmark starts itself in a temporary XY
+location (with "grass --tmp-location XY --exec"), which is deleted
+afterwards. Each run is timed in a fresh Python process, so that its peak
+memory (of that process, and of the largest GRASS module it ran) is its own,
+and not the largest peak of the runs before it.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from mmllite import profiling, stats
+
+# Directory holding the scripts, the rules folder, and the mmllite package
+SCRIPTDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+TRANSP_EQS = ("StreamPower", "ShearStress", "USPED")
+TENURETYPES = ("None", "Maximize", "Satisfice")
+
+# Resolution of the synthetic landscapes (meters)
+RES = 10
+
+# r.landscape.evol defaults, with constant climate and c-factor
+LEVOL_OPTIONS = {
+    "outdem": "elevation",
+    "outsoil": "soildepth",
+    "k": "0.05",
+    "c": "0.005",
+    "p": "1.0",
+    "sdensity": "1218.4",
+    "exp_m": "500,1,1000,1.2",
+    "exp_n": "20,1,45,1.3",
+    "manningn": "0.03",
+    "flowcontrib": "100",
+    "convergence": "5",
+}
+LEVOL_FLAGS = dict((key, False) for key in "dekmprst")
+CLIMATE = (720, 30, 24.0, 2, 0.05)
+
+
+def mapnames(size):
+    """Names of the synthetic input maps of a size, by their key."""
+    return dict((key, "bench%s_%s" % (size, key)) for key in ("elev", "bdrk", "lcov", "fert", "agcatch", "grazecatch", "cost"))
+
+
+def build_landscape(size):
+    """
+    Make the synthetic input maps for a square region of size x size cells.
+    The DEM is a valley sloping down to the south with rolling hills, the soil
+    is thickest in the valley bottom, and the catchments and cost surface are
+    centered on a settlement in the middle of the valley.
+    Returns a dictionary of map names.
+    """
+    import grass.script as grass
+
+    extent = size * RES
+    grass.run_command("g.region", n=extent, s=0, e=extent, w=0, res=RES, quiet=True)
+    maps = mapnames(size)
+    center = extent / 2.0
+    expressions = [
+        "${elev}=200 + 0.02 * y() + 0.05 * abs(x() - %(c)s) + 5 * sin(x() / 7.0) * cos(y() / 11.0)",
+        "${bdrk}=${elev} - 0.5 - 2.5 * exp(-abs(x() - %(c)s) / (0.1 * %(e)s))",
+        "${lcov}=round(25 + 20 * sin(x() / 13.0) * sin(y() / 17.0))",
+        "${fert}=round(70 + 20 * cos(x() / 19.0) * cos(y() / 23.0))",
+        "${cost}=sqrt((x() - %(c)s)^2 + (y() - %(c)s)^2) * (1 + 0.05 * abs(x() - %(c)s) / %(e)s)",
+        "${agcatch}=if(sqrt((x() - %(c)s)^2 + (y() - %(c)s)^2) <= 0.15 * %(e)s, 1, null())",
+        "${grazecatch}=if(sqrt((x() - %(c)s)^2 + (y() - %(c)s)^2) <= 0.35 * %(e)s, 1, null())",
+    ]
+    for expression in expressions:
+        grass.mapcalc(expression % {"c": center, "e": extent}, overwrite=True, quiet=True, **maps)
+    return maps
+
+
+def time_landscape(maps, size, transp_eq, years, workdir):
+    """Time a number of years of landscapeEvol() with one transport equation."""
+    import grass.script as grass
+
+    from mmllite import landscape
+
+    options = dict(LEVOL_OPTIONS, elev=maps["elev"], initbdrk=maps["bdrk"], transp_eq=transp_eq, number=str(years), prefx="bench%s_%s_" % (size, transp_eq))
+    statsout = os.path.join(workdir, "%serdep.csv" % options["prefx"])
+    sink = stats.StatsSink()
+    landscape.addStats(sink, statsout, size=years)
+    climate = [[value] * years for value in CLIMATE]
+    yeartimes = []
+    for x in range(years):
+        start = time.perf_counter()
+        landscape.landscapeEvol(x, x + 1, options["prefx"], statsout, RES, climate, sink, options, LEVOL_FLAGS)
+        sink.step()
+        yeartimes.append(time.perf_counter() - start)
+    sink.close()
+    grass.run_command("g.remove", flags="f", type="raster", pattern="%s*" % options["prefx"], quiet=True)
+    return yeartimes
+
+
+def time_agropast(maps, size, tenuretype, years, workdir):
+    """
+    Time a number of years of r.agropast.adaptive with one tenure type. The
+    time of each year is the sum of the stages in its profile= timeline.
+    """
+    import grass.script as grass
+
+    prefx = "bench%s_%s_" % (size, tenuretype)
+    profile = os.path.join(workdir, "%sprofile.csv" % prefx)
+    rules = os.path.join(SCRIPTDIR, "rules")
+    command = [
+        sys.executable,
+        os.path.join(SCRIPTDIR, "r.agropast.adaptive"),
+        "years=%s" % years,
+        "prfx=%s" % prefx,
+        "tenuretype=%s" % tenuretype,
+        "elev=%s" % maps["elev"],
+        "initbdrk=%s" % maps["bdrk"],
+        "inlcov=%s" % maps["lcov"],
+        "infert=%s" % maps["fert"],
+        "agcatch=%s" % maps["agcatch"],
+        "grazecatch=%s" % maps["grazecatch"],
+        "costsurf=%s" % maps["cost"],
+        "fodder_rules=%s" % os.path.join(rules, "fodder_rules.txt"),
+        "lc_rules=%s" % os.path.join(rules, "luse_reclass_rules.txt"),
+        "cfact_rules=%s" % os.path.join(rules, "cfactor_recode_rules.txt"),
+        "profile=%s" % profile,
+        "--overwrite",
+        "--quiet",
+    ]
+    subprocess.check_call(command)
+    yeartimes = [0.0] * years
+    with open(profile) as f:
+        for row in csv.DictReader(f):
+            yeartimes[int(row["Year"]) - 1] += float(row["Wall Time (s)"])
+    grass.run_command("g.remove", flags="f", type="raster", pattern="%s*" % prefx, quiet=True)
+    return yeartimes
+
+
+def case(benchmark, variant, size, years, workdir):
+    """
+    Time one run, in this process, and save its year times and peak memory
+    use to the case.json file of the working directory. This is what each of
+    the fresh processes started by run_case() does.
+    """
+    maps = mapnames(size)
+    if benchmark == "landscapeEvol":
+        yeartimes = time_landscape(maps, size, variant, years, workdir)
+    else:
+        yeartimes = time_agropast(maps, size, variant, years, workdir)
+    usage = profiling.usage()
+    with open(os.path.join(workdir, "case.json"), "w") as f:
+        json.dump({"year_times": yeartimes, "peak_rss_mb": usage[3], "peak_child_rss_mb": usage[4]}, f)
+
+
+def run_case(benchmark, variant, size, years, workdir):
+    """
+    Time one run in a fresh Python process (see case()), so that the peak
+    memory use it reports is that of this run only.
+    """
+    command = [sys.executable, "-m", "mmllite.benchmark", "--case", "%s,%s,%s" % (benchmark, variant, size), "--years", str(years), "--workdir", workdir]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (SCRIPTDIR, os.getenv("PYTHONPATH")) if p))
+    subprocess.check_call(command, env=env)
+    with open(os.path.join(workdir, "case.json")) as f:
+        return json.load(f)
+
+
+def record(benchmark, variant, size, result, environment):
+    """Summarize the year times and resource use of one run (see run_case)."""
+    yeartimes = result["year_times"]
+    mean = sum(yeartimes) / len(yeartimes)
+    return dict(
+        environment,
+        benchmark=benchmark,
+        variant=variant,
+        size=size,
+        cells=size * size,
+        years=len(yeartimes),
+        year_times=yeartimes,
+        mean_year_time=mean,
+        cells_per_second=size * size / mean if mean > 0 else None,
+        peak_rss_mb=result["peak_rss_mb"],
+        peak_child_rss_mb=result["peak_child_rss_mb"],
+    )
+
+
+def environment():
+    """Details of the machine, GRASS version, and code version of a run."""
+    import grass.script as grass
+
+    try:
+        commit = subprocess.check_output(["git", "-C", SCRIPTDIR, "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "grass": grass.version().get("version"),
+        "commit": commit,
+    }
+
+
+def compare(results, baseline):
+    """Print the change in time per year of each run against a baseline file."""
+    with open(baseline) as f:
+        before = dict(((r["benchmark"], r["variant"], r["size"]), r) for r in json.load(f))
+    print("%-16s %-12s %6s %12s %12s %8s" % ("benchmark", "variant", "size", "before (s)", "after (s)", "ratio"))
+    for r in results:
+        old = before.get((r["benchmark"], r["variant"], r["size"]))
+        if old is None:
+            continue
+        print("%-16s %-12s %6s %12.3f %12.3f %8.2f" % (r["benchmark"], r["variant"], r["size"], old["mean_year_time"], r["mean_year_time"], r["mean_year_time"] / old["mean_year_time"]))
+
+
+def run(args):
+    """Build the landscapes and run the benchmarks inside a GRASS session."""
+    results = []
+    env = environment()
+    workdir = tempfile.mkdtemp(prefix="mmllite_benchmark")
+    for size in sorted(args.sizes):
+        print("Building %sx%s landscape..." % (size, size))
+        build_landscape(size)
+        for transp_eq in args.transp_eqs:
+            print("Timing landscapeEvol %s at %sx%s..." % (transp_eq, size, size))
+            results.append(record("landscapeEvol", transp_eq, size, run_case("landscapeEvol", transp_eq, size, args.years, workdir), env))
+        for tenuretype in args.tenuretypes:
+            print("Timing r.agropast.adaptive %s at %sx%s..." % (tenuretype, size, size))
+            results.append(record("r.agropast.adaptive", tenuretype, size, run_case("r.agropast.adaptive", tenuretype, size, args.years, workdir), env))
+    for r in results:
+        print("%-20s %-12s %5sx%-5s %8.3f s/year %12.0f cells/s %8.1f MB peak" % (r["benchmark"], r["variant"], r["size"], r["size"], r["mean_year_time"], r["cells_per_second"] or 0, max(r["peak_rss_mb"], r["peak_child_rss_mb"])))
+    # Append to earlier results, so that one file can hold a history of runs
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            history = json.load(f)
+    with open(args.output, "w") as f:
+        json.dump(history + results, f, indent=1)
+    print("Results saved to %s" % args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="256,1024,4096", type=lambda s: [int(v) for v in s.split(",")], help="Comma separated sizes (cells per side) of the synthetic landscapes")
+    parser.add_argument("--years", default=3, type=int, help="Number of years to time for each run")
+    parser.add_argument("--transp-eqs", default=",".join(TRANSP_EQS), type=lambda s: [v for v in s.split(",") if v], help="Transport equations to time landscapeEvol with (empty to skip)")
+    parser.add_argument("--tenuretypes", default=",".join(TENURETYPES), type=lambda s: [v for v in s.split(",") if v], help="Tenure types to time r.agropast.adaptive with (empty to skip)")
+    parser.add_argument("--output", default="mmllite_benchmark.json", help="JSON file to append the results to")
+    parser.add_argument("--compare", help="JSON file of earlier results to compare this run against")
+    # Used by run_case() to time one run in a fresh process
+    parser.add_argument("--case", type=lambda s: s.split(","), help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.case:
+        benchmark, variant, size = args.case
+        case(benchmark, variant, int(size), args.years, args.workdir)
+        return 0
+    args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    if not os.getenv("GISRC"):
+        # Not in a GRASS session, so start one in a temporary location
+        argv = sys.argv[1:] if argv is None else argv
+        command = ["grass", "--tmp-location", "XY", "--exec", sys.executable, "-m", "mmllite.benchmark"] + argv + ["--output", args.output]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (SCRIPTDIR, os.getenv("PYTHONPATH")) if p))
+        try:
+            return subprocess.call(command, env=env)
+        except OSError:
+            parser.error("not in a GRASS session, and the grass executable was not found to start one")
+    run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
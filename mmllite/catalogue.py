@@ -0,0 +1,260 @@
+"""
+Persistent index of the output maps of many simulation runs.
+
+Replicate runs are usually made in their own mapsets, and the follow up
+scripts used to find their maps with g.list patterns, and then pick the year
+and replicate out of the map names with split() and strip(). Here, the mapset
+directories of a location are scanned straight from the file system, and
+every output map whose name matches one of the naming schemes of the scripts
+is recorded in a SQLite database in the location directory, with its prefix,
+replicate (mapset), year, variable, file path, region, and a checksum of its
+data. Scans are incremental: maps whose data files have not changed since the
+last scan are not read again. Queries like "Elevation of every replicate in
+year 300" are then answered from the index.
+
+    python3 -m mmllite.catalogue --gisdbase ~/grassdata --location Spain scan
+    python3 -m mmllite.catalogue --gisdbase ~/grassdata --location Spain query --variable Elevation --year 300
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+
+# Name of the index database, in the location directory
+DBNAME = "mmllite_catalogue.sqlite"
+
+# Output variables of the scripts, and other names they are written under
+VARIABLES = (
+    "Elevation",
+    "Soil_Depth",
+    "Landcover",
+    "Soil_Fertilty",
+    "Farming_Impacts",
+    "Gazing_Impacts",
+    "Cfactor",
+    "Rainfall_Excess",
+    "Tenured_Fields",
+    "Natural_Fires",
+    "ED_rate",
+    "slope",
+)
+ALIASES = {"soildepth": "Soil_Depth", "rainfall_excess_map": "Rainfall_Excess"}
+_CANONICAL = dict((v.lower(), v) for v in VARIABLES)
+
+# Map naming schemes of the scripts, tried in order:
+# PREFIX_Year_300_Landcover_Map (legacy agropast scripts, with the year
+#     zero padded to the number of digits of the run, between "Year_" and "_")
+# PREFIX0300_Landcover (r.agropast.adaptive, with the year as %04d)
+# PREFIXLandcover_Map0300, PREFIXelevation0300 (r.landscape.evol, older
+#     scripts, with the year as %04d at the end of the name)
+# The year of the second scheme is taken as its last four digits, as prefixes
+# can end in digits too (e.g. sim120003_Landcover is year 3 of sim12). Years
+# of more digits than that (runs of over 9999 years) are found with the
+# prefixes that are already known (see parsename).
+_VARIABLE = "(?P<variable>%s)" % "|".join(sorted(set(VARIABLES) | set(ALIASES), key=len, reverse=True))
+SCHEMES = [
+    re.compile(r"^(?P<prefix>.*?)_?Year_(?P<year>\d+)_%s(?:_map)?$" % _VARIABLE, re.I),
+    re.compile(r"^(?P<prefix>.*)(?P<year>\d{4})_%s(?:_map)?$" % _VARIABLE, re.I),
+    re.compile(r"^(?P<prefix>.*?)%s(?:_map)?_?(?P<year>\d{4,})$" % _VARIABLE, re.I),
+]
+
+COLUMNS = ["name", "mapset", "prefix", "year", "variable", "path", "north", "south", "east", "west", "rows", "cols", "nsres", "ewres", "size", "mtime", "checksum"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS maps (
+    name TEXT, mapset TEXT, prefix TEXT, year INTEGER, variable TEXT, path TEXT,
+    north REAL, south REAL, east REAL, west REAL, rows INTEGER, cols INTEGER, nsres REAL, ewres REAL,
+    size INTEGER, mtime INTEGER, checksum TEXT,
+    PRIMARY KEY (mapset, name)
+);
+CREATE INDEX IF NOT EXISTS maps_variable_year ON maps (variable, year);
+CREATE INDEX IF NOT EXISTS maps_prefix ON maps (prefix);
+"""
+
+
+def parsename(name, prefixes=()):
+    """
+    Find the prefix, year, and variable of an output map from its name.
+    Returns None if the name does not match any of the naming schemes.
+    prefixes = known prefixes of runs. When the last four digits of the year
+        leave a prefix that ends in digits, and one of these (the longest)
+        leaves only digits in between, the year is all of those digits (e.g.
+        sim_12000_Landcover is year 12000 of sim_ if sim_ is known, rather
+        than year 2000 of sim_1).
+    """
+    for scheme in SCHEMES:
+        match = scheme.match(name)
+        if match:
+            variable = match.group("variable").lower()
+            variable = ALIASES.get(variable, _CANONICAL.get(variable))
+            prefix, year = match.group("prefix"), match.group("year")
+            if scheme is SCHEMES[1] and prefix[-1:].isdigit():
+                for known in sorted(prefixes, key=len, reverse=True):
+                    digits = prefix[len(known):]
+                    if len(known) < len(prefix) and prefix.startswith(known) and digits.isdigit() and not digits.startswith("0"):
+                        prefix, year = known, digits + year
+                        break
+            return prefix, int(year), variable
+    return None
+
+
+def readheader(path):
+    """
+    Read the region of a raster map from its cellhd file. Returns north,
+    south, east, west, rows, cols, nsres, ewres (all None for reclass maps).
+    """
+    header = {}
+    with open(path) as f:
+        for line in f:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                header[key.strip()] = value.strip()
+    try:
+        n, s, e, w = (float(header[key]) for key in ("north", "south", "east", "west"))
+        rows, cols = int(header["rows"]), int(header["cols"])
+    except (KeyError, ValueError):
+        return [None] * 8
+    return [n, s, e, w, rows, cols, (n - s) / rows, (e - w) / cols]
+
+
+def checksum(path):
+    """SHA-1 checksum of a file, read in blocks."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Catalogue(object):
+    """
+    Index of the output maps in the mapsets of a location.
+    gisdbase = path of the GRASS database
+    location = name of the location
+    dbpath = path of the index database (defaults to DBNAME in the location)
+    """
+
+    def __init__(self, gisdbase, location, dbpath=None):
+        self.locationpath = os.path.join(gisdbase, location)
+        self.dbpath = dbpath or os.path.join(self.locationpath, DBNAME)
+        self.db = sqlite3.connect(self.dbpath)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, mapsets=None, checksums=True):
+        """
+        Update the index from the mapset directories, re-reading only the maps
+        whose data files are new or have changed, and dropping maps that are
+        gone. Returns the number of maps that were (re)indexed.
+        mapsets = names of the mapsets to scan (defaults to all of them)
+        checksums = compute checksums of the data files of new or changed maps
+        """
+        if mapsets is None:
+            mapsets = sorted(m for m in os.listdir(self.locationpath) if os.path.isdir(os.path.join(self.locationpath, m, "cellhd")))
+        known = dict(((row["mapset"], row["name"]), (row["size"], row["mtime"])) for row in self.db.execute("SELECT mapset, name, size, mtime FROM maps"))
+        names = {}
+        for mapset in mapsets:
+            if os.path.isdir(os.path.join(self.locationpath, mapset, "cellhd")):
+                names[mapset] = os.listdir(os.path.join(self.locationpath, mapset, "cellhd"))
+        # Prefixes that do not end in digits are never in doubt, and tell
+        # where the years of more than four digits start (see parsename)
+        prefixes = set(row[0] for row in self.db.execute("SELECT DISTINCT prefix FROM maps") if row[0] and not row[0][-1:].isdigit())
+        for mapset in names:
+            for name in names[mapset]:
+                parsed = parsename(name)
+                if parsed is not None and not parsed[0][-1:].isdigit():
+                    prefixes.add(parsed[0])
+        seen = set()
+        updates = []
+        for mapset in names:
+            mapsetpath = os.path.join(self.locationpath, mapset)
+            cellhd = os.path.join(mapsetpath, "cellhd")
+            for name in names[mapset]:
+                parsed = parsename(name, prefixes)
+                if parsed is None:
+                    continue
+                seen.add((mapset, name))
+                # Floating point maps keep their data in fcell, integer maps in cell
+                path = os.path.join(mapsetpath, "fcell", name)
+                if not os.path.exists(path):
+                    path = os.path.join(mapsetpath, "cell", name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if known.get((mapset, name)) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                region = readheader(os.path.join(cellhd, name))
+                digest = checksum(path) if checksums else None
+                updates.append([name, mapset] + list(parsed) + [path] + region + [stat.st_size, stat.st_mtime_ns, digest])
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO maps (%s) VALUES (%s)" % (",".join(COLUMNS), ",".join("?" * len(COLUMNS))), updates)
+            gone = [key for key in known if key[0] in mapsets and key not in seen]
+            self.db.executemany("DELETE FROM maps WHERE mapset = ? AND name = ?", gone)
+        return len(updates)
+
+    def query(self, variable=None, year=None, prefix=None, replicate=None):
+        """
+        Find maps in the index. Any of the arguments can be left out to match
+        all values. Returns a list of rows (that can be used as dictionaries),
+        ordered by prefix, replicate, and year.
+        variable = output variable (e.g. "Elevation")
+        year = simulation year
+        prefix = prefix of the run
+        replicate = mapset of the run
+        """
+        where, args = [], []
+        for column, value in (("variable", variable), ("year", year), ("prefix", prefix), ("mapset", replicate)):
+            if value is not None:
+                where.append("%s = ?" % column)
+                args.append(value)
+        sql = "SELECT * FROM maps"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self.db.execute(sql + " ORDER BY prefix, mapset, year", args).fetchall()
+
+    def names(self, **kwargs):
+        """Full names (name@mapset) of the maps found by query()."""
+        return ["%s@%s" % (row["name"], row["mapset"]) for row in self.query(**kwargs)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gisdbase", help="Path of the GRASS database (defaults to the current GRASS session)")
+    parser.add_argument("--location", help="Name of the location (defaults to the current GRASS session)")
+    parser.add_argument("--db", help="Path of the index database (defaults to %s in the location)" % DBNAME)
+    commands = parser.add_subparsers(dest="command")
+    scan = commands.add_parser("scan", help="Update the index")
+    scan.add_argument("--mapsets", type=lambda s: s.split(","), help="Comma separated mapsets to scan (defaults to all)")
+    scan.add_argument("--no-checksums", action="store_true", help="Do not compute checksums")
+    query = commands.add_parser("query", help="List indexed maps as name@mapset")
+    query.add_argument("--variable")
+    query.add_argument("--year", type=int)
+    query.add_argument("--prefix")
+    query.add_argument("--replicate")
+    args = parser.parse_args(argv)
+    if not args.gisdbase or not args.location:
+        import grass.script as grass
+
+        env = grass.gisenv()
+        args.gisdbase = args.gisdbase or env["GISDBASE"]
+        args.location = args.location or env["LOCATION_NAME"]
+    catalogue = Catalogue(args.gisdbase, args.location, args.db)
+    if args.command == "scan":
+        print("%s maps indexed" % catalogue.scan(args.mapsets, not args.no_checksums))
+    elif args.command == "query":
+        print("\n".join(catalogue.names(variable=args.variable, year=args.year, prefix=args.prefix, replicate=args.replicate)))
+    else:
+        parser.print_help()
+    catalogue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
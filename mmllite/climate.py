@@ -0,0 +1,129 @@
+"""
+Stochastic yearly climate for long simulation runs.
+
+Instead of a hand-built climate file with one row per year, the values of
+"R,rain,stormlength,storms,stormi" for a whole run are drawn at startup in one
+call. Each variable follows a lognormal distribution with a given long-term
+mean and coefficient of variation, with an optional linear trend in the mean
+and optional AR(1) persistence of the yearly anomalies. The same seed always
+gives back the same series, so every member of an ensemble can get its own
+reproducible climate stream without writing climate files to disk.
+"""
+
+import numpy as np
+
+# Column order of the climate file, as read by climfile() in the scripts
+CLIMVARS = ("r", "rain", "stormlength", "storms", "stormi")
+
+
+def generate(years, means, cv, trend=0.0, ar1=0.0, seed=None):
+    """
+    Draw an array of yearly climate values with one row per year and one
+    column per variable in CLIMVARS.
+    years = number of years of the simulation
+    means = long-term means of the variables at the start of the run
+    cv = coefficients of variation of the variables (0 keeps a variable constant)
+    trend = linear change in the means, as a proportion of the starting mean per year
+    ar1 = lag-one autocorrelation of the yearly anomalies (0 <= ar1 < 1)
+    seed = seed for the random number generator (None draws a fresh one)
+    """
+    years = int(years)
+    shape = (len(CLIMVARS),)
+    means = np.broadcast_to(np.asarray(means, dtype=float), shape)
+    cv = np.broadcast_to(np.asarray(cv, dtype=float), shape)
+    trend = np.broadcast_to(np.asarray(trend, dtype=float), shape)
+    ar1 = float(ar1)
+    if not 0.0 <= ar1 < 1.0:
+        raise ValueError("AR(1) coefficient must be between 0 and 1, got %s" % ar1)
+    if (cv < 0).any():
+        raise ValueError("Coefficients of variation cannot be negative")
+    rng = np.random.default_rng(seed)
+    # Standard normal anomalies with AR(1) persistence. The innovations are
+    # scaled so the series is stationary with unit variance from the first
+    # year on. The recursion only runs along the year axis, all variables are
+    # updated together.
+    z = rng.standard_normal((years, len(CLIMVARS)))
+    if ar1 > 0:
+        scale = np.sqrt(1.0 - ar1 ** 2)
+        for t in range(1, years):
+            z[t] = ar1 * z[t - 1] + scale * z[t]
+    # Lognormal marginals with the requested mean and coefficient of variation
+    sigma = np.sqrt(np.log1p(cv ** 2))
+    level = means * (1.0 + trend * np.arange(years)[:, np.newaxis])
+    clim = np.clip(level, 0, None) * np.exp(sigma * z - 0.5 * sigma ** 2)
+    # Storms are counted in whole events, and stormi is a proportion of the storm
+    clim[:, 3] = np.rint(clim[:, 3])
+    clim[:, 4] = np.clip(clim[:, 4], 0, 1)
+    return clim
+
+
+def fit(table):
+    """
+    Estimate the parameters of generate() from an observed climate table
+    (one row per year, columns in the order of CLIMVARS). Returns the fitted
+    starting means, coefficients of variation, and trends of each column, and
+    a single AR(1) coefficient pooled over the columns that vary.
+    """
+    table = np.atleast_2d(np.asarray(table, dtype=float))
+    n = table.shape[0]
+    t = np.arange(n, dtype=float)
+    if n > 2:
+        slope, start = np.polyfit(t, table, 1)
+    else:
+        slope, start = np.zeros(table.shape[1]), table.mean(axis=0)
+    level = start + slope * t[:, np.newaxis]
+    resid = table - level
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trend = np.where(start > 0, slope / start, 0.0)
+        cv = np.where(level.mean(axis=0) > 0, resid.std(axis=0, ddof=min(1, n - 1)) / level.mean(axis=0), 0.0)
+    # Ignore floating point noise left over from fitting a perfectly linear column
+    varies = cv > 1e-9
+    cv = np.where(varies, cv, 0.0)
+    if n > 2 and varies.any():
+        r = resid[:, varies]
+        ar1 = float(np.mean((r[1:] * r[:-1]).sum(axis=0) / (r ** 2).sum(axis=0)))
+    else:
+        ar1 = 0.0
+    return start, cv, trend, min(max(ar1, 0.0), 0.99)
+
+
+def read_table(path):
+    """
+    Read a climate file into an array with one row per year, dropping a text
+    header if there is one.
+    """
+    table = np.atleast_2d(np.genfromtxt(path, delimiter=",", dtype=float))
+    return table[~np.isnan(table).all(axis=1)]
+
+
+def from_options(options, years):
+    """
+    Draw the yearly climate from the standard climate options of the scripts
+    (r, rain, stormlength, storms, stormi, climfile, climcv, climtrend, climar,
+    and climseed). The constant climate values are used as long-term means.
+    If a climate file is given, the means, variability, trends, and
+    persistence of the columns it has are fitted from it instead, so a short
+    observed record can drive a run of any length. Returns the list of yearly
+    values for each variable in CLIMVARS, and the seed that was used.
+    """
+    try:
+        means = np.array([float(options[key]) for key in CLIMVARS])
+    except ValueError:
+        raise ValueError("The stochastic climate needs constant values for %s, not maps" % ",".join(CLIMVARS))
+    cv = np.array(list(map(float, options["climcv"].split(","))))
+    trend = np.array(list(map(float, options["climtrend"].split(","))))
+    if cv.size not in (1, len(CLIMVARS)) or trend.size not in (1, len(CLIMVARS)):
+        raise ValueError("Enter either one value, or one value for each of %s" % ",".join(CLIMVARS))
+    cv = np.broadcast_to(cv, means.shape).copy()
+    trend = np.broadcast_to(trend, means.shape).copy()
+    ar1 = float(options["climar"])
+    if options["climfile"]:
+        table = read_table(options["climfile"])[:, : len(CLIMVARS)]
+        ncols = table.shape[1]
+        means[:ncols], cv[:ncols], trend[:ncols], ar1 = fit(table)
+    if options["climseed"]:
+        seed = int(options["climseed"])
+    else:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    clim = generate(years, means, cv, trend, ar1, seed)
+    return [col.tolist() for col in clim.T], seed
@@ -0,0 +1,137 @@
+"""
+Ensemble statistics over many replicate runs of a simulation.
+
+accumulate() gathers columns of the stats text files of many replicate runs
+into one (runs x years x columns) array, reading each file only once.
+
+semcurves() gives the cumulative standard error curve of an ensemble: the
+summed standard error of the mean of every year when only the first 1, 2, ...
+n runs are used. It is used to judge how many replicates are needed before
+adding more no longer changes the result. The curve depends on the order of
+the runs, so it is bootstrapped over random permutations of that order.
+converged() tells whether such a curve has levelled off, so that an ensemble
+can stop adding replicates (see runner).
+"""
+
+import fnmatch
+import functools
+import multiprocessing
+import os
+
+import numpy as np
+
+
+def _semcurve(stack):
+    """
+    Cumulative standard error curves of a (permutations x runs x years) stack,
+    from running sums and sums of squares along the run axis.
+    """
+    n = stack.shape[1]
+    k = np.arange(1, n + 1, dtype=float)[:, np.newaxis]
+    sums = np.cumsum(stack, axis=1)
+    sumsq = np.cumsum(stack * stack, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var = (sumsq - sums * sums / k) / (k - 1)
+        sem = np.sqrt(np.clip(var, 0, None) / k)
+    # A single run has no standard error (as with scipy.stats.sem)
+    sem[:, 0] = np.nan
+    return sem.sum(axis=2)
+
+
+def semcurves(data, permutations=None, chunk=None, seed=None):
+    """
+    Cumulative standard error curves of an ensemble, in its original run order
+    and in a number of random orders. Returns an array with one row per curve
+    (the first one is the original order), and one column per number of runs.
+    Each value is the sum over years of scipy.stats.sem() of that many runs.
+    data = array with one row per run and one column per year
+    permutations = number of random orders (defaults to the number of runs)
+    chunk = number of random orders to compute at once, to bound memory use
+        to about 3 * chunk * runs * years values (defaults to all of them)
+    seed = seed for the random orders (None draws a fresh one)
+    """
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    n = data.shape[0]
+    if permutations is None:
+        permutations = n
+    chunk = permutations if not chunk else int(chunk)
+    # The standard error does not depend on the mean, so center the columns
+    # first to keep the sums of squares from losing precision
+    data = data - np.nanmean(data, axis=0) if n else data
+    rng = np.random.default_rng(seed)
+    curves = [_semcurve(data[np.newaxis])]
+    for start in range(0, permutations, max(chunk, 1)):
+        size = min(chunk, permutations - start)
+        order = np.argsort(rng.random((size, n)), axis=1)
+        curves.append(_semcurve(data[order]))
+    return np.concatenate(curves)
+
+
+def converged(curve, tolerance, window=5):
+    """
+    Check whether a cumulative standard error curve (see semcurves) has
+    levelled off: whether the last window runs each changed the summed
+    standard error by less than tolerance (as a proportion of its current
+    value), on average. Returns the decision and that average reduction (NaN until there
+    are more than window runs).
+    """
+    curve = np.asarray(curve, dtype=float)
+    if len(curve) <= window or not np.isfinite(curve[-1 - window :]).all() or curve[-1] <= 0:
+        return False, float("nan")
+    reduction = (curve[-1 - window] - curve[-1]) / (window * curve[-1])
+    return bool(abs(reduction) < tolerance), float(reduction)
+
+
+def find(basepath, pattern):
+    """
+    Recursively search through a base directory and all subdirectories for
+    files whose names match the given pattern, and return their paths.
+    """
+    matches = []
+    for root, dirnames, filenames in os.walk(basepath):
+        for filename in fnmatch.filter(filenames, pattern):
+            matches.append(os.path.join(root, filename))
+    return matches
+
+
+def _read(path, columns, skip_header):
+    """Read the given columns of one stats text file as a (years x columns) array."""
+    data = np.genfromtxt(path, dtype=float, delimiter=",", skip_header=skip_header, usecols=columns)
+    return data.reshape(-1, len(columns))
+
+
+def accumulate(paths, columns, skip_header=0, processes=None):
+    """
+    Read the given columns of the stats text files of many runs, parsing each
+    file only once, in parallel worker processes. Returns an array with one
+    row per run (in the order of paths), one row per year, and one layer per
+    column. Runs with fewer years than the longest one (e.g. when everybody
+    died) are padded with NaN.
+    paths = paths of the stats files, one per run
+    columns = numbers of the columns to read
+    skip_header = number of header lines to skip in each file
+    processes = number of worker processes (defaults to the number of CPUs,
+        1 reads the files in this process)
+    """
+    columns = tuple(columns)
+    read = functools.partial(_read, columns=columns, skip_header=skip_header)
+    pool = multiprocessing.Pool(processes) if processes != 1 and len(paths) > 1 else None
+    try:
+        results = pool.imap(read, paths, chunksize=max(1, len(paths) // 64)) if pool else map(read, paths)
+        all_data = None
+        for run, data in enumerate(results):
+            if all_data is None:
+                all_data = np.full((len(paths), len(data), len(columns)), np.nan)
+            elif len(data) > all_data.shape[1]:
+                pad = np.full((len(paths), len(data) - all_data.shape[1], len(columns)), np.nan)
+                all_data = np.concatenate((all_data, pad), axis=1)
+            all_data[run, : len(data)] = data
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if all_data is None:
+        return np.zeros((0, 0, len(columns)))
+    return all_data
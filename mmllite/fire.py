@@ -0,0 +1,240 @@
+"""
+Natural (lightning-caused) fires.
+
+The fire scripts used to split the fire probability map into low, medium, and
+high probability strata with three r.mapcalc calls every year, draw a share
+of the cells of each stratum with r.random, and r.patch the draws together
+into that year's map of fires. The fire probability map does not change, so
+here the cells of each stratum are found once per run, and kept as arrays of
+flat cell indices. Each year's ignitions are then one random draw of cell
+positions per stratum, and only the final map of fires is written.
+
+FireBatch runs many replicates of the same landscape at once, for studies of
+fire regimes, where only the random ignitions differ between runs. The
+landcover of all the replicates is kept as one (replicates, rows, cols) array,
+and regrowth, fires, rainfall excess, and c-factors are worked out for all of
+them together.
+
+Fires can also spread from their ignitions (spread()). The time at which fire
+reaches each cell is found as the shortest travel time from any ignition
+(Dijkstra's algorithm), where the rate of spread into a cell depends on its
+landcover (fuel) and on the slope up or down to it. Cells are taken off a
+priority queue in order of arrival time, until the burn time runs out, so
+only the burned cells and the cells around them are ever looked at, however
+large the map.
+"""
+
+import heapq
+import math
+
+import numpy as np
+
+from grass.script import array as garray
+
+from mmllite import landcover
+
+# Fire probability strata: (lowest probability (exclusive), highest
+# probability (inclusive), share of the cells of the stratum that ignite each
+# year). The cutoffs are from the histogram of the Spanish fire probability map.
+STRATA = [
+    (None, 0.2, 0.05),
+    (0.2, 0.6, 0.10),
+    (0.6, None, 0.15),
+]
+
+# Rates of spread of fire on flat ground (m/min) through each landcover class,
+# as (lowest landcover value of the class, rate). The classes are those of the
+# c-factor rules: bare land and sparse grass do not carry fire, grassland
+# burns fastest, and woodland slowest.
+FUELS = [
+    (0, 0.0),
+    (3, 20.0),
+    (8, 12.0),
+    (13, 8.0),
+    (19, 5.0),
+    (38, 2.0),
+]
+
+# Increase of the rate of spread per degree of upslope (it doubles about every
+# 10 degrees), and the same decrease downslope
+SLOPE_FACTOR = 0.069
+
+
+class FireStrata(object):
+    """
+    Cells of each fire probability stratum of a map, for drawing ignitions.
+    fireprob = array of fire probabilities (0-1, NaN for null cells)
+    strata = list of (lowest, highest, share) tuples, as in STRATA
+    seed = seed for the random draws (a new random seed if None)
+    """
+
+    def __init__(self, fireprob, strata=STRATA, seed=None):
+        fireprob = np.asarray(fireprob, dtype=float)
+        self.shape = fireprob.shape
+        flat = fireprob.ravel()
+        self.cells = []
+        self.counts = []
+        for lo, hi, share in strata:
+            inside = ~np.isnan(flat)
+            if lo is not None:
+                inside &= flat > lo
+            if hi is not None:
+                inside &= flat <= hi
+            cells = np.flatnonzero(inside)
+            self.cells.append(cells)
+            # As r.random does with a percentage of the cells
+            self.counts.append(int(round(share * len(cells))))
+        self.rng = np.random.default_rng(seed)
+
+    def ignitions(self, rng=None):
+        """
+        Flat indices of one year's ignition cells, drawn without replacement
+        within each stratum (with the random generator of the strata, unless
+        another is given).
+        """
+        rng = rng or self.rng
+        draws = [cells[rng.choice(len(cells), count, replace=False)] for cells, count in zip(self.cells, self.counts) if count]
+        if not draws:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(draws))
+
+    def mask(self, cells=None):
+        """Boolean array of the ignition cells (a new draw if none are given)."""
+        out = np.zeros(self.shape, dtype=bool)
+        out.ravel()[self.ignitions() if cells is None else cells] = True
+        return out
+
+
+def fuelrates(lcov, fuels=FUELS):
+    """
+    Rate of spread of fire on flat ground (m/min) through every cell of a
+    landcover array, from the classes of fuels (0 for null cells).
+    """
+    lcov = np.asarray(lcov, dtype=float)
+    bounds = np.array([lo for lo, rate in fuels], dtype=float)
+    rates = np.array([0.0] + [rate for lo, rate in fuels])
+    # Values below the lowest class, and null cells, get a rate of 0
+    index = np.searchsorted(bounds, np.nan_to_num(lcov, nan=-np.inf), side="right")
+    return rates[index]
+
+
+def spread(ignitions, rates, elev, res, burntime):
+    """
+    Spread fires from their ignition cells for a burn time. Fire moves between
+    neighbouring cells (including diagonals) at the rate of the cell it moves
+    into, sped up going upslope and slowed down going downslope. Cells with a
+    rate of 0 do not burn (but ignition cells always do).
+    ignitions = flat indices of the ignition cells
+    rates = array of rates of spread on flat ground (m/min, see fuelrates)
+    elev = array of elevations (m), or None for flat ground
+    res = (north-south, east-west) cell size (m)
+    burntime = minutes that fires spread for before they go out
+    Returns the flat indices of the burned cells, and their arrival times (min).
+    """
+    rows, cols = np.shape(rates)
+    flatrates = np.asarray(rates, dtype=float).ravel()
+    flatelev = None if elev is None else np.asarray(elev, dtype=float).ravel()
+    nsres, ewres = float(res[0]), float(res[1])
+    steps = []
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            if dr or dc:
+                steps.append((dr, dc, dr * cols + dc, math.hypot(dr * nsres, dc * ewres)))
+    # Arrival times of the cells reached so far, only for the cells on or behind the front
+    times = dict((int(cell), 0.0) for cell in ignitions)
+    heap = [(0.0, cell) for cell in times]
+    heapq.heapify(heap)
+    burned = {}
+    while heap:
+        t, cell = heapq.heappop(heap)
+        if cell in burned or t > times[cell]:
+            continue
+        burned[cell] = t
+        r, c = divmod(cell, cols)
+        for dr, dc, offset, dist in steps:
+            if not (0 <= r + dr < rows and 0 <= c + dc < cols):
+                continue
+            nbr = cell + offset
+            if nbr in burned:
+                continue
+            rate = flatrates[nbr]
+            if not rate > 0:
+                continue
+            if flatelev is not None:
+                dz = flatelev[nbr] - flatelev[cell]
+                if dz != dz:
+                    continue
+                rate *= math.exp(SLOPE_FACTOR * math.degrees(math.atan2(dz, dist)))
+            arrival = t + dist / rate
+            if arrival <= burntime and arrival < times.get(nbr, math.inf):
+                times[nbr] = arrival
+                heapq.heappush(heap, (arrival, nbr))
+    cells = np.fromiter(burned.keys(), dtype=np.int64, count=len(burned))
+    arrivals = np.fromiter(burned.values(), dtype=float, count=len(burned))
+    return cells, arrivals
+
+
+class FireBatch(object):
+    """
+    Landcover of a batch of replicates of a landscape, that only differ in
+    their random fires, advanced a year at a time in lockstep.
+    lcov = array of the initial landcover (the same for every replicate)
+    fert = array (or number) of soil fertility
+    maxlcov = array (or number) of the maximum landcover
+    strata = FireStrata of the fire probability map
+    replicates = number of replicates
+    seed = seed for the ignitions (each replicate gets its own random stream)
+    reclass = rules.Reclass of the landcover labels, to reclass the landcover
+        with every year (as the scripts do with r.reclass), or None
+    """
+
+    def __init__(self, lcov, fert, maxlcov, strata, replicates, seed=None, reclass=None):
+        self.lcov = np.repeat(np.asarray(lcov, dtype=float)[np.newaxis], replicates, axis=0)
+        self.fert = fert
+        self.maxlcov = maxlcov
+        self.strata = strata
+        self.reclass = reclass
+        self.excesstable = landcover.excesstable(np.nanmax(maxlcov))
+        self.rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(replicates)]
+
+    def __len__(self):
+        return len(self.lcov)
+
+    def fires(self, elev=None, res=None, burntime=0):
+        """
+        Draw this year's fires of every replicate, spread through last year's
+        landcover if a burn time is given (see spread). Returns a boolean
+        array of burned cells, with one layer per replicate.
+        elev = array of the elevations of each replicate, or None for flat ground
+        """
+        burned = np.zeros(self.lcov.shape, dtype=bool)
+        for i, rng in enumerate(self.rngs):
+            cells = self.strata.ignitions(rng)
+            if burntime > 0:
+                cells, arrivals = spread(cells, fuelrates(self.lcov[i]), None if elev is None else elev[i], res, burntime)
+            burned[i].ravel()[cells] = True
+        return burned
+
+    def step(self, sdepth, precip, burned):
+        """
+        Regrow the landcover of every replicate, and burn the burned cells.
+        Returns the rainfall excess of the new landcover.
+        sdepth = array of last year's soil depths of each replicate
+        precip = total precipitation of the year (m)
+        burned = boolean array of burned cells of each replicate (see fires)
+        """
+        grown = self.lcov + landcover.growthrate(sdepth, precip, self.fert)
+        lcov = np.where(grown >= self.maxlcov, self.maxlcov, grown)
+        lcov[burned] = 0
+        excess = landcover.rainfallexcess(lcov, self.excesstable)
+        if self.reclass is not None:
+            lcov = self.reclass(lcov)
+        self.lcov = lcov
+        return excess
+
+
+def writefires(mapname, mask):
+    """Write a map of fires, with 1 for burned cells and null elsewhere (as r.random makes)."""
+    out = garray.array(dtype=np.int32)
+    out[...] = mask
+    out.write(mapname=mapname, null=0, overwrite=True)
@@ -0,0 +1,184 @@
+"""
+Population, labour, herds, and yield memory of many households at once.
+
+The agropast scripts model one village as a single number of people, with
+babymaker() and deathdealer() drawing one Poisson rate a year for all of it,
+and the agent's memory of yields as Python lists. Households keeps the same
+state for any number of agents (households, or whole villages, e.g. one per
+catchment) as arrays with one entry per agent, and makes each year's births,
+deaths, and memories for all of them with one random draw per quantity. A
+thousand agents cost about the same per year as one.
+
+The yearly rules are those of the scripts:
+
+- the demands of an agent follow from its population: a_p_ratio of the people
+  are pastoralists, each with a herd of animals, the rest farm, and the
+  cereal and fodder requirements and the labour are per person (or animal)
+- births and deaths are a Poisson rate draw (of rate * 100, divided by 100)
+  times the population, truncated to whole people, as in babymaker() and
+  deathdealer(). Agents that fed less than starvthresh of their people have
+  no births that year. Set perperson=True to draw every person's birth or
+  death instead (a binomial draw, as the old per-person loop did)
+- each year's surplus or deficit and mean yield are remembered with a
+  gaussian fuzz of sigma 0.0333 of the value, and agents recall the mean of
+  the last memory years
+
+Memories are kept in Memory ring buffers of memory years, with a running sum,
+so remembering and recalling cost the same every year of a run, however long.
+The scripts keep the memory of their single village in them too.
+"""
+
+import numpy as np
+
+# Relative sigma of the gaussian fuzz of remembered values (+-10% at 3 sigma)
+FUZZ = 0.0333
+
+# Remembered quantities, in the order of the memory array
+MEMORIES = ("farming", "farm yield", "grazing", "graze yield")
+
+
+class Memory(object):
+    """
+    The last size values of something that agents remember, in a ring buffer
+    with a running sum of the values.
+    size = number of values remembered (as agentmem=)
+    shape = shape of the values (() for a single agent, (n,) for n agents)
+    """
+
+    def __init__(self, size, shape=()):
+        self.size = max(int(size), 1)
+        self.values = np.zeros((self.size,) + tuple(shape))
+        self.total = np.zeros(shape)
+        self.count = 0
+        self._next = 0
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "Memory(%s of %s years, mean %s)" % (self.count, self.size, self.mean())
+
+    def append(self, value):
+        """Remember a value (or an array of the values of all agents), forgetting the oldest one."""
+        value = np.asarray(value, dtype=float)
+        self.total = self.total - self.values[self._next] + value
+        self.values[self._next] = value
+        self._next = (self._next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        # The sum is worked out afresh once per turn of the ring (and while it
+        # holds NaNs), so that rounding errors do not build up over long runs
+        if self._next == 0 or not np.isfinite(self.total).all():
+            self.total = self.values[: self.count].sum(axis=0)
+
+    def mean(self):
+        """Mean of the remembered values (NaN before anything is remembered)."""
+        if not self.count:
+            mean = np.full(self.total.shape, np.nan)
+        else:
+            mean = self.total / self.count
+        return float(mean) if mean.ndim == 0 else mean
+
+
+class Households(object):
+    """
+    Population and memory of a set of agents, as arrays.
+    people = array (or list) of the starting population of each agent
+    animals = herd animals per pastoralist
+    a_p_ratio = share of the people that are pastoralists (as a_p_ratio=)
+    cerealreq = cereal required per person per year (kg)
+    fodderreq = fodder required per animal per year (kg)
+    aglabor = labour available per person per year (person-days)
+    fieldlabor = labour needed per farm field per year (person-days)
+    memory = number of years that agents remember (as agentmem=)
+    seed = seed for the random draws (a new random seed if None)
+    perperson = draw births and deaths per person rather than as village rates
+    """
+
+    def __init__(self, people, animals, a_p_ratio, cerealreq, fodderreq, aglabor, fieldlabor, memory, seed=None, perperson=False):
+        self.people = np.array(people, dtype=float, ndmin=1)
+        self.animals = float(animals)
+        self.pratio = float(a_p_ratio)
+        self.agratio = 1 - self.pratio
+        self.indcerreq = float(cerealreq)
+        self.indfodreq = float(fodderreq)
+        self.aglabor = float(aglabor)
+        self.fieldlabor = float(fieldlabor)
+        self.memory = max(int(memory), 1)
+        self.perperson = perperson
+        self.rng = np.random.default_rng(seed)
+        # Remembered values of each agent, by the order of MEMORIES
+        self.memories = [Memory(self.memory, self.people.shape) for name in MEMORIES]
+
+    def __len__(self):
+        return len(self.people)
+
+    @property
+    def alive(self):
+        """Boolean array of the agents that have any people left."""
+        return self.people > 0
+
+    @property
+    def herds(self):
+        """Number of herd animals of each agent."""
+        return self.animals * self.people * self.pratio
+
+    @property
+    def cerealreq(self):
+        """Cereal required by each agent this year (kg)."""
+        return self.indcerreq * self.people * self.agratio
+
+    @property
+    def fodderreq(self):
+        """Fodder required by each agent this year (kg)."""
+        return self.indfodreq * self.herds
+
+    @property
+    def labor(self):
+        """Labour of each agent (person-days)."""
+        return self.people * self.aglabor
+
+    @property
+    def maxfields(self):
+        """Largest number of fields each agent can farm with its labour."""
+        return np.round(self.labor / self.fieldlabor).astype(int)
+
+    def fuzz(self, values):
+        """Values as they are remembered, with a gaussian fuzz of FUZZ of each value."""
+        values = np.broadcast_to(np.asarray(values, dtype=float), self.people.shape)
+        return values + self.rng.standard_normal(values.shape) * (values * FUZZ)
+
+    def remember(self, farming, farmyield, grazing, grazeyield):
+        """
+        Remember this year's cereal surplus or deficit, mean field yield,
+        fodder surplus or deficit, and mean grazing patch yield of each agent
+        (arrays, or numbers for all agents), with fuzz.
+        """
+        for memory, values in zip(self.memories, (farming, farmyield, grazing, grazeyield)):
+            memory.append(self.fuzz(values))
+
+    def recall(self, name):
+        """
+        Mean of the remembered values of one of MEMORIES over the last memory
+        years, for each agent (NaN before anything is remembered).
+        """
+        return self.memories[MEMORIES.index(name)].mean()
+
+    def _draw(self, rate, people):
+        if self.perperson:
+            return self.rng.binomial(people.astype(np.int64), rate).astype(float)
+        return np.trunc((self.rng.poisson(rate * 100, people.shape) / 100.0) * people)
+
+    def demography(self, peoplefed, starvthresh, birthrate, deathrate):
+        """
+        Births and deaths of the year. Agents that fed less than starvthresh
+        of their people have deaths only. Populations do not go below 0.
+        peoplefed = array of the number of people each agent could feed
+        Returns the arrays of births and deaths of each agent.
+        """
+        people = self.people
+        with np.errstate(divide="ignore", invalid="ignore"):
+            starved = np.asarray(peoplefed, dtype=float) / people < starvthresh
+        births = np.where(starved, 0.0, self._draw(birthrate, people))
+        deaths = np.minimum(self._draw(deathrate, people), people + births)
+        self.people = people + births - deaths
+        return births, deaths
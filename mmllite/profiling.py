@@ -0,0 +1,91 @@
+"""
+Per-stage timing and resource use of the yearly loops.
+
+The loops mark the start of each named stage with Profiler.mark(), which also
+ends the stage before it, so no code has to be re-indented to be timed. For
+each year and stage, the profiler records wall time, CPU time of the script
+itself, CPU time of the GRASS modules it ran (child processes), and the peak
+resident memory of the script and of the largest child process so far. The
+timeline is written as CSV, or as JSON if the output name ends with ".json".
+"""
+
+import atexit
+import json
+import resource
+import sys
+import time
+
+COLUMNS = ["Year", "Stage", "Wall Time (s)", "CPU Time (s)", "Child CPU Time (s)", "Peak RSS (MB)", "Peak Child RSS (MB)"]
+
+# ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+RSS_TO_MB = 1.0 / (1024 * 1024) if sys.platform == "darwin" else 1.0 / 1024
+
+
+def usage():
+    """Current wall clock, own and child CPU times, and peak RSS (MB)."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        time.perf_counter(),
+        own.ru_utime + own.ru_stime,
+        children.ru_utime + children.ru_stime,
+        own.ru_maxrss * RSS_TO_MB,
+        children.ru_maxrss * RSS_TO_MB,
+    )
+
+
+class Profiler(object):
+    """
+    Records a timeline of stages. Without an output path, all methods do
+    nothing, so the loops can always call them.
+    path = name of the CSV or JSON file to write the timeline to
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.year = 0
+        self._stage = None
+        self._start = None
+        self._rows = {}
+        if path:
+            atexit.register(self.close)
+
+    def mark(self, stage, year=None):
+        """
+        End the current stage (if any), and start the named stage.
+        stage = name of the stage
+        year = year of the simulation the stage belongs to, if it is a new year
+        """
+        if not self.path:
+            return
+        now = usage()
+        if self._stage is not None:
+            key = (self.year, self._stage)
+            row = self._rows.setdefault(key, [0.0, 0.0, 0.0, 0.0, 0.0])
+            # A stage that comes up more than once in a year is summed
+            for i in range(3):
+                row[i] += now[i] - self._start[i]
+            row[3], row[4] = now[3], now[4]
+        if year is not None:
+            self.year = year
+        self._stage = stage
+        self._start = now
+
+    def end(self):
+        """End the current stage."""
+        self.mark(None)
+
+    def close(self):
+        """End the current stage and write out the timeline."""
+        if not self.path:
+            return
+        self.end()
+        rows = [[year, stage] + values for (year, stage), values in self._rows.items()]
+        with open(self.path, "w") as f:
+            if self.path.lower().endswith(".json"):
+                json.dump([dict(zip(COLUMNS, row)) for row in rows], f, indent=1)
+            else:
+                f.write(",".join(COLUMNS) + "\n")
+                for row in rows:
+                    f.write(",".join(str(v) for v in row) + "\n")
+        self.path = None
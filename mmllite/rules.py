@@ -0,0 +1,184 @@
+"""
+GRASS recode and reclass rules files, compiled into lookup tables.
+
+Every year the scripts recode the landcover map into a c-factor map
+(cfactor_recode_rules.txt) and a fodder map (fodder_rules.txt) with r.recode,
+and relabel it with r.reclass and the landcover labels
+(luse_reclass_rules.txt), each time reading and writing whole rasters. Here a
+rules file is read once per run, and its values for every whole landcover
+class (0 up to the top of the rules) are worked out once into a table. Each
+recode of a landcover array of whole classes is then a single np.take() from
+the table. Arrays with values between classes are recoded rule by rule.
+
+Values are worked out with the same interpolation as r.recode, (value - low) /
+(high - low) * (new high - new low) + new low, in double precision. r.recode
+writes FCELL maps unless it is run with -d, so Recode returns float32 arrays
+unless made with dcell=True, and the values are the same as those of the maps
+r.recode writes.
+"""
+
+import numpy as np
+
+
+def _number(text):
+    text = text.strip()
+    if text == "*":
+        return None
+    return float(text)
+
+
+def readrecode(path):
+    """
+    Read an r.recode rules file into a list of (low, high, new low, new high)
+    rules. Lines are "low:high:new" or "low:high:new low:new high".
+    """
+    rules = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or line == "end":
+                continue
+            parts = [float(v) for v in line.split(":")]
+            if len(parts) == 3:
+                parts.append(parts[2])
+            lo, hi, newlo, newhi = parts[:4]
+            # As r.recode does with rules written from high to low
+            if lo > hi:
+                lo, hi, newlo, newhi = hi, lo, newhi, newlo
+            rules.append((lo, hi, newlo, newhi))
+    return rules
+
+
+def interpolate(values, rules):
+    """
+    Recode an array with r.recode rules, rule by rule. When rules overlap, the
+    last one wins (as in r.recode). Values that no rule covers become NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    out = np.full(values.shape, np.nan)
+    for lo, hi, newlo, newhi in rules:
+        inside = (values >= lo) & (values <= hi)
+        if hi == lo or newhi == newlo:
+            out[inside] = newlo
+        else:
+            out[inside] = (values[inside] - lo) / (hi - lo) * (newhi - newlo) + newlo
+    return out
+
+
+def lookup(table, values):
+    """
+    Look up the values of an array of whole classes in a table of the values
+    of classes 0 to len(table) - 2, where the last entry of the table is the
+    value for null cells (NaN). Returns None if the array holds any values
+    that are not classes of the table.
+    """
+    values = np.asarray(values, dtype=float)
+    size = len(table) - 1
+    with np.errstate(invalid="ignore"):
+        index = np.where(np.isnan(values), size, values)
+        if not np.array_equal(index, np.trunc(index)) or ((values < 0) | (values > size - 1)).any():
+            return None
+    return table.take(index.astype(np.intp))
+
+
+class Recode(object):
+    """
+    An r.recode rules file, with its values for every whole class.
+    path = path of the rules file
+    dcell = give double precision values, as r.recode -d does (otherwise
+        float32, as in the FCELL maps r.recode makes by default)
+    """
+
+    def __init__(self, path, dcell=False):
+        self.rules = readrecode(path)
+        self.dtype = np.float64 if dcell else np.float32
+        top = max([hi for lo, hi, newlo, newhi in self.rules] + [0])
+        # The last entry stands for null cells and values no rule covers
+        self.table = np.append(interpolate(np.arange(int(top) + 1, dtype=float), self.rules), np.nan)
+
+    def __call__(self, values):
+        """Recode an array (NaN for null cells), from the table if it only holds whole classes."""
+        out = lookup(self.table, values)
+        if out is None:
+            out = interpolate(values, self.rules)
+        return out.astype(self.dtype)
+
+    def value(self, value):
+        """Recoded value of a single number, as a float (NaN if no rule covers it)."""
+        return float(self(np.array([float(value)]))[0])
+
+
+class Reclass(object):
+    """
+    An r.reclass rules file ("1 2 3 = 1 label", "4 thru 9 = 2 label",
+    "* = NULL"), with the new class of every class from 0 to the top of the
+    rules, and the labels of the new classes.
+    path = path of the rules file
+    """
+
+    def __init__(self, path):
+        rules = []
+        self.labels = {}
+        with open(path) as f:
+            for line in f:
+                line = line.split("#")[0].strip()
+                if not line or line == "end":
+                    continue
+                old, sep, new = line.partition("=")
+                if not sep:
+                    raise ValueError("Bad reclass rule: %s" % line)
+                new = new.split(None, 1)
+                value = np.nan if new[0].upper() == "NULL" else float(int(new[0]))
+                if len(new) > 1 and value == value:
+                    self.labels[int(value)] = new[1].strip()
+                words = old.split()
+                while words:
+                    if len(words) >= 3 and words[1] == "thru":
+                        rules.append((_number(words[0]), _number(words[2]), value))
+                        words = words[3:]
+                    else:
+                        number = _number(words[0])
+                        rules.append((number, number, value))
+                        words = words[1:]
+        self.rules = rules
+        top = max([int(hi) for lo, hi, value in rules if hi is not None] + [0])
+        # As with r.recode tables, the last entry stands for null cells
+        self.table = np.full(top + 2, np.nan)
+        covered = np.zeros(top + 1, dtype=bool)
+        classes = np.arange(top + 1, dtype=float)
+        # New class of the classes that no other rule covers ("*")
+        self.other = np.nan
+        for lo, hi, value in rules:
+            if lo is None and hi is None:
+                self.other = value
+                continue
+            inside = np.ones(classes.shape, dtype=bool)
+            if lo is not None:
+                inside &= classes >= lo
+            if hi is not None:
+                inside &= classes <= hi
+            self.table[:-1][inside] = value
+            covered |= inside
+        self.table[:-1][~covered] = self.other
+
+    def __call__(self, values):
+        """
+        Reclass an array (NaN for null cells) into an array of new classes.
+        Values between classes are taken as the whole class below them (as
+        the landcover of FireBatch is), and classes outside of the table only
+        get a new class from "*".
+        """
+        values = np.trunc(np.asarray(values, dtype=float))
+        size = len(self.table) - 1
+        with np.errstate(invalid="ignore"):
+            outside = (values < 0) | (values > size - 1)
+            index = np.where(np.isnan(values) | outside, size, values).astype(np.intp)
+        out = self.table.take(index)
+        out[outside] = self.other
+        return out
+
+    def categories(self, path):
+        """Write the labels to a file of r.category rules (class:label)."""
+        with open(path, "w") as f:
+            for value in sorted(self.labels):
+                f.write("%s:%s\n" % (value, self.labels[value]))
@@ -0,0 +1,161 @@
+"""
+Run an ensemble of replicates until its results stop changing.
+
+Replicates of a simulation script are started in their own new mapsets of a
+location, a few at a time (as with the command lines of run_in_parallel.txt).
+Every replicate writes its stats to a binary stats file (flag -b), and as
+replicates finish, the summed standard error over all years of a few chosen
+stats columns (e.g. Population, Mean Erosion) is tracked over the finished
+replicates. Once adding replicates no longer cuts the summed standard error
+of every chosen column by more than a tolerance, no more replicates are
+started. The replicates that are still running are allowed to finish, and the
+precision that was reached is reported.
+
+    python3 -m mmllite.runner --location ~/grassdata/Spain --parallel 8 \\
+        --columns "yields:Population,erdep:Mean Erosion" --tolerance 0.005 \\
+        -- r.agropast.adaptive years=500 prfx=sim_ elev=INIT_DEM@PERMANENT ...
+
+"{replicate}" in the command is replaced by the number of each replicate
+(e.g. climseed={replicate} gives every replicate its own reproducible climate).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from mmllite import ensemble, stats
+
+
+def parsecolumns(text):
+    """Parse "table:column,table:column" into a list of (table, column) pairs."""
+    pairs = []
+    for item in text.split(","):
+        table, sep, column = item.partition(":")
+        if not sep:
+            raise argparse.ArgumentTypeError("Columns must be given as table:column, not %s" % item)
+        pairs.append((table.strip(), column.strip()))
+    return pairs
+
+
+def option(command, keys):
+    """Value of the first of the named key=value options of a command."""
+    for arg in command:
+        key, sep, value = arg.partition("=")
+        if sep and key in keys:
+            return value
+    return ""
+
+
+def precision(runs, columns, permutations=50):
+    """
+    Cumulative summed standard error curve of each column over the finished
+    replicates, averaged over random orders of the replicates (as in the
+    sse_stats.py plots), so that it does not jump about with the order they
+    happened to finish in. Years that not every replicate reached (e.g. when
+    everybody died) are left out.
+    runs = list of dictionaries of stats tables of the finished replicates
+    columns = list of (table, column) pairs
+    permutations = number of random orders to average over
+    Returns a list of curves and a list of the means of the columns.
+    """
+    curves, means = [], []
+    for table, column in columns:
+        series = [np.asarray(run[table][column], dtype=float) for run in runs]
+        years = min(len(s) for s in series)
+        data = np.array([s[:years] for s in series])
+        curves.append(ensemble.semcurves(data, permutations=permutations, seed=0).mean(axis=0))
+        means.append(np.abs(data.mean(axis=0)).sum())
+    return curves, means
+
+
+def run(args):
+    command = list(args.command)
+    if "-b" not in command:
+        command.append("-b")
+    prfx = option(args.command, ("prfx", "prefx"))
+    procs = {}
+    finished, failed = [], []
+    tables = []
+    launched = 0
+    stop = False
+    history = []
+    while procs or (not stop and launched < args.max_runs):
+        # Keep the requested number of replicates running
+        while not stop and launched < args.max_runs and len(procs) < args.parallel:
+            replicate = launched + 1
+            mapset = args.mapsets % replicate
+            log = open(os.path.join(args.location, "%s.log" % mapset), "w")
+            cmd = ["grass", "-c", os.path.join(args.location, mapset), "--exec"] + [arg.replace("{replicate}", str(replicate)) for arg in command]
+            procs[subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)] = (replicate, mapset, log)
+            launched += 1
+            print("Started replicate %s in mapset %s" % (replicate, mapset))
+        time.sleep(args.poll)
+        for proc in [p for p in procs if p.poll() is not None]:
+            replicate, mapset, log = procs.pop(proc)
+            log.close()
+            path = args.stats % {"mapsetdir": os.path.join(args.location, mapset), "mapset": mapset, "prfx": prfx, "replicate": replicate}
+            if proc.returncode != 0 or not os.path.exists(path):
+                print("Replicate %s failed (see %s.log)" % (replicate, mapset))
+                failed.append(replicate)
+                continue
+            tables.append(stats.load(path, mmap=False)[0])
+            finished.append(replicate)
+            if len(finished) < max(args.min_runs, 2):
+                continue
+            curves, means = precision(tables, args.columns)
+            checks = [ensemble.converged(curve, args.tolerance, args.window) for curve in curves]
+            history.append({"runs": len(finished), "summed_sem": [float(c[-1]) for c in curves], "reduction": [r for ok, r in checks]})
+            print("%s replicates finished, summed standard errors: %s" % (len(finished), ", ".join("%s %.4g" % (col[1], c[-1]) for col, c in zip(args.columns, curves))))
+            if not stop and all(ok for ok, r in checks):
+                stop = True
+                print("Standard errors have converged after %s replicates, no more will be started" % len(finished))
+    report = {
+        "launched": launched,
+        "finished": finished,
+        "failed": failed,
+        "converged": stop,
+        "tolerance": args.tolerance,
+        "window": args.window,
+        "columns": [],
+        "history": history,
+    }
+    if len(tables) > 1:
+        curves, means = precision(tables, args.columns)
+        for (table, column), curve, mean in zip(args.columns, curves, means):
+            report["columns"].append({"table": table, "column": column, "summed_sem": float(curve[-1]), "relative_sem": float(curve[-1] / mean) if mean else None})
+            print("%s %s: summed standard error %.4g (%.2f%% of the summed mean)" % (table, column, curve[-1], 100 * curve[-1] / mean if mean else float("nan")))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1)
+    return 0 if stop or launched >= args.max_runs else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--location", required=True, help="Path of the GRASS location to make the replicate mapsets in")
+    parser.add_argument("--mapsets", default="replicate%03d", help="Name of the replicate mapsets, with %%d (or similar) for the replicate number")
+    parser.add_argument("--parallel", type=int, default=os.cpu_count() or 1, help="Number of replicates to run at once")
+    parser.add_argument("--columns", type=parsecolumns, required=True, help='Comma separated stats columns to track, as table:column (e.g. "yields:Population,erdep:Mean Erosion")')
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Stop when each new replicate cuts the summed standard error of every column by less than this proportion")
+    parser.add_argument("--window", type=int, default=5, help="Number of replicates to average the reduction over")
+    parser.add_argument("--min-runs", type=int, default=10, help="Minimum number of replicates")
+    parser.add_argument("--max-runs", type=int, default=200, help="Maximum number of replicates")
+    parser.add_argument("--stats", default="%(mapsetdir)s/%(prfx)sstats.npz", help="Path of the binary stats file of a replicate, with %%(mapsetdir)s, %%(mapset)s, %%(prfx)s, and %%(replicate)s")
+    parser.add_argument("--report", help="JSON file to write the achieved precision to")
+    parser.add_argument("--poll", type=float, default=5, help="Seconds between checks for finished replicates")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Simulation script and its options")
+    args = parser.parse_args(argv)
+    if args.command and args.command[0] == "--":
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error("no simulation command given")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
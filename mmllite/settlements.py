@@ -0,0 +1,354 @@
+"""
+Many settlements farming and grazing one shared landscape.
+
+r.agropast.adaptive models one village, with one agricultural catchment, one
+grazing catchment, and one cost surface. To model a region, every village
+used to be run on its own, each with its own landscape evolution, and the
+villages never met on the landscape. Here all the settlements of a table
+farm and graze the same in-memory landscape each year, and the region then
+goes through one landscape evolution step.
+
+Catchments are kept as a flat list of (settlement, cell) pairs, with the cost
+distance of each cell from its settlement, so overlapping catchments cost no
+more than their combined size. Each year every settlement works out how many
+fields and grazing patches it thinks it needs, from the memory of its
+households (population.Households, with one agent per settlement), and
+claims its preferred cells: random cells of its agricultural catchment for
+fields (as r.random does for a single village), and the nearest cells of its
+grazing catchment for grazing. When settlements claim the same cell, the
+cell goes to the one it is nearest to (by cost distance). Settlements that
+lost cells then claim their next preferred cells, for a few rounds.
+
+Fields are cells of the region in this mode, so yields are worked out per
+cell rather than per field of nsfieldsize by ewfieldsize.
+"""
+
+import csv
+
+import numpy as np
+
+from mmllite import agropast, landcover
+
+# Columns of a settlements table. agcatch and grazecatch are the names of
+# catchment maps, or cost distances from the settlement (as with r.cost).
+COLUMNS = ("name", "x", "y", "people", "agcatch", "grazecatch")
+
+# Columns of the yearly stats of each settlement
+STATS_COLUMNS = [
+    "Year", "Settlement", "Population", "Births", "Deaths", "People Fed", "",
+    "Number of Farm Fields", "Fields Lost to Other Settlements", "Total Cereals Harvested", "Total Cereals Required", "Cereal Surplus/Deficit", "",
+    "Number of Grazing Patches", "Grazing Patches Lost to Other Settlements", "Total Stubble Fodder", "Total Fodder Consumed", "Total Amount of Fodder Required", "Fodder Surplus/Deficit",
+]
+
+
+def read(path):
+    """
+    Read a settlements table (a CSV file with a header line of COLUMNS) into
+    a list of dictionaries, with x, y, and people as numbers.
+    """
+    with open(path) as f:
+        rows = [dict((key.strip(), value.strip()) for key, value in row.items()) for row in csv.DictReader(f)]
+    for row in rows:
+        missing = [key for key in COLUMNS if not row.get(key)]
+        if missing:
+            raise ValueError("Settlement %s has no %s" % (row.get("name", len(rows)), ", ".join(missing)))
+        row["x"], row["y"], row["people"] = float(row["x"]), float(row["y"]), float(row["people"])
+    return rows
+
+
+def rankwithin(groups, key):
+    """Rank (from 0) of every element within its group, in order of ascending key."""
+    groups = np.asarray(groups)
+    order = np.lexsort((key, groups))
+    sortedgroups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sortedgroups[1:] != sortedgroups[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(starts, counts)
+    return rank
+
+
+class Catchments(object):
+    """
+    Catchment cells of a set of settlements, as (settlement, cell) pairs.
+    settlement = array of the settlement of each pair
+    cell = array of the flat cell index of each pair
+    cost = array of the cost distance from the settlement to the cell
+    count = number of settlements
+    """
+
+    def __init__(self, settlement, cell, cost, count):
+        self.settlement = np.asarray(settlement, dtype=np.int64)
+        self.cell = np.asarray(cell, dtype=np.int64)
+        self.cost = np.asarray(cost, dtype=float)
+        self.count = count
+
+    def __len__(self):
+        return len(self.cell)
+
+    def subset(self, keep):
+        """Catchments of only the pairs where keep (a boolean array of the pairs) is True."""
+        return Catchments(self.settlement[keep], self.cell[keep], self.cost[keep], self.count)
+
+    def sizes(self):
+        """Number of catchment cells of each settlement."""
+        return np.bincount(self.settlement, minlength=self.count)
+
+    def means(self, values):
+        """Mean of the non-null values of a map array in the catchment of each settlement (NaN if none)."""
+        values = np.asarray(values, dtype=float).ravel()[self.cell]
+        valid = ~np.isnan(values)
+        sums = np.bincount(self.settlement[valid], values[valid], minlength=self.count)
+        counts = np.bincount(self.settlement[valid], minlength=self.count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+
+    def allocate(self, wants, preference, taken=None, rounds=3):
+        """
+        Give each settlement up to the number of cells it wants from its
+        catchment. Each settlement claims the cells of its catchment with the
+        lowest preference values that nobody holds yet, and a cell that more
+        than one settlement claims goes to the one with the lowest cost
+        distance to it (and then to the first settlement). Settlements that
+        lost cells claim again, up to rounds times.
+        wants = array of the number of cells each settlement wants
+        preference = array of a preference value for every pair (lower first)
+        taken = boolean array of the cells of the map that are already held
+        Returns an array of the settlement that holds each cell of the map
+        (-1 for none, the size of taken), and an array of the number of cells
+        each settlement lost to others.
+        """
+        size = len(taken) if taken is not None else (self.cell.max() + 1 if len(self) else 0)
+        owner = np.full(size, -1, dtype=np.int64)
+        if taken is not None:
+            owner[np.asarray(taken, dtype=bool)] = -2
+        need = np.maximum(np.asarray(wants, dtype=np.int64), 0)
+        lost = np.zeros(self.count, dtype=np.int64)
+        for _ in range(rounds):
+            open_ = (owner[self.cell] == -1) & (need[self.settlement] > 0)
+            if not open_.any():
+                break
+            pairs = np.flatnonzero(open_)
+            settlement = self.settlement[pairs]
+            claimed = rankwithin(settlement, preference[pairs]) < need[settlement]
+            pairs, settlement = pairs[claimed], settlement[claimed]
+            cell = self.cell[pairs]
+            # Contested cells go to the nearest settlement
+            order = np.lexsort((settlement, self.cost[pairs], cell))
+            cell, settlement = cell[order], settlement[order]
+            first = np.r_[True, cell[1:] != cell[:-1]]
+            owner[cell[first]] = settlement[first]
+            need -= np.bincount(settlement[first], minlength=self.count)
+            lost += np.bincount(settlement[~first], minlength=self.count)
+        owner[owner == -2] = -1
+        return owner, lost
+
+
+def catchments(rows, costsurf, env=None):
+    """
+    Make the agricultural and grazing catchments of the settlements of a
+    table, from their catchment maps, or from their cost distances (r.cost
+    over the cost surface, from the location of the settlement).
+    rows = settlements table (see read)
+    costsurf = name of the map of the cost of moving through each cell
+    Returns the agricultural and grazing Catchments.
+    """
+    import os
+
+    import grass.script as grass
+
+    from mmllite import zonal
+
+    tempcost = "tmp%s_settlement_cost" % os.getpid()
+    pairs = {"agcatch": ([], [], []), "grazecatch": ([], [], [])}
+    for i, row in enumerate(rows):
+        grass.run_command("r.cost", quiet=True, overwrite=True, input=costsurf, output=tempcost, start_coordinates="%s,%s" % (row["x"], row["y"]), env=env)
+        cost = zonal.readmap(tempcost, env=env).ravel()
+        for key, (settlement, cell, costs) in pairs.items():
+            try:
+                inside = cost <= float(row[key])
+            except ValueError:
+                inside = ~np.isnan(zonal.readmap(row[key], env=env).ravel())
+            inside &= ~np.isnan(cost)
+            index = np.flatnonzero(inside)
+            settlement.append(np.full(len(index), i, dtype=np.int64))
+            cell.append(index)
+            costs.append(cost[index])
+    grass.run_command("g.remove", quiet=True, flags="f", type="raster", name=tempcost, env=env)
+    return [Catchments(np.concatenate(pairs[key][0]), np.concatenate(pairs[key][1]), np.concatenate(pairs[key][2]), len(rows)) for key in ("agcatch", "grazecatch")]
+
+
+class Region(object):
+    """
+    Landcover, soil fertility, fields, and households of all the settlements
+    of a region, advanced a year at a time.
+    agcatch, grazecatch = Catchments of the settlements
+    households = population.Households, with one agent per settlement
+    lcov, fert = arrays of the starting landcover and soil fertility
+    params = dictionary of the farming and grazing options of
+        r.agropast.adaptive (as numbers, and tenuretype as a string)
+    fodder = rules.Recode of the fodder rules (dcell=True)
+    seed = seed for the choice of fields (a new random seed if None)
+    reclass = rules.Reclass of the landcover labels, to reclass the landcover
+        with every year (as the single village loop does), or None
+    excesstable = rainfall excess of the whole landcover classes (see
+        landcover.excesstable), or None
+    """
+
+    def __init__(self, agcatch, grazecatch, households, lcov, fert, params, fodder, seed=None, reclass=None, excesstable=None):
+        self.agcatch = agcatch
+        self.grazecatch = grazecatch
+        self.households = households
+        self.shape = np.shape(lcov)
+        self.lcov = np.asarray(lcov, dtype=float).ravel()
+        self.fert = np.asarray(fert, dtype=float).ravel()
+        self.params = params
+        self.fodder = fodder
+        self.reclass = reclass
+        self.excesstable = excesstable
+        self.rng = np.random.default_rng(seed)
+        # Settlement farming each cell last year (-1 for none)
+        self.fields = np.full(self.lcov.shape, -1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.households)
+
+    def _tenure(self, need, yields):
+        """Last year's fields that are kept this year, by the tenure rules of r.agropast.adaptive."""
+        p = self.params
+        count = len(self)
+        fields = np.full(self.fields.shape, -1, dtype=np.int64)
+        if p["tenuretype"] not in ("Maximize", "Satisfice"):
+            return fields
+        cells = np.flatnonzero(self.fields >= 0)
+        owner = self.fields[cells]
+        held = np.bincount(owner, minlength=count)
+        if p["tenuretype"] == "Maximize":
+            # Settlements that need fewer fields drop the ones that yield less than the mean (or than the tenuredrop share of the best)
+            y = np.nan_to_num(yields[cells])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = np.bincount(owner, y, minlength=count) / held
+            best = np.zeros(count)
+            np.maximum.at(best, owner, y)
+            threshold = mean if p["tenuredrop"] == 0 else best - (best * p["tenuredrop"])
+            drop = (need[owner] - held[owner] <= 0) & (y < threshold[owner])
+        else:
+            # Settlements with too many fields drop random ones
+            drop = rankwithin(owner, self.rng.random(len(cells))) >= np.maximum(need, 0)[owner]
+        fields[cells[~drop]] = owner[~drop]
+        return fields
+
+    def step(self, precip, sdepth, grazeimpact, fertregain, farmimpact, dynamics=True):
+        """
+        Farm, graze, and regrow the landscape for a year, and update the
+        households.
+        precip = total precipitation of the year (m)
+        sdepth = array of last year's soil depths
+        grazeimpact = array of potential grazing impacts (as r.random.surface makes)
+        fertregain = array of soil fertility regain (as r.surf.gauss makes)
+        farmimpact = array of the fertility impacts of farming (as r.surf.gauss makes)
+        dynamics = let the populations change with births and deaths (flag -p)
+        Returns dictionaries of maps (arrays of the region: "fields",
+        "grazeimpacts", "lcov", "fert", and "excess", the rainfall excess of
+        the landcover before it is reclassed) and of the stats of each settlement
+        (arrays, by the names of STATS_COLUMNS).
+        """
+        p = self.params
+        h = self.households
+        count = len(self)
+        sdepth = np.asarray(sdepth, dtype=float).ravel()
+        alive = h.alive
+        # Farming plan of each settlement, from its memory of yields
+        yields = agropast.cerealyield(precip, self.fert, sdepth, p["maxwheat"], p["maxbarley"], p["agmix"], p["cellperhectare"])
+        fieldable = self.agcatch.subset(~np.isnan(yields[self.agcatch.cell]))
+        yieldmemory = h.recall("farm yield")
+        deficitmemory = h.recall("farming")
+        first = np.isnan(yieldmemory)
+        yieldmemory[first] = h.fuzz(fieldable.means(yields))[first]
+        deficitmemory[first] = -1
+        with np.errstate(invalid="ignore", divide="ignore"):
+            numfields = np.where(yieldmemory > 0, np.round(h.cerealreq / yieldmemory) - np.round(deficitmemory / yieldmemory), 0)
+        numfields = np.nan_to_num(numfields).astype(np.int64)
+        numfields = np.where(alive, np.clip(numfields, 0, np.minimum(fieldable.sizes(), h.maxfields)), 0)
+        # Keep tenured fields, and claim new ones at random in the catchments
+        fields = self._tenure(numfields, yields)
+        held = np.bincount(fields[fields >= 0], minlength=count)
+        new, fieldslost = fieldable.allocate(numfields - held, self.rng.random(len(fieldable)), taken=fields >= 0)
+        fields = np.where(new >= 0, new, fields)
+        farmed = np.flatnonzero(fields >= 0)
+        owner = fields[farmed]
+        numfarmcells = np.bincount(owner, minlength=count)
+        cereals = np.bincount(owner, np.nan_to_num(yields[farmed]), minlength=count)
+        cerealdif = cereals - h.cerealreq
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fieldmean = np.where(numfarmcells > 0, cereals / numfarmcells, 0)
+        # Grazing yields, and the stubble of the fields (unless flag -g)
+        fodder = (self.fodder(self.lcov) / p["cellperhectare"]) * grazeimpact.ravel()
+        if p["stubble"]:
+            best = np.zeros(count)
+            np.maximum.at(best, owner, np.nan_to_num(yields[farmed]))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                stubble = np.where(best[owner] > 0, (self.fodder.value(p["farmval"]) / p["cellperhectare"]) * (yields[farmed] / best[owner]), 0)
+            stubblefodder = np.bincount(owner, np.nan_to_num(stubble), minlength=count)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                stubblemean = np.where(numfarmcells > 0, stubblefodder / numfarmcells, 0)
+            remaining = np.where(h.fodderreq - (stubblemean * numfarmcells) <= 0, 0, h.fodderreq - (h.fuzz(stubblemean) * numfarmcells))
+        else:
+            stubblefodder = np.zeros(count)
+            remaining = h.fodderreq
+        # Grazing plan, from the memory of grazing yields
+        cell = self.grazecatch.cell
+        grazeable = ~np.isnan(fodder[cell]) & (fields[cell] < 0)
+        if p["fallow"]:
+            grazeable &= ~np.isin(cell, self.agcatch.cell)
+        catchment = self.grazecatch.subset(grazeable)
+        gyieldmemory = h.recall("graze yield")
+        gdeficitmemory = h.recall("grazing")
+        first = np.isnan(gyieldmemory)
+        gyieldmemory[first] = h.fuzz(catchment.means(fodder))[first]
+        gdeficitmemory[first] = -1
+        with np.errstate(invalid="ignore", divide="ignore"):
+            numgraze = np.where(gyieldmemory != 0, np.round(remaining / gyieldmemory) - np.round(gdeficitmemory / gyieldmemory), 0)
+        numgraze = np.where(alive, np.clip(np.nan_to_num(numgraze).astype(np.int64), 0, catchment.sizes()), 0)
+        # Only cells with enough vegetation are grazed, nearest first
+        pasture = catchment.subset(self.lcov[catchment.cell] > p["mingraze"])
+        grazers, grazelost = pasture.allocate(numgraze, pasture.cost, taken=fields >= 0)
+        grazed = np.flatnonzero(grazers >= 0)
+        numgrazecells = np.bincount(grazers[grazed], minlength=count)
+        wildfodder = np.bincount(grazers[grazed], np.nan_to_num(fodder[grazed]), minlength=count)
+        totalfodder = wildfodder + stubblefodder
+        fodderdif = totalfodder - h.fodderreq
+        with np.errstate(invalid="ignore", divide="ignore"):
+            grazemean = np.where(numgrazecells > 0, wildfodder / numgrazecells, 0)
+        # Households remember the year, and are fed (or not)
+        h.remember(cerealdif, fieldmean, fodderdif, grazemean)
+        animfed = totalfodder / h.indfodreq
+        peoplefed = (cereals / h.indcerreq) + (animfed / h.animals)
+        people, cerealreq, fodderreq = h.people.copy(), h.cerealreq, h.fodderreq
+        if dynamics:
+            births, deaths = h.demography(peoplefed, p["starvthresh"], p["birthrate"], p["deathrate"])
+        else:
+            births, deaths = np.zeros(count), np.zeros(count)
+        # Soil fertility and landcover
+        fieldmap = np.full(self.lcov.shape, np.nan)
+        fieldmap[farmed] = farmimpact.ravel()[farmed]
+        grazemap = np.full(self.lcov.shape, np.nan)
+        grazemap[grazed] = grazeimpact.ravel()[grazed]
+        fert = agropast.fertility(self.fert, fieldmap, grazemap, grazeimpact.ravel(), fertregain.ravel(), p["manurerate"], p["maxfert"], p["stubble"])
+        growth = landcover.growthrate(sdepth, precip, fert)
+        lcov, firestats = landcover.update(self.lcov, growth, grazemap, fieldmap, p["farmval"], p["maxlcov"])
+        excess = landcover.rainfallexcess(lcov, self.excesstable)
+        # The reclassed landcover is the one written out, and carried on to next year
+        if self.reclass is not None:
+            lcov = self.reclass(lcov)
+        self.lcov, self.fert, self.fields = lcov, fert, fields
+        maps = {"fields": fieldmap, "grazeimpacts": grazemap, "lcov": lcov, "fert": fert, "excess": excess}
+        maps = dict((key, value.reshape(self.shape)) for key, value in maps.items())
+        stats = {
+            "Population": people, "Births": births, "Deaths": deaths, "People Fed": peoplefed,
+            "Number of Farm Fields": numfarmcells, "Fields Lost to Other Settlements": fieldslost,
+            "Total Cereals Harvested": cereals, "Total Cereals Required": cerealreq, "Cereal Surplus/Deficit": cerealdif,
+            "Number of Grazing Patches": numgrazecells, "Grazing Patches Lost to Other Settlements": grazelost,
+            "Total Stubble Fodder": stubblefodder, "Total Fodder Consumed": totalfodder, "Total Amount of Fodder Required": fodderreq, "Fodder Surplus/Deficit": fodderdif,
+        }
+        return maps, stats
@@ -0,0 +1,205 @@
+"""
+Stats outputs of a run.
+
+StatsSink owns all the stats text files of a run. Each file is opened once,
+and rows are buffered in memory and written out every few years (or whenever
+flush() is called), instead of reopening every file every year.
+
+Optionally, the rows are also kept in typed NumPy buffers with named columns
+and written out once, at the end of the run, as a single uncompressed .npz
+file together with the run metadata. Each table is stored as a structured
+array, so it can be memory-mapped straight out of the file by load(), and
+ensembles can be aggregated without parsing thousands of text files.
+"""
+
+import atexit
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+# Name of the .npz member holding the run metadata (as a JSON string)
+METADATA = "metadata"
+
+
+class Table(object):
+    """
+    A growable buffer of rows with named, typed columns. Columns named "" are
+    spacers that only exist in the text version of a stats file, so they are
+    skipped when rows are stored.
+    """
+
+    def __init__(self, columns, dtype="f8", size=512):
+        self.columns = list(columns)
+        self._keep = [i for i, name in enumerate(self.columns) if name]
+        self.dtype = np.dtype([(self.columns[i], dtype) for i in self._keep])
+        self._data = np.zeros(size, dtype=self.dtype)
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def append(self, values):
+        """
+        Add a row. Values are given for every column, spacers included, and
+        are converted to the column type (so the strings returned by r.univar
+        can be passed straight in).
+        """
+        if len(values) != len(self.columns):
+            raise ValueError("Expected %s values, got %s" % (len(self.columns), len(values)))
+        if self._rows == len(self._data):
+            self._data = np.resize(self._data, 2 * len(self._data))
+        self._data[self._rows] = tuple(values[i] for i in self._keep)
+        self._rows += 1
+
+    @property
+    def data(self):
+        """Structured array of the rows stored so far."""
+        return self._data[: self._rows]
+
+
+class StatsSink(object):
+    """
+    Buffered writer for all the stats files of a run.
+    flushevery = number of years of rows to buffer before writing them out
+    columnar = also keep every row in a Table, to be written by save()
+    aggregator = aggregate.Aggregator to also send every row to, for live
+        ensemble statistics (rows are sent whenever the buffers are written out)
+    Buffered rows are also written out when the interpreter exits, so that
+    they are not lost if the run is stopped with grass.fatal.
+    """
+
+    def __init__(self, flushevery=1, columnar=False, aggregator=None):
+        self.flushevery = max(int(flushevery), 1)
+        self.columnar = columnar
+        self.aggregator = aggregator
+        self.tables = {}
+        self._columns = {}
+        self._files = {}
+        self._formats = {}
+        self._keys = {}
+        self._buffers = {}
+        self._years = 0
+        atexit.register(self.close)
+
+    def add(self, name, path, columns, header=None, prefix="\n", suffix="", size=512, key=None):
+        """
+        Open a stats text file for appending, writing its header if the file is
+        new or empty. Rows are written as prefix + values + suffix.
+        name = name of the output, used by write() and as the table name
+        path = path of the text file
+        columns = column names (empty names are spacer columns)
+        header = text header of the file (defaults to the column names)
+        key = column that tells apart the rows of one year (e.g. "Settlement"),
+            or None for one row a year. The rows of each of its values are
+            aggregated as a table of their own, named NAME/VALUE (e.g.
+            settlements/0), rather than as replicates of each other
+        """
+        f = open(path, "a")
+        if f.tell() == 0:
+            f.write(",".join(columns) if header is None else header)
+        self._files[name] = f
+        self._formats[name] = (prefix, suffix)
+        self._columns[name] = list(columns)
+        self._keys[name] = None if key is None else list(columns).index(key)
+        self._buffers[name] = []
+        if self.columnar:
+            self.tables[name] = Table(columns, size=size)
+
+    def write(self, name, values):
+        """Buffer a row of values for the named output."""
+        prefix, suffix = self._formats[name]
+        self._buffers[name].append(prefix + csvrow(values) + suffix)
+        if self.columnar:
+            self.tables[name].append(values)
+        if self.aggregator is not None:
+            # Rows are tagged with the year of the run they were written in,
+            # and the rows of each key value go to a table of their own
+            columns, key = self._columns[name], self._keys[name]
+            if key is not None:
+                columns = columns[:key] + [""] + columns[key + 1:]
+                name = "%s/%s" % (name, values[key])
+            self.aggregator.add(name, self._years + 1, columns, values)
+
+    def step(self):
+        """Mark the end of a year, and write out the buffers if it is time to."""
+        self._years += 1
+        if self._years % self.flushevery == 0:
+            self.flush()
+
+    def flush(self):
+        """Write out all buffered rows."""
+        for name, rows in self._buffers.items():
+            if rows:
+                self._files[name].write("".join(rows))
+                self._files[name].flush()
+                del rows[:]
+        if self.aggregator is not None:
+            self.aggregator.flush()
+
+    def close(self):
+        """Write out all buffered rows and close the files."""
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._buffers = {}
+        if self.aggregator is not None:
+            self.aggregator.close()
+            self.aggregator = None
+
+    def save(self, path, metadata=None):
+        """Write the tables of a columnar sink to one .npz file (see save())."""
+        save(path, self.tables, metadata)
+
+
+def csvrow(values):
+    """Format a row of values as a line of a comma separated stats file."""
+    return ",".join(str(v) for v in values)
+
+
+def save(path, tables, metadata=None):
+    """
+    Write a dictionary of Tables (or structured arrays) and a dictionary of
+    run metadata to one .npz file. The file is not compressed, so that load()
+    can memory-map its tables.
+    """
+    arrays = dict((name, getattr(table, "data", table)) for name, table in tables.items())
+    arrays[METADATA] = np.array(json.dumps(metadata or {}, default=str))
+    np.savez(path, **arrays)
+
+
+def load(path, mmap=True):
+    """
+    Read the tables and run metadata from a file written by save(). With mmap,
+    tables are memory-mapped from the file instead of being read into memory.
+    Returns a dictionary of structured arrays and the metadata dictionary.
+    """
+    tables = {}
+    with zipfile.ZipFile(path) as zf:
+        infos = [info for info in zf.infolist() if info.filename.endswith(".npy")]
+        metadata = json.loads(str(np.load(zf.open(METADATA + ".npy"))))
+    with open(path, "rb") as fh:
+        for info in infos:
+            name = info.filename[:-4]
+            if name == METADATA:
+                continue
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with zipfile.ZipFile(path) as zf:
+                    tables[name] = np.load(zf.open(info.filename))
+                continue
+            # Skip the zip local file header to get to the .npy data
+            fh.seek(info.header_offset + 26)
+            namelen, extralen = struct.unpack("<HH", fh.read(4))
+            fh.seek(info.header_offset + 30 + namelen + extralen)
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(fh)
+            if 0 in shape:
+                tables[name] = np.zeros(shape, dtype=dtype)
+            else:
+                tables[name] = np.memmap(path, dtype=dtype, mode="r", shape=shape, offset=fh.tell(), order="F" if fortran else "C")
+    return tables, metadata
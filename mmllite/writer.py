@@ -0,0 +1,92 @@
+"""
+Background output work for the yearly loops of the simulations.
+
+Archiving a year's maps (reading them, compressing them, and writing them to
+disk), making color tables, and removing maps that are not to be kept all
+stall the yearly loop on disk I/O, even though the next year does not need
+any of it. A BackgroundWriter runs such jobs, in order, in a thread while the
+simulation gets on with the next year. The queue of waiting jobs is bounded
+(one job is usually one year's output), so if the disk cannot keep up the
+simulation waits for it, rather than holding ever more years in memory.
+
+The simulations change the computational region for some steps with
+grass.use_temp_region(), which would also change it for any GRASS modules run
+at the same time from the background thread. Jobs are therefore given the
+environment (and so the region) of the writer from when it was made, and
+should pass it on as env= to every GRASS call.
+"""
+
+import os
+import queue
+import threading
+
+
+class BackgroundWriter(object):
+    """
+    Runs output jobs in a background thread, in the order they were given.
+    queued = number of jobs that can wait before submit() blocks (0 runs
+        every job right away in the calling thread instead)
+    """
+
+    def __init__(self, queued=2):
+        self.queued = int(queued)
+        self._error = None
+        if self.queued > 0:
+            self.env = os.environ.copy()
+            self.env.pop("WIND_OVERRIDE", None)
+            self._queue = queue.Queue(self.queued)
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self.env = None
+            self._thread = None
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            func, args, kwargs = job
+            try:
+                if self._error is None:
+                    func(*args, **kwargs)
+            except Exception as e:
+                # Keep the first error, to raise in the main thread, and skip the rest
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the background, waiting for room in the
+        queue if it is full. Errors of earlier jobs are raised here.
+        """
+        self._check()
+        if self._thread is None:
+            func(*args, **kwargs)
+        else:
+            self._queue.put((func, args, kwargs))
+
+    def wait(self):
+        """
+        Wait for all the submitted jobs to finish (e.g. before reading maps
+        that they write), and raise any error. The writer can still be used.
+        """
+        if self._thread is not None:
+            self._queue.join()
+        self._check()
+
+    def close(self):
+        """Wait for all the submitted jobs to finish, and raise any error."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._check()
@@ -0,0 +1,253 @@
+"""
+Zonal erosion/deposition statistics of many replicate runs.
+
+The follow up scripts used to make a cumulative erosion/deposition
+("CUMERDEP") map for every replicate with r.mapcalc, then erosion and
+deposition maps for every zone with two more r.mapcalc calls, and then run
+r.univar on those. Here, the final DEM of every replicate is read into memory
+once and the initial DEM is subtracted from it there. The erosion and
+deposition stats of all the zones then come from the same array. Replicates
+are spread over a pool of worker processes that each read the initial DEM and
+the zone masks only once, and no maps are written unless asked for.
+
+For many small zones, like the segments of a stream network, ZoneIndex holds
+the flat indices of the cells of every zone, so that the values along all the
+segments are gathered from a replicate's map in one indexing operation, and
+summarized per segment with numpy.bincount.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+import grass.script as grass
+from grass.script import array as garray
+
+# Stats for each zone, as in the stats files of the follow up scripts
+STATS = ["summed erosion", "summed deposition", "mean erosion", "mean deposition", "max erosion", "max deposition"]
+
+# Initial DEM and zone masks of each worker process, set by _setup
+_shared = {}
+
+
+def readmap(mapname, env=None):
+    """Read a raster map in the current region into a float array, with NaN for nulls."""
+    return np.asarray(garray.array(mapname=mapname, null="nan", env=env))
+
+
+def writemap(mapname, data, integer=False, env=None):
+    """
+    Write an array to a raster map in the current region (NaN cells are null),
+    as an integer (CELL) map if asked to. float32 arrays are written as FCELL
+    maps, and other arrays as DCELL maps.
+    env = environment to run GRASS in (e.g. that of a writer.BackgroundWriter)
+    """
+    if integer:
+        # Integer maps need a stand in value for their null cells
+        null = np.iinfo(np.int32).min
+        out = garray.array(dtype=np.int32, env=env)
+        out[...] = np.where(np.isnan(data), null, data)
+        out.write(mapname=mapname, null=null, overwrite=True)
+        return
+    out = garray.array(dtype=np.float32 if np.asarray(data).dtype == np.float32 else np.float64, env=env)
+    out[...] = data
+    out.write(mapname=mapname, overwrite=True)
+
+
+def writemaps(maps, integer=(), labels=None, colors=None, env=None):
+    """
+    Write some of a year's maps from their arrays, and label and color them
+    (e.g. as one job of a writer.BackgroundWriter).
+    maps = list of (map name, array) pairs
+    integer = names of the maps to write as integer (CELL) maps
+    labels = dictionary of category rules files to label maps with, by map name
+    colors = dictionary of color rules files to color maps with, by map name
+    env = environment to run GRASS in (e.g. that of a writer.BackgroundWriter)
+    """
+    for mapname, data in maps:
+        writemap(mapname, data, integer=mapname in integer, env=env)
+    for mapname, rules in (labels or {}).items():
+        grass.run_command("r.category", quiet=True, map=mapname, rules=rules, separator=":", env=env)
+    for mapname, rules in (colors or {}).items():
+        grass.run_command("r.colors", quiet=True, map=mapname, rules=rules, env=env)
+
+
+def erdepstats(cumerdep, mask):
+    """
+    Erosion and deposition stats of the cells of a cumulative erosion/deposition
+    array inside a zone. Erosion values are negative, so "max erosion" is the
+    most negative value. Stats of a zone with no erosion (or deposition) are NaN.
+    Returns values in the order of STATS.
+    """
+    values = cumerdep[mask]
+    erosion = values[values < 0]
+    deposition = values[values > 0]
+    if erosion.size:
+        ero = [erosion.sum(), erosion.mean(), erosion.min()]
+    else:
+        ero = [np.nan] * 3
+    if deposition.size:
+        dep = [deposition.sum(), deposition.mean(), deposition.max()]
+    else:
+        dep = [np.nan] * 3
+    return [ero[0], dep[0], ero[1], dep[1], ero[2], dep[2]]
+
+
+class ZoneIndex(object):
+    """
+    Flat-index table of the cells of each zone of a zone map (e.g. the segments
+    of a stream network), built once so that the values of every zone can be
+    gathered from any map of the same region with one indexing operation.
+    zones = array of zone numbers, with NaN outside of all zones (see readmap)
+    """
+
+    def __init__(self, zones):
+        zones = np.asarray(zones).ravel()
+        inside = np.flatnonzero(~np.isnan(zones))
+        ids = zones[inside].astype(np.int64)
+        order = np.argsort(ids, kind="stable")
+        # Flat indices of the cells of every zone, zone after zone
+        self.cells = inside[order]
+        self.ids, self.counts = np.unique(ids[order], return_counts=True)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        # Position of each gathered cell's zone in self.ids
+        self.zone = np.repeat(np.arange(len(self.ids)), self.counts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def gather(self, values):
+        """Values of a map at the cells of every zone, zone after zone."""
+        return np.asarray(values).ravel()[self.cells]
+
+    def stats(self, values, percentiles=(10, 50, 90)):
+        """
+        Sum, mean, and percentiles of the values of a map in every zone (NaN
+        cells are left out). Returns an array with one row per zone (in the
+        order of self.ids) and one column per stat.
+        """
+        v = self.gather(values)
+        valid = ~np.isnan(v)
+        n = len(self.ids)
+        sums = np.bincount(self.zone[valid], weights=v[valid], minlength=n)
+        counts = np.bincount(self.zone[valid], minlength=n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        out = [sums, means]
+        if percentiles:
+            # Sort the values within each zone (NaN last), then interpolate
+            # the percentiles of all zones at once, as numpy.percentile does
+            v = v[np.lexsort((v, self.zone))]
+            last = np.maximum(counts - 1, 0)
+            for q in percentiles:
+                pos = self.starts + last * (q / 100.0)
+                lo = np.floor(pos).astype(np.int64)
+                hi = np.minimum(lo + 1, self.starts + last)
+                frac = pos - lo
+                value = v[lo] * (1 - frac) + v[hi] * frac if len(v) else np.zeros(n)
+                out.append(np.where(counts > 0, value, np.nan))
+        return np.column_stack(out)
+
+
+def _setup(shared):
+    _shared.update(shared)
+
+
+def _cumerdep(elevmap):
+    """Read one replicate's map, and subtract the initial DEM (if any)."""
+    cumerdep = readmap(elevmap)
+    if _shared["initdem"] is not None:
+        cumerdep -= _shared["initdem"]
+    return cumerdep
+
+
+def _replicate(args):
+    """Read one replicate's map, and return the stats of every zone."""
+    elevmap, outname = args
+    cumerdep = _cumerdep(elevmap)
+    if outname:
+        writemap(outname, cumerdep)
+    return dict((zone, erdepstats(cumerdep, mask)) for zone, mask in _shared["masks"].items())
+
+
+def _segments(elevmap):
+    """Read one replicate's map, and return the stats of every zone of the index."""
+    return _shared["index"].stats(_cumerdep(elevmap), _shared["percentiles"])
+
+
+def _values(args):
+    """Read one replicate's map, and return its values at the cells of the index."""
+    elevmap, outname = args
+    cumerdep = _cumerdep(elevmap)
+    if outname:
+        writemap(outname, cumerdep)
+    return _shared["index"].gather(cumerdep)
+
+
+def _run(func, jobs, processes, shared):
+    """Run func on every job, in a pool of worker processes that share some data."""
+    if processes == 1 or len(jobs) < 2:
+        _setup(shared)
+        return list(map(func, jobs))
+    pool = multiprocessing.Pool(processes, initializer=_setup, initargs=(shared,))
+    try:
+        return pool.map(func, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def cumerdepstats(elevmaps, initdem, masks, outnames=None, processes=None):
+    """
+    Erosion and deposition stats of every zone for many replicates. Returns a
+    dictionary with an array for each zone, with one row per replicate and one
+    column per stat in STATS.
+    elevmaps = names of the final DEMs of the replicates (or of existing
+        cumulative erosion/deposition maps, if initdem is None)
+    initdem = array of the initial DEM (see readmap), or None
+    masks = dictionary of boolean arrays of the zones, by zone name
+    outnames = names of cumulative erosion/deposition maps to write for each
+        replicate (optional, none are written by default)
+    processes = number of worker processes (defaults to the number of CPUs)
+    """
+    if outnames is None:
+        outnames = [None] * len(elevmaps)
+    results = _run(_replicate, list(zip(elevmaps, outnames)), processes, {"initdem": initdem, "masks": masks})
+    return dict((zone, np.array([r[zone] for r in results]).reshape(-1, len(STATS))) for zone in masks)
+
+
+def segmentstats(elevmaps, initdem, index, percentiles=(10, 50, 90), processes=None):
+    """
+    Sum, mean, and percentiles of the cumulative erosion/deposition along every
+    zone of a ZoneIndex (e.g. every stream segment) for many replicates.
+    Returns an array with one layer per replicate, one row per zone (in the
+    order of index.ids), and one column per stat.
+    elevmaps = names of the final DEMs of the replicates (or of existing
+        cumulative erosion/deposition maps, if initdem is None)
+    initdem = array of the initial DEM (see readmap), or None
+    index = ZoneIndex of the zones
+    percentiles = percentiles to compute for each zone
+    processes = number of worker processes (defaults to the number of CPUs)
+    """
+    results = _run(_segments, list(elevmaps), processes, {"initdem": initdem, "index": index, "percentiles": percentiles})
+    return np.array(results).reshape(-1, len(index), 2 + len(percentiles))
+
+
+def zonevalues(elevmaps, initdem, index, outnames=None, processes=None):
+    """
+    Cumulative erosion/deposition at every cell of the zones of a ZoneIndex
+    (e.g. every cell of a stream network) for many replicates. Returns an
+    array with one row per replicate and one column per cell (zone after
+    zone, in the order of index.ids), with NaN for null cells.
+    elevmaps = names of the final DEMs of the replicates (or of existing
+        cumulative erosion/deposition maps, if initdem is None)
+    initdem = array of the initial DEM (see readmap), or None
+    index = ZoneIndex of the zones
+    outnames = names of cumulative erosion/deposition maps to write for each
+        replicate (optional, none are written by default)
+    processes = number of worker processes (defaults to the number of CPUs)
+    """
+    if outnames is None:
+        outnames = [None] * len(elevmaps)
+    results = _run(_values, list(zip(elevmaps, outnames)), processes, {"initdem": initdem, "index": index})
+    return np.array(results).reshape(-1, len(index.cells))
@@ -51,6 +51,20 @@
 #% required: yes
 #% guisection: Simulation Control
 #%END
+#%option
+#% key: outinterval
+#% type: integer
+#% description: Only keep the yearly output maps of every this many years (and of the final year). The maps of the other years are removed as soon as the next year has been simulated from them.
+#% answer: 1
+#% guisection: Simulation Control
+#%END
+#%option
+#% key: writequeue
+#% type: integer
+#% description: Number of output jobs (writing this year's landcover and fertility maps and making their labels and color tables) that can wait for a background writer while the simulation goes on. If the writer falls further behind, the simulation waits for it. Set to 0 to do all the output work in the simulation loop.
+#% answer: 2
+#% guisection: Simulation Control
+#%END
 
 ##################################
 #Agent Properties
@@ -323,6 +337,13 @@
 #% guisection: Landcover Dynamics
 #%END
 #%option
+#% key: fireseed
+#% type: integer
+#% description: Seed for the random draws of natural fire ignitions (a new random seed is used for every run if not given)
+#% required: no
+#% guisection: Landcover Dynamics
+#%END
+#%option
 #% key: maxlcov
 #% type: string
 #% gisprompt: old,cell,raster
@@ -397,7 +418,7 @@
 #%option
 #% key: kt
 #% type: double
-#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate)
+#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate) (ignored: not used by the landscape evolution anymore)
 #% answer: 0.0001
 #% options: 0.001,0.0001,0.00001,0.000001
 #% guisection: Landscape Evolution
@@ -405,7 +426,7 @@
 #%option
 #% key: loadexp
 #% type: double
-#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport)
+#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport) (ignored: not used by the landscape evolution anymore)
 #% answer: 1.5
 #% options: 1.5,2.5
 #% guisection: Landscape Evolution
@@ -422,7 +443,7 @@
 #%option
 #% key: kappa
 #% type: double
-#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr]
+#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr] (ignored: not used by the landscape evolution anymore)
 #% answer: 1
 #% guisection: Landscape Evolution
 #%end
@@ -458,28 +479,28 @@
 #%option
 #% key: speed
 #% type: double
-#% description: Average velocity of flowing water in the drainage [m/s]
+#% description: Average velocity of flowing water in the drainage [m/s] (ignored: not used by the landscape evolution anymore)
 #% answer: 1.4
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff1
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow
+#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow (ignored: not used by the landscape evolution anymore)
 #% answer: 0
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff2
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 100
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff3
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 100
 #% guisection: Landscape Evolution
 #%end
@@ -534,33 +555,9 @@ import random
 import numpy
 import grass.script as grass
 
-#new random-poisson babymaker
-def babymaker(p, n): #p is the per capita birth rate, n is the population size
-    babys = (numpy.random.poisson(p*100)/100.)*n
-    return(int(babys))
-
-# old random-normal babymaker
-#def babymaker(p, n): #p is the per capita birth rate, n is the population size
-#    babys = 0
-#    for m in range(int(n)):
-#        x = numpy.random.random()
-#        if x < float(p):
-#            babys = babys + 1
-#    return(babys)
-
-#new random-poisson deathdealer
-def deathdealer(p, n): #p is the per capita death rate, n is the population size
-    deaths = (numpy.random.poisson(p*100)/100.)*n
-    return(int(deaths))
-
-#old random-normal deathdealer
-#def deathdealer(p, n): #p is the per capita death rate, n is the population size
-#    deaths = 0
-#    for m in range(int(n)):
-#        x = numpy.random.random()
-#        if x < float(p):
-#            deaths = deaths + 1
-#    return(deaths)
+# The mmllite package is installed in the same directory as this script
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from mmllite import agropast, fire, landcover, population, rules, writer, zonal
 
 #main block of code starts here
 def main():
@@ -577,6 +574,7 @@ def main():
     inlcov = options['inlcov']
     fireprob = options['fireprob']
     years = int(options['years'])
+    outinterval = max(int(options['outinterval']), 1)
     farmval = options['farmval']
     maxlcov = options['maxlcov']
     prfx = options['prfx']
@@ -618,15 +616,11 @@ def main():
     initbdrk = options["initbdrk"]
     k = options["k"]
     sdensity = options["sdensity"]
-    kappa = options["kappa"]
     manningn = options["manningn"]
-    cutoff1 = options["cutoff1"]
-    cutoff2 = options["cutoff2"]
-    cutoff3 = options["cutoff3"]
-    speed = options["speed"]
-    kt = options["kt"]
-    loadexp = options["loadexp"]
     smoothing = options["smoothing"]
+    #kappa, cutoff1-3, speed, kt, and loadexp were options of the old r.landscape.evol, and the landscape evolution does not use them anymore
+    for key in agropast.ignoredoptions(options, {"kappa": 1, "cutoff1": 0, "cutoff2": 100, "cutoff3": 100, "speed": 1.4, "kt": 0.0001, "loadexp": 1.5}):
+        grass.warning("%s=%s is ignored, as the landscape evolution does not use it anymore" % (key, options[key]))
     #these values could be read in from a climate file, so check that, and act accordingly
     rain2 = []
     try:
@@ -711,18 +705,23 @@ def main():
         if flags[flag] is True:
             levol_flags.append(flag)
     #check if maxlcov is a map or a number, and grab the actual max value for the stats file
+    #(and keep the maximum landcover in memory for the landcover updates)
     try:
         maxval = int(float(maxlcov))
-
+        maxlcovval = float(maxlcov)
     except:
         maxlcovdict = grass.parse_command('r.univar', flags = 'ge', map = maxlcov)
         maxval = int(float(maxlcovdict['max']))
+        maxlcovval = zonal.readmap(maxlcov)
+    #rainfall excess of every whole landcover class, worked out once
+    xstable = landcover.excesstable(maxval)
     #check if maxfert is a map or a number, and grab the actual max value for the stats file
+    #(and keep the maximum fertility in memory for the fertility updates)
     try:
-        maxfertval = int(float(maxfert))
+        maxfertarr = float(maxfert)
     except:
-        maxfertdict = grass.parse_command('r.univar', flags = 'ge', map = maxfert)
-        maxfertval = int(float(maxfertdict['max']))
+        maxfertarr = zonal.readmap(maxfert)
+    maxfertval = int(numpy.nanmax(maxfertarr))
     #set up the stats files names
     env = grass.gisenv()
     statsdir = os.path.join(env['GISDBASE'], env['LOCATION_NAME'], env['MAPSET'])
@@ -741,9 +740,23 @@ def main():
     fertcolors = tempfile.NamedTemporaryFile()
     fertcolors.write('0 white\n20 grey\n40 yellow\n60 orange\n80 brown\n100 black')
     fertcolors.flush()
+    #read the c-factor and landcover label rules once, into lookup tables of the landcover classes
+    try:
+        cfactrules = rules.Recode(cfact_rules)
+    except:
+        grass.fatal("NO CFACTOR RECLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
+    try:
+        lcrules = rules.Reclass(lc_rules)
+        lclabels = tempfile.NamedTemporaryFile(mode = "w")
+        lcrules.categories(lclabels.name)
+    except:
+        grass.warning("No landcover labling rules found at path \"%s\"\nOutput landcover maps will not have text labels in queries" % lc_rules)
+        lcrules = None
     #Figure out the number of cells per hectare and how many square meters per cell to use as conversion factors for yields
     region = grass.region()
     cellperhectare = 10000 / (float(region['nsres']) * float(region['ewres']))
+    #run the landscape evolution of each year in this process, with the common agropast engine
+    evolution = agropast.Evolution(statsout, region['nsres'], {"elev": elev, "initbdrk": initbdrk, "k": k, "sdensity": sdensity, "manningn": manningn, "smoothing": smoothing, "outdem": "Elevation_Map", "outsoil": "Soil_Depth_Map"}, levol_flags)
     #sqmeterpercell = (float(region['nsres']) * float(region['ewres']))
     #do same for farm field size
     fieldsperhectare = 10000 / (float(nsfieldsize) * float(ewfieldsize))
@@ -753,21 +766,30 @@ def main():
     #maxyield = (((1-float(agmix))*float(maxwheat))+(float(agmix)*float(maxbarley)))/fieldsperhectare
     #find out number of digits in 'years' for zero padding
     digits = len(str(abs(years)))
-    #set up the agent memory
-    farmingmemory = []
-    farmyieldmemory = []
-    grazingmemory = []
-    grazeyieldmemory = []
+    #find the cells of each fire probability stratum once, for drawing the natural fire ignitions every year
+    if options['fireseed']:
+        fireseed = int(options['fireseed'])
+    else:
+        fireseed = None
+    strata = fire.FireStrata(zonal.readmap(fireprob), seed = fireseed)
+    #set up the agent memory, as ring buffers of the last agentmem years
+    farmingmemory = population.Memory(agentmem)
+    farmyieldmemory = population.Memory(agentmem)
+    grazingmemory = population.Memory(agentmem)
+    grazeyieldmemory = population.Memory(agentmem)
     grass.message('Simulation will run for %s iterations.\n\n............................STARTING SIMULATION...............................' % years)
     # Before we get going on the loop, write out some basic information about the run. These can be used to remeber what the settings were for this particular run, as well as to provide some interpretation for the other stats files that will be made.
     f = open(statsdir + os.sep + prfx + '_run_info.txt', 'a')
     f.write("Variables used in the model:\ncell resolution (grazing patch size),%s\nagcatch,%s\nnsfieldsize,%s\newfieldsize,%s\ngrazecatch,%s\ngrazespatial,%s\ngrazepatchy,%s\nmaxgrazeimpact,%s\nmanurerate,%s\ninlcov,%s\nyears,%s\nfarmval,%s\nmaxfert,%s\nmaxwheat,%s\nmaxbarley,%s\nagmix,%s\nagentmem,%s\nnumpeople,%s\nanimals,%s\ncalculated agricultural ratio,%s\ncalculated pastoral ratio,%s\ncalculated cereal required per person,%s\ncalculated fodder required per animal,%s\ncalculated total cereal required,%s\ncalculated total number of animals required,%s\ncalculated total fodder required,%s\n\nFarming stats in Kg wheat and/or barley seeds per farmplot.\nGrazing stats in Kg of digestable matter per grazing plot. Note that this may also include stubble grazing if enabled." % (region['nsres'],agcatch,nsfieldsize,ewfieldsize,grazecatch,grazespatial,grazepatchy,maxgrazeimpact,manurerate,inlcov,years,farmval,maxfert,maxwheat,maxbarley,agmix,agentmem,numpeople,animals,agratio,pratio,indcerreq,fodder_anim,indfodreq,cerealreq,fodderreq)) 
     f.close()
+    #write this year's landcover and fertility maps in the background while the landcover is updated and the c-factor made (the writer is made here, so that it works in the full region)
+    output = writer.BackgroundWriter(options['writequeue'])
     #Set up loop
     for year in range(int(years)):
         now = str(year + 1).zfill(digits)
         then = str(year).zfill(digits)
         if numpeople == 0:
+            output.close()
             grass.fatal("Everybody is dead. \nSimulation stopped at year %s." % then)
         #grab the current climate vars from the lists
         rain = rain2[year]
@@ -804,30 +826,20 @@ def main():
         grass.run_command('g.region', quiet = 'True',nsres = nsfieldsize, ewres = ewfieldsize)
         #generate the yields
         grass.message("Calculating potential farming yields.....")
-        #Calculate the wheat yield map (kg/cell)
-        tempwheatreturn = "%stemporary_wheat_yields_map" % pid
-        grass.mapcalc("${tempwheatreturn}=eval(x=if(${precip} > 0, (0.51*log(${precip}))+1.03, 0), y=if(${sfertil} > 0, (0.28*log(${sfertil}))+0.87, 0), z=if(${sdepth} > 0, (0.19*log(${sdepth}))+1, 0), a=if(x <= 0 || z <= 0, 0, ((((x*y*z)/3)*${maxwheat})/${fieldsperhectare})), if(a < 0, 0, a))", quiet = "True", tempwheatreturn = tempwheatreturn, precip = precip, sfertil = oldfert, sdepth = oldsdepth, maxwheat = maxwheat, fieldsperhectare = fieldsperhectare)
-        #Calculate barley yield map (kg/cell)
-        tempbarleyreturn = "%stemporary_barley_yields_map" % pid
-        grass.mapcalc("${tempbarleyreturn}=eval(x=if(${precip} > 0, (0.48*log(${precip}))+1.51, 0), y=if(${sfertil} > 0, (0.34*log(${sfertil}))+1.09, 0), z=if(${sdepth} > 0, (0.18*log(${sdepth}))+0.98, 0), a=if(x <= 0 || z <= 0, 0, ((((x*y*z)/3)*${maxbarley})/${fieldsperhectare})), if(a < 0, 0, a))", quiet = "True", tempbarleyreturn = tempbarleyreturn, precip = precip, sfertil = oldfert, sdepth = oldsdepth, maxbarley = maxbarley, fieldsperhectare = fieldsperhectare)
-        #Create the desired cereal mix
+        #Calculate the potential yields (kg/field) of the desired cereal mix in the agricultural catchment
         tempcerealreturn = "%stemporary_cereal_yields_map" %pid
-        grass.mapcalc("${tempcerealreturn}=if(isnull(${agcatch}), null(),  (((1-${agmix})*${tempwheatreturn})+(${agmix}*${tempbarleyreturn})) )", quiet = "True", tempcerealreturn = tempcerealreturn, agmix = agmix, tempwheatreturn = tempwheatreturn, tempbarleyreturn = tempbarleyreturn, agcatch = agcatch)
+        cerealreturn = agropast.cerealyield(precip, zonal.readmap(oldfert), zonal.readmap(oldsdepth), float(maxwheat), float(maxbarley), float(agmix), fieldsperhectare)
+        zonal.writemap(tempcerealreturn, numpy.where(numpy.isnan(zonal.readmap(agcatch)), numpy.nan, cerealreturn))
         grass.message("Figuring out the farming plan for this year...")
         #gather some stats from yields maps in order to make an estimate of number of farm plots...
         cerealstats2 = grass.parse_command('r.univar', flags = 'ge', map = tempcerealreturn)
         # Grab the agent's current memory of farming yields to see what they think they need to do this year
-        if len(farmyieldmemory) is 0:
+        if len(farmyieldmemory) == 0:
             fuzzyyieldmemory = random.gauss(float(cerealstats2["mean"]), (float(cerealstats2['mean']) * 0.0333))
             fuzzydeficitmemory = -1
         else:
-            if agentmem > (year -1):
-                slicer = year - 1
-            else:
-                slicer = agentmem
-            grass.debug("slicer: %s" % slicer)
-            fuzzyyieldmemory = numpy.mean(farmyieldmemory[slicer:])
-            fuzzydeficitmemory = numpy.mean(farmingmemory[slicer:])
+            fuzzyyieldmemory = farmyieldmemory.mean()
+            fuzzydeficitmemory = farmingmemory.mean()
         #Figure out how many fields the agent thinks it needs based on current average yield
         numfields = int(round(float(cerealreq) / fuzzyyieldmemory))
         grass.debug("total fields should be %s" % numfields)
@@ -1023,12 +1035,12 @@ def main():
         #Now that we know where we are allowed to graze, how much of the grazing catchment does the agent think it needs to meet its remaining fodder requirements? First grab some general stats from the grazing catchment.
         fodderstats = grass.parse_command('r.univar', flags = 'ge', percentile = '90', map = tempgrazecatch)
         # Use the agent's memory of past grazing yields and deficits to determine what they think they need to do this year.
-        if len(grazeyieldmemory) is 0: #if it's the first year, then just use the fuzzed average potential yield from all cells in agcatch, and make the padded amount 1
+        if len(grazeyieldmemory) == 0: #if it's the first year, then just use the fuzzed average potential yield from all cells in agcatch, and make the padded amount 1
             fuzzygyieldmemory = random.gauss(float(fodderstats['mean']), (float(fodderstats['mean']) * 0.0333))
             fuzzygdeficitmemory = -1
         else:
-            fuzzygyieldmemory = numpy.mean(grazeyieldmemory[slicer:])
-            fuzzygdeficitmemory = numpy.mean(grazingmemory[slicer:])
+            fuzzygyieldmemory = grazeyieldmemory.mean()
+            fuzzygdeficitmemory = grazingmemory.mean()
         #Figure out how many grazing patches the agent thinks it needs based on current average patch yield
         numfoddercells = int(round(float(remainingfodder) / fuzzygyieldmemory))
         grass.debug("total graze patches should be %s" % numfoddercells)
@@ -1064,6 +1076,7 @@ def main():
                 #make the actual grazing impacts map
                 grass.mapcalc("${grazeimpacts}=if(${tempgrazecost} > ${cutoff}, null(), ${tempimpactg})", quiet = "True", grazeimpacts = grazeimpacts, tempimpactg = tempimpactg, tempgrazecost = tempgrazecost, cutoff = cutoff[-1])
             except:
+                output.close()
                 grass.fatal("Uh oh! Somethng wierd happened when figuring out this year\'s grazing catchment! Check your numbers and try again! Sorry!")
                 sys.exit(1)
         #now get some grazing yields stats
@@ -1096,10 +1109,10 @@ def main():
         # If the -p flag was checked, update population levels based on returns.
         if use_flags['p'] is True:
             if peoplefed / numpeople < starvthresh:     #Check if they starved this year and just die deaths if so
-                numpeople = numpeople - deathdealer(deathrate, numpeople)
+                numpeople = numpeople - agropast.deathdealer(deathrate, numpeople)
                 grass.message("Starved a bit this year, no births will occur. New population: %i" % numpeople)
             else: #otherwise, balance births and deaths, and adjust the population accordingly
-                numpeople = numpeople + babymaker(birthrate, numpeople) - deathdealer(deathrate, numpeople)
+                numpeople = numpeople + agropast.babymaker(birthrate, numpeople) - agropast.deathdealer(deathrate, numpeople)
                 grass.message("Balancing births and deaths... New population: %i" % numpeople)
             # Update labor and yeild needs
             cereal_pers = numpeople * agratio
@@ -1109,23 +1122,9 @@ def main():
             totlabor = numpeople * aglabor
             maxfields = int(round(totlabor / fieldlabor))
         # Calculate natural (lightning-caused) fire ignition on the landscape
-        # parse fire probability map into three with mapcalc:
-        lowprobmap = "%stemp_fireprob_low" % pid
-        medprobmap = "%stemp_fireprob_med" % pid
-        hiprobmap = "%stemp_fireprob_hi" % pid
-        # Hardcoding cutoffs for no, low, medium, high probability based on histogram of spanish fire probability map.
-        grass.mapcalc("${lowprobmap}=if(${fireprob} <= 0.2, 1, null())", quiet = "True", fireprob=fireprob, lowprobmap=lowprobmap)
-        grass.mapcalc("${medprobmap}=if(${fireprob} > 0.2 || ${fireprob} <= 0.6, 1, null())", quiet = "True", fireprob=fireprob, medprobmap=medprobmap)
-        grass.mapcalc("${hiprobmap}=if(${fireprob} > 0.6, 1, null())", quiet = "True", fireprob=fireprob, hiprobmap=hiprobmap)
-        # randomly sample each of these maps at different densities (find out actual densities from Grant):
-        fires1 = "%sfires_low" % pid
-        fires2 = "%sfires_med" % pid
-        fires3 = "%sfires_hi" % pid
-        grass.run_command('r.random', quiet = 'True', input=lowprobmap, raster=fires1, npoints="5%")
-        grass.run_command('r.random', quiet = 'True', input=medprobmap, raster=fires2, npoints="10%")
-        grass.run_command('r.random', quiet = 'True', input=hiprobmap, raster=fires3, npoints="15%")
-        # patch those back to make final map of fire locations
-        grass.run_command('r.patch', input="%s,%s,%s" % (fires1,fires2,fires3), output=natural_fires)
+        # by drawing a share of the cells of each fire probability stratum
+        fires = strata.mask()
+        fire.writefires(natural_fires, fires)
         #write the yield stats to the stats file
         grass.message('Writing some farming and grazing stats from this year....')
         f = open(textout3, 'a')
@@ -1139,29 +1138,32 @@ def main():
         #use r.surf.gaussian to cacluate fertily regain map
         grass.run_command('r.surf.gauss', quiet = "True", output = tempfertil, mean = fertilrate[0], sigma = fertilrate[1])
         #figure out what happened to fertility (see if stubble-grazing is enabled, and make sure to add some manure where grazing occured, scaled to the degree of graing that happened)
-        if use_flags['g'] is False:
-            grass.mapcalc("${outfert}=eval(a=if(isnull(${grazeimpacts}) && isnull(${fields}), ${tempfertil}, ${tempfertil} + (${manurerate} * ${tempimpactg})), b=if(isnull(${fields}), ${oldfert}, ${oldfert} - ${fields}), c=if(b <= ${maxfert} - a, b + a, ${maxfert}), if(c < 0, 0, c))", quiet = "True", outfert = outfert, oldfert = oldfert, fields = fields, tempimpactg = tempimpactg, grazeimpacts = grazeimpacts, manurerate = manurerate, maxfert = maxfert, tempfertil = tempfertil)
-        else:
-            grass.mapcalc("${outfert}=eval(a=if(isnull(${grazeimpacts}), ${tempfertil}, ${tempfertil} + (${manurerate} * ${tempimpactg})), b=if(isnull(${fields}), ${oldfert}, ${oldfert} - ${fields}), if(b <= ${maxfert} - a, b + a, ${maxfert}))", quiet = "True", outfert = outfert, oldfert = oldfert, fields = fields, tempimpactg = tempimpactg, grazeimpacts = grazeimpacts, manurerate = manurerate, maxfert = maxfert, tempfertil = tempfertil)
-        grass.run_command('r.colors', quiet = "True", map = outfert, rules = fertcolors.name)
+        fertarr = agropast.fertility(zonal.readmap(oldfert), zonal.readmap(fields), zonal.readmap(grazeimpacts), zonal.readmap(tempimpactg), zonal.readmap(tempfertil), float(manurerate), maxfertarr, stubble = use_flags['g'] is False)
+        #(written in the background, while the landcover is updated)
+        output.submit(zonal.writemaps, [(outfert, fertarr)], colors = {outfert: fertcolors.name}, env = output.env)
         #update landcover
         # calculating rate of regrowth based on current soil fertility, spil depths, and precipitation. Recoding fertility (0 to 100%), depth (0 to >= 1m), and precip (0 to >= 1000mm) with a power regression curve from 0 to 1, then taking the mean of the two as the regrowth rate
-        growthrate = "%stemporary_vegetation_regrowth_map" % pid
-        grass.mapcalc('${growthrate}=eval(x=if(${sdepth} <= 1.0, ( -0.000118528 * (exp((100*${sdepth}),2.0))) + (0.0215056 * (100*${sdepth})) + 0.0237987, 1), y=if(${precip} <= 1.0, ( -0.000118528 * (exp((100*${precip}),2.0))) + (0.0215056 * (100*${precip})) + 0.0237987, 1), z=(-0.000118528 * (exp(${outfert},2.0))) + (0.0215056 * ${outfert}) + 0.0237987, a=if(x <= 0 || z <= 0, 0, (x+y+z)/3), if(a < 0, 0, a) )', quiet = "True", growthrate = growthrate,  sdepth = oldsdepth, outfert = outfert, precip = precip)
-        #Calculate this year's landcover impacts and regrowth
-        grass.mapcalc("${outlcov}=eval(a=if(${oldlcov} - ${grazeimpacts} + ${growthrate} >= 0, ${oldlcov} - ${grazeimpacts} + ${growthrate}, 0) , b=if(isnull(${fields}), a, ${farmval}), if(${oldlcov} < (${maxlcov} - ${growthrate}) && isnull(b), ${oldlcov} + ${growthrate}, if(isnull(b), ${maxlcov}, b) ))", quiet = "True", outlcov = outlcov, oldlcov = oldlcov, maxlcov = maxlcov, growthrate = growthrate, fields = fields, farmval = farmval, grazeimpacts = grazeimpacts)
-        #If there was a fire, vegetation goes to 0 no matter what was there.
-        grass.mapcalc("${outlcov}=if(isnull(${natural_fires}), ${outlcov}, 0)", quiet = "True", overwrite = "True", outlcov = outlcov, natural_fires = natural_fires)
-        #Make a rainfall excess map to send to r.landcape.evol. This is a logarithmic regression (R^2=0.99.) for the data pairs: 0,90;3,85;8,70;13,60;19,45;38,30;50,20. These are the same succession cutoffs that are used in the c-factor coding.
-        grass.mapcalc("${outxs}=193.522 - (42.3272 * log(${lcov} + 10.9718))", quiet = "True", outxs = outxs, lcov = outlcov)
-        #if rules set exists, create reclassed landcover labels map
-        try:
-            temp_reclass = "%stemporary_reclassed_landcover" %pid
-            grass.run_command('r.reclass', quiet = "True",  input = outlcov,  output = temp_reclass,  rules = lc_rules)
-            grass.mapcalc('${out}=${input}', quiet = "True", overwrite = "True", out = outlcov, input = temp_reclass)
-        except:
-            grass.warning("No landcover labling rules found at path \"%s\"\nOutput landcover map will not have text labels in queries" % lc_rules)
-        grass.run_command('r.colors',  quiet = "True",  map = outlcov, rules = lccolors.name)
+        growthrate = landcover.growthrate(zonal.readmap(oldsdepth), precip, fertarr)
+        #Calculate this year's landcover impacts and regrowth in one pass, and if there was a fire, vegetation goes to 0 no matter what was there. The fire stats come out of the same pass.
+        lcovarr, firestats = landcover.update(zonal.readmap(oldlcov), growthrate, zonal.readmap(grazeimpacts), zonal.readmap(fields), farmval, maxlcovval, fires)
+        #Make a rainfall excess array to send to the landscape evolution. This is a logarithmic regression (R^2=0.99.) for the data pairs: 0,90;3,85;8,70;13,60;19,45;38,30;50,20. These are the same succession cutoffs that are used in the c-factor coding. It is looked up from the table of the landcover classes when the landcover is in whole classes, and only written out as a map if the maps are to be kept.
+        excess = landcover.rainfallexcess(lcovarr, xstable)
+        if use_flags['c'] is True:
+            zonal.writemap(outxs, excess)
+        #if rules set exists, reclass the landcover with its labels (in memory, where it is kept for the c-factor map), and write it in the background
+        if lcrules is not None:
+            lcovarr = lcrules(lcovarr)
+            output.submit(zonal.writemaps, [(outlcov, lcovarr)], integer = [outlcov], labels = {outlcov: lclabels.name}, colors = {outlcov: lccolors.name}, env = output.env)
+        else:
+            output.submit(zonal.writemaps, [(outlcov, lcovarr)], colors = {outlcov: lccolors.name}, env = output.env)
+        #creating c-factor array (from the landcover classes in memory) while they are written. It is only written out as a map if the maps are to be kept
+        grass.message('Creating C-factor map for r.landscape.evol')
+        cfactor = cfactrules(lcovarr)
+        if use_flags['c'] is True:
+            zonal.writemap(outcfact, cfactor)
+            grass.run_command('r.colors',  quiet = True, map = outcfact, rules = cfcolors.name)
+        #the landcover and fertility maps have to be written before their stats are taken
+        output.wait()
         #collect and write landcover and fertiltiy temporal matrices
         grass.message('Collecting some landcover and fertility stats from this year....')
         f = open(textout, 'a')
@@ -1197,20 +1199,12 @@ def main():
         grass.mapcalc("MASK=if(isnull(${agcatch}), null(), 1)", quiet = "True", overwrite = "True", agcatch = agcatch)
         fertstats = grass.parse_command('r.univar', flags = 'ge', percentile = '90', map = outfert)
         grass.run_command('g.remove', quiet = "True", flags = "f", type = "rast", name = "MASK")
-        #grab some fire stats
-        firestats = grass.parse_command('r.univar', flags = 'ge', percentile = '90', map = natural_fires)
+        #format the fire stats from the landcover update as r.univar does (there are none if nothing burned)
+        firestats = dict((key, "%.15g" % value) for key, value in firestats.items())
         f = open(textout4, 'a')
         if os.path.getsize(textout4) == 0:
             f.write("Landcover, Fire, and Soil Fertility Stats\nNote that Land cover stats are collected within the grazing catchment and fertility stats in the agricultural catchment (fertility) ONLY. Fire stats are collected across the whole map. \n\n,,Basic Stats,,,,Extended Stats\nYear,,Mean Landcover,Standard Deviation Landcover,Mean Soil Fertility,Standard Deviation Soil Fertility,,Minimum Landcover,First Quartile Landcover,Median Landcover,Third Quartile Landcover,Maximum Landcover,,Minimum Soil Fertility,First Quartile Soil Fertility,Median Soil Fertility,Third Quartile Soil Fertility,Maximum Soil Fertility")
-        f.write('\n%s' % now + ',,' + lcovstats['mean'] + ',' + firestats['stddev'] + ',,' + firestats['mean'] + ',' + firestats['stddev'] + ',' + fertstats['mean'] + ',' + fertstats['stddev'] + ',,' + lcovstats['max'] + ',' + lcovstats['third_quartile'] + ',' + lcovstats['median'] + ',' + lcovstats['first_quartile'] + ',' + lcovstats['min'] + ',,' + fertstats['min'] + ',' + fertstats['first_quartile'] + ',' + fertstats['median'] + ',' + fertstats['third_quartile'] + ',' + fertstats['max'])
-        #creating c-factor map
-        grass.message('Creating C-factor map for r.landscape.evol')
-        try:
-            grass.run_command('r.recode', quiet = True, input = outlcov, output = outcfact, rules = cfact_rules)
-        except:
-            grass.fatal("NO CFACTOR RECLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
-            sys.exit(1)
-        grass.run_command('r.colors',  quiet = True, map = outcfact, rules = cfcolors.name)
+        f.write('\n%s' % now + ',,' + lcovstats['mean'] + ',' + firestats.get('stddev', '') + ',,' + firestats.get('mean', '') + ',' + firestats.get('stddev', '') + ',' + fertstats['mean'] + ',' + fertstats['stddev'] + ',,' + lcovstats['max'] + ',' + lcovstats['third_quartile'] + ',' + lcovstats['median'] + ',' + lcovstats['first_quartile'] + ',' + lcovstats['min'] + ',,' + fertstats['min'] + ',' + fertstats['first_quartile'] + ',' + fertstats['median'] + ',' + fertstats['third_quartile'] + ',' + fertstats['max'])
         #Run r.landscape.evol with this years' cfactor map
         grass.message('Running landscape evolution for this year....')
         #set the prefix for r.landscape.evol output files
@@ -1221,21 +1215,24 @@ def main():
         else:
             inelev = "%s_Year_%s_Elevation_Map" % (prfx, then)
         try:
-            grass.run_command('r.landscape.evol', quiet = "True", number = 1, prefx = prefix, c = outcfact, elev = inelev, initbdrk = initbdrk, outdem = "Elevation_Map", outsoil = "Soil_Depth_Map", r = r, k = k, sdensity = sdensity, kappa = kappa, manningn = manningn, flowcontrib = outxs, cutoff1 = cutoff1, cutoff2 = cutoff2, cutoff3 = cutoff3, rain = rain, storms = storms, stormlength = stormlength, speed = speed, kt = kt, loadexp = loadexp, smoothing = smoothing, statsout = statsout, flags = ''.join(levol_flags))
+            evolution.step(prefix, inelev, cfactor, r, rain, storms, stormlength, flowcontrib = excess)
         except:
+            output.close()
             grass.fatal("Something is wrong with the values you sent to r.landscape.evol. Did you forget something? Check the values and try again...\nSimulation terminated with an error at time step %s" % now)
             sys.exit(1)
-        #delete C-factor map, unless asked to save it
-        if use_flags['c'] is False:
-            grass.run_command("g.remove", quiet = "True", flags = 'f', type = "rast", name = "%s,%s" %  (outcfact,outxs))
-        else:
-            pass
         #clean up temporary maps
         grass.run_command('g.remove', quiet = "True", flags = 'f', type = "rast", pattern = '%s*' % pid)
+        #last year's maps are not needed anymore, so remove them unless they are to be kept
+        if year % outinterval != 0:
+            grass.run_command('g.remove', quiet = "True", flags = 'f', type = "rast", pattern = '%s_Year_%s_*' % (prfx, then))
         grass.message('Completed year %s of the simulation' % now)
+    output.close()
+    evolution.close()
     lccolors.close()
     cfcolors.close()
     fertcolors.close()
+    if lcrules is not None:
+        lclabels.close()
     return(grass.message(".........................SIMULATION COMPLETE...........................\nCheck in the current mapset for farming/grazing yields, landcover, fertility, and erosion/depostion stats files from this run."))
 
 
@@ -51,6 +51,20 @@
 #% required: yes
 #% guisection: Simulation Control
 #%END
+#%option
+#% key: outinterval
+#% type: integer
+#% description: Only keep the yearly output maps of every this many years (and of the final year). The maps of the other years are removed as soon as the next year has been simulated from them.
+#% answer: 1
+#% guisection: Simulation Control
+#%END
+#%option
+#% key: writequeue
+#% type: integer
+#% description: Number of output jobs (writing this year's landcover and fertility maps and making their labels and color tables) that can wait for a background writer while the simulation goes on. If the writer falls further behind, the simulation waits for it. Set to 0 to do all the output work in the simulation loop.
+#% answer: 2
+#% guisection: Simulation Control
+#%END
 
 ##################################
 #Agent Properties
@@ -397,7 +411,7 @@
 #%option
 #% key: kt
 #% type: double
-#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate)
+#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate) (ignored: not used by the landscape evolution anymore)
 #% answer: 0.0001
 #% options: 0.001,0.0001,0.00001,0.000001
 #% guisection: Landscape Evolution
@@ -405,7 +419,7 @@
 #%option
 #% key: loadexp
 #% type: double
-#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport)
+#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport) (ignored: not used by the landscape evolution anymore)
 #% answer: 1.5
 #% options: 1.5,2.5
 #% guisection: Landscape Evolution
@@ -422,7 +436,7 @@
 #%option
 #% key: kappa
 #% type: double
-#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr]
+#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr] (ignored: not used by the landscape evolution anymore)
 #% answer: 1
 #% guisection: Landscape Evolution
 #%end
@@ -458,28 +472,28 @@
 #%option
 #% key: speed
 #% type: double
-#% description: Average velocity of flowing water in the drainage [m/s]
+#% description: Average velocity of flowing water in the drainage [m/s] (ignored: not used by the landscape evolution anymore)
 #% answer: 1.4
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff1
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow
+#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow (ignored: not used by the landscape evolution anymore)
 #% answer: 0
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff2
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 100
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff3
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 100
 #% guisection: Landscape Evolution
 #%end
@@ -529,6 +543,7 @@
 
 import sys
 import os
+import tempfile
 
 #CAN NUMPY BE USED FOR RANDOM GAUSS, REDUCING DEPENDENCIES?
 import random
@@ -537,15 +552,9 @@ import random
 import numpy
 import grass.script as grass
 
-# New random-poisson babymaker
-def babymaker(p, n): #p is the per capita birth rate, n is the population size
-    babys = (numpy.random.poisson(p*100)/100.)*n
-    return(int(babys))
-
-# New random-poisson deathdealer
-def deathdealer(p, n): #p is the per capita death rate, n is the population size
-    deaths = (numpy.random.poisson(p*100)/100.)*n
-    return(int(deaths))
+# The mmllite package is installed in the same directory as this script
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from mmllite import agropast, landcover, population, rules, writer, zonal
 
 # Main block of code starts here
 def main():
@@ -562,6 +571,7 @@ def main():
     manurerate = options['manurerate']
     inlcov = options['inlcov']
     years = int(options['years'])
+    outinterval = max(int(options['outinterval']), 1)
     farmval = options['farmval']
     maxlcov = options['maxlcov']
     p = options['prefx'] + "_"
@@ -603,6 +613,11 @@ def main():
     elev = options["elev"]
     initbdrk = options["initbdrk"]
 
+    # kappa, cutoff1-3, speed, kt, and loadexp were options of the old
+    # r.landscape.evol, and the landscape evolution does not use them anymore
+    for key in agropast.ignoredoptions(options, {"kappa": 1, "cutoff1": 0, "cutoff2": 100, "cutoff3": 100, "speed": 1.4, "kt": 0.0001, "loadexp": 1.5}):
+        grass.warning("%s=%s is ignored, as the landscape evolution does not use it anymore" % (key, options[key]))
+
     # These values could be read in from a climate file, so check that, and act accordingly
     rain2 = []
     try:
@@ -698,19 +713,45 @@ def main():
             levol_flags.append(flag)
 
     # Check if maxlcov is a map or a number, and grab the actual max value for the stats file
+    # (and keep the maximum landcover in memory for the landcover updates)
     try:
-        maxval = int(float(maxlcov))
+        maxlcovarr = float(maxlcov)
+    except:
+        maxlcovarr = zonal.readmap(maxlcov)
+    maxval = int(numpy.nanmax(maxlcovarr))
+    # Rainfall excess of every whole landcover class, worked out once
+    xstable = landcover.excesstable(maxval)
 
+    # Read the c-factor and landcover label rules once, into lookup tables of
+    # the landcover classes
+    try:
+        cfactrules = rules.Recode(cfact_rules)
     except:
-        maxlcovdict = grass.parse_command('r.univar', flags = 'ge', map = maxlcov)
-        maxval = int(float(maxlcovdict['max']))
+        grass.fatal("NO CFACTOR RECLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
+    try:
+        lcrules = rules.Reclass(lc_rules)
+        lclabels = tempfile.NamedTemporaryFile(mode = "w")
+        lcrules.categories(lclabels.name)
+    except:
+        grass.warning("No landcover labling rules found at path \"%s\"\nOutput landcover maps will not have text labels in queries" % lc_rules)
+        lcrules = None
+
+    # Color rules for the landcover and soil fertility maps, in files that
+    # the background writer can read
+    lccolors = tempfile.NamedTemporaryFile(mode = "w")
+    lccolors.write('\n'.join(['0 grey', '10 red', '20 orange', '30 brown', '40 yellow', '%s green' % maxval]))
+    lccolors.flush()
+    fertcolors = tempfile.NamedTemporaryFile(mode = "w")
+    fertcolors.write('\n'.join(['0 white', '20 grey', '40 yellow', '60 orange', '80 brown', '100 black']))
+    fertcolors.flush()
 
     # Check if maxfert is a map or a number, and grab the actual max value for the stats file
+    # (and keep the maximum fertility in memory for the fertility updates)
     try:
-        maxfertval = int(float(maxfert))
+        maxfertarr = float(maxfert)
     except:
-        maxfertdict = grass.parse_command('r.univar', flags = 'ge', map = maxfert)
-        maxfertval = int(float(maxfertdict['max']))
+        maxfertarr = zonal.readmap(maxfert)
+    maxfertval = int(numpy.nanmax(maxfertarr))
 
     # Set up the stats files names
     env = grass.gisenv()
@@ -726,14 +767,19 @@ def main():
     region = grass.region()
     cellperhectare = 10000 / (float(region['nsres']) * float(region['ewres']))
 
+    # Run the landscape evolution of each year in this process, with the
+    # common agropast engine (and the map names of r.landscape.evol2, which
+    # are overwritten every year)
+    evolution = agropast.Evolution(statsout, region['nsres'], {"elev": elev, "initbdrk": initbdrk, "k": options["k"], "sdensity": options["sdensity"], "manningn": options["manningn"], "smoothing": options["smoothing"], "outdem": "Elevation_Map0001", "outsoil": "Soil_Depth_Map0001"}, levol_flags)
+
     # Do same for farm field size
     fieldsperhectare = 10000 / (float(nsfieldsize) * float(ewfieldsize))
 
     # Set up the agent memory
-    farmingmemory = []
-    farmyieldmemory = []
-    grazingmemory = []
-    grazeyieldmemory = []
+    farmingmemory = population.Memory(agentmem)
+    farmyieldmemory = population.Memory(agentmem)
+    grazingmemory = population.Memory(agentmem)
+    grazeyieldmemory = population.Memory(agentmem)
 
     grass.message('Simulation will run for %s iterations.\n\n............................STARTING SIMULATION...............................' % years)
     # Before we get going on the loop, write out some basic information about
@@ -744,11 +790,17 @@ def main():
     f.write("Variables used in the model:\ncell resolution (grazing patch size),%s\nagcatch,%s\nnsfieldsize,%s\newfieldsize,%s\ngrazecatch,%s\ngrazespatial,%s\ngrazepatchy,%s\nmaxgrazeimpact,%s\nmanurerate,%s\ninlcov,%s\nyears,%s\nfarmval,%s\nmaxfert,%s\nmaxwheat,%s\nmaxbarley,%s\nagmix,%s\nagentmem,%s\nnumpeople,%s\nanimals,%s\ncalculated agricultural ratio,%s\ncalculated pastoral ratio,%s\ncalculated cereal required per person,%s\ncalculated fodder required per animal,%s\ncalculated total cereal required,%s\ncalculated total number of animals required,%s\ncalculated total fodder required,%s\n\nFarming stats in Kg wheat and/or barley seeds per farmplot.\nGrazing stats in Kg of digestable matter per grazing plot. Note that this may also include stubble grazing if enabled." % (region['nsres'],agcatch,nsfieldsize,ewfieldsize,grazecatch,grazespatial,grazepatchy,maxgrazeimpact,manurerate,inlcov,years,farmval,maxfert,maxwheat,maxbarley,agmix,agentmem,numpeople,animals,agratio,pratio,indcerreq,fodder_anim,indfodreq,cerealreq,fodderreq))
     f.close()
 
+    # Write this year's landcover and fertility maps in the background while
+    # the landcover is updated and the c-factor made (the writer is made
+    # here, so that it works in the full region)
+    output = writer.BackgroundWriter(options['writequeue'])
+
     # Set up loop
     for x in range(int(years)):
         o = x + 1
         m = x
         if numpeople == 0:
+            output.close()
             grass.fatal("Everybody is dead. \nSimulation stopped at year %s." % m)
 
         # Grab the current climate vars from the lists
@@ -789,7 +841,7 @@ def main():
         # Run farming impacts method
         # farmImpacts():
         # needs these variables: precip, sfertil, sdepth, maxwheat, maxbarley, fieldsperhectare, agmix, agcatch, farmyieldmemory, cerealstats2, fuzzydeficitmemory, agentmem, cerealreq, maxfields
-        # produces these variables: tempfields, tempimpacta, tempwheatreturn, tempbarleyreturn, tempcerealreturn, cerealstats2, fuzzyyieldmemory, fuzzydeficitmemory, slicer, numfields, fieldpad
+        # produces these variables: tempfields, tempimpacta, tempcerealreturn, cerealstats2, fuzzyyieldmemory, fuzzydeficitmemory, numfields, fieldpad
 
         # ***GENERATE FARM IMPACTS***
         # Create some temp map names
@@ -803,46 +855,11 @@ def main():
         # Generate the yields
         grass.message("Calculating potential farming yields.....")
 
-        # Calculate the wheat yield map (kg/cell)
-        tempwheatreturn = "%stemporary_wheat_yields_map" % pid
-        e = '''${tempwheatreturn} = eval(x = if(${precip} > 0, (0.51*log(${precip}))+1.03, 0), \
-                                         y = if(${sfertil} > 0, (0.28*log(${sfertil}))+0.87, 0), \
-                                         z = if(${sdepth} > 0, (0.19*log(${sdepth}))+1, 0), \
-                                         a = if(x <= 0 || z <= 0, 0, ((((x*y*z)/3)*${maxwheat})/${fieldsperhectare})), \
-                                         if(a < 0, 0, a))'''
-        twr = grass.mapcalc_start (e,  quiet = True,
-                      tempwheatreturn = tempwheatreturn,
-                      precip = precip,
-                      sfertil = oldfert,
-                      sdepth = oldsdepth,
-                      maxwheat = maxwheat,
-                      fieldsperhectare = fieldsperhectare)
-
-        # Calculate barley yield map (kg/cell)
-        tempbarleyreturn = "%stemporary_barley_yields_map" % pid
-        e = '''${tempbarleyreturn} = eval(x = if(${precip} > 0, (0.48*log(${precip}))+1.51, 0), \
-                                          y = if(${sfertil} > 0, (0.34*log(${sfertil}))+1.09, 0), \
-                                          z = if(${sdepth} > 0, (0.18*log(${sdepth}))+0.98, 0), \
-                                          a = if(x <= 0 || z <= 0, 0, ((((x*y*z)/3)*${maxbarley})/${fieldsperhectare})), \
-                                          if(a < 0, 0, a))'''
-        tbr = grass.mapcalc_start(e, quiet = True,
-                      tempbarleyreturn = tempbarleyreturn,
-                      precip = precip,
-                      sfertil = oldfert,
-                      sdepth = oldsdepth,
-                      maxbarley = maxbarley,
-                      fieldsperhectare = fieldsperhectare)
-
-        twr.wait(), tbr.wait()
-
-        # Create the desired cereal mix
+        # Calculate the potential yields (kg/field) of the desired cereal mix
+        # in the agricultural catchment
         tempcerealreturn = "%stemporary_cereal_yields_map" %pid
-        e = '''${tempcerealreturn} = if(isnull(${agcatch}), null(), (((1-${agmix})*${tempwheatreturn})+(${agmix}*${tempbarleyreturn})) )'''
-        grass.mapcalc(e, quiet = True,
-                      tempcerealreturn = tempcerealreturn,
-                      agmix = agmix, tempwheatreturn = tempwheatreturn,
-                      tempbarleyreturn = tempbarleyreturn,
-                      agcatch = agcatch)
+        cerealreturn = agropast.cerealyield(precip, zonal.readmap(oldfert), zonal.readmap(oldsdepth), float(maxwheat), float(maxbarley), float(agmix), fieldsperhectare)
+        zonal.writemap(tempcerealreturn, numpy.where(numpy.isnan(zonal.readmap(agcatch)), numpy.nan, cerealreturn))
 
         grass.message("Figuring out the farming plan for this year...")
 
@@ -852,17 +869,12 @@ def main():
 
         # Grab the agent's current memory of farming yields to see what they
         # think they need to do this year
-        if len(farmyieldmemory) is 0:
+        if len(farmyieldmemory) == 0:
             fuzzyyieldmemory = random.gauss(float(cerealstats2["mean"]), (float(cerealstats2['mean']) * 0.0333))
             fuzzydeficitmemory = -1
         else:
-            if agentmem > (m - 1):
-                slicer = m - 1
-            else:
-                slicer = agentmem
-            grass.debug("slicer: %s" % slicer)
-            fuzzyyieldmemory = numpy.mean(farmyieldmemory[slicer:])
-            fuzzydeficitmemory = numpy.mean(farmingmemory[slicer:])
+            fuzzyyieldmemory = farmyieldmemory.mean()
+            fuzzydeficitmemory = farmingmemory.mean()
 
             grass.debug("farmyieldmemory: %s" % farmyieldmemory)
             grass.debug("fuzzyyieldmemory: %s" % fuzzyyieldmemory)
@@ -1073,15 +1085,15 @@ def main():
 
         # Use the agent's memory of past grazing yields and deficits to
         # determine what they think they need to do this year.
-        if len(grazeyieldmemory) is 0:
+        if len(grazeyieldmemory) == 0:
             # If it's the first year, then just use the fuzzed average
             # potential yield from all cells in agcatch, and make the padded
             # amount 1
             fuzzygyieldmemory = random.gauss(float(fodderstats['mean']), (float(fodderstats['mean']) * 0.0333))
             fuzzygdeficitmemory = -1
         else:
-            fuzzygyieldmemory = numpy.mean(grazeyieldmemory[slicer:])
-            fuzzygdeficitmemory = numpy.mean(grazingmemory[slicer:])
+            fuzzygyieldmemory = grazeyieldmemory.mean()
+            fuzzygdeficitmemory = grazingmemory.mean()
 
         # Figure out how many grazing patches the agent thinks it needs based
         # on current average patch yield
@@ -1150,6 +1162,7 @@ def main():
                               cutoff = cutoff[-1])
 
             except:
+                output.close()
                 grass.fatal("Uh oh! Somethng wierd happened when figuring out this year\'s grazing catchment! Check your numbers and try again! Sorry!")
                 sys.exit(1)
 
@@ -1203,10 +1216,10 @@ def main():
         # If the -p flag was checked, update population levels based on returns.
         if use_flags['p'] is True:
             if peoplefed / numpeople < starvthresh:     #Check if they starved this year and just die deaths if so
-                numpeople = numpeople - deathdealer(deathrate, numpeople)
+                numpeople = numpeople - agropast.deathdealer(deathrate, numpeople)
                 grass.message("Starved a bit this year, no births will occur. New population: %i" % numpeople)
             else: #otherwise, balance births and deaths, and adjust the population accordingly
-                numpeople = numpeople + babymaker(birthrate, numpeople) - deathdealer(deathrate, numpeople)
+                numpeople = numpeople + agropast.babymaker(birthrate, numpeople) - agropast.deathdealer(deathrate, numpeople)
                 grass.message("Balancing births and deaths... New population: %i" % numpeople)
             # Update labor and yeild needs
             cereal_pers = numpeople * agratio
@@ -1275,104 +1288,59 @@ def main():
         grass.run_command('r.surf.gauss', quiet = True, output = tempfertil, mean = fertilrate[0], sigma = fertilrate[1])
 
         # Figure out what happened to fertility (see if stubble-grazing is enabled, and make sure to add some manure where grazing occured, scaled to the degree of graing that happened)
-        if use_flags['g'] is False:
-            e = '''${outfert} = eval(a = if(isnull(${grazeimpacts}) && isnull(${fields}), ${tempfertil}, ${tempfertil} + (${manurerate} * ${tempimpactg})), \
-                                     b = if(isnull(${fields}), ${oldfert}, ${oldfert} - ${fields}), \
-                                     c = if(b <= ${maxfert} - a, b + a, ${maxfert}), if(c < 0, 0, c))'''
-            grass.mapcalc(e, quiet = True,
-                          outfert = outfert,
-                          oldfert = oldfert,
-                          fields = fields,
-                          tempimpactg = tempimpactg,
-                          grazeimpacts = grazeimpacts,
-                          manurerate = manurerate,
-                          maxfert = maxfert,
-                          tempfertil = tempfertil)
-
-        else:
-            e = '''${outfert} = eval(a = if(isnull(${grazeimpacts}), ${tempfertil}, ${tempfertil} + (${manurerate} * ${tempimpactg})), \
-                                     b = if(isnull(${fields}), ${oldfert}, ${oldfert} - ${fields}), \
-                                     if(b <= ${maxfert} - a, b + a, ${maxfert}))'''
-            grass.mapcalc(e, quiet = True,
-                          outfert = outfert,
-                          oldfert = oldfert,
-                          fields = fields,
-                          tempimpactg =
-                          tempimpactg,
-                          grazeimpacts = grazeimpacts,
-                          manurerate = manurerate,
-                          maxfert = maxfert,
-                          tempfertil = tempfertil)
-
-        fertcolors = ['0 white', '20 grey', '40 yellow', '60 orange', '80 brown', '100 black']
-        fc = grass.feed_command('r.colors', quiet = True, map = outfert, rules = "-")
-        fc.stdin.write('\n'.join(fertcolors))
-        fc.stdin.close()
+        fieldsarr = zonal.readmap(fields)
+        grazearr = zonal.readmap(grazeimpacts)
+        fertarr = agropast.fertility(zonal.readmap(oldfert), fieldsarr, grazearr, zonal.readmap(tempimpactg), zonal.readmap(tempfertil), float(manurerate), maxfertarr, stubble = use_flags['g'] is False)
+        # (written in the background, while the landcover is updated)
+        output.submit(zonal.writemaps, [(outfert, fertarr)], colors = {outfert: fertcolors.name}, env = output.env)
 
         # Update landcover
         # Calculating rate of regrowth based on current soil fertility, spil depths, and precipitation. Recoding fertility (0 to 100%), depth (0 to >= 1m), and precip (0 to >= 1000mm) with a power regression curve from 0 to 1, then taking the mean of the two as the regrowth rate
-        growthrate = "%stemporary_vegetation_regrowth_map" % pid
-
-        e = '''${growthrate} = eval(x = if(${sdepth} <= 1.0, (-0.000118528 * (exp((100*${sdepth}),2.0))) + (0.0215056 * (100*${sdepth})) + 0.0237987, 1), \
-                                    y = if(${precip} <= 1.0, ( -0.000118528 * (exp((100*${precip}),2.0))) + (0.0215056 * (100*${precip})) + 0.0237987, 1), \
-                                    z = (-0.000118528 * (exp(${outfert},2.0))) + (0.0215056 * ${outfert}) + 0.0237987, \
-                                    a = if(x <= 0 || z <= 0, 0, (x+y+z)/3), if(a < 0, 0, a) )'''
-        grass.mapcalc(e, quiet = True,
-                      growthrate = growthrate,
-                      sdepth = oldsdepth,
-                      outfert = outfert,
-                      precip = precip)
-
-        # Calculate this year's landcover impacts and regrowth
-        e = '''${outlcov} = eval(a = if(${oldlcov} - ${grazeimpacts} + ${growthrate} >= 0, ${oldlcov} - ${grazeimpacts} + ${growthrate}, 0) , \
-                                 b = if(isnull(${fields}), a, ${farmval}), \
-                                 if(${oldlcov} < (${maxlcov} - ${growthrate}) && isnull(b), ${oldlcov} + ${growthrate}, if(isnull(b), ${maxlcov}, b) ))'''
-        grass.mapcalc(e, quiet = True,
-                      outlcov = outlcov,
-                      oldlcov = oldlcov,
-                      maxlcov = maxlcov,
-                      growthrate = growthrate,
-                      fields = fields,
-                      farmval = farmval,
-                      grazeimpacts = grazeimpacts)
+        growthrate = landcover.growthrate(zonal.readmap(oldsdepth), precip, fertarr)
 
+        # Calculate this year's landcover impacts and regrowth. If there was
+        # a fire, vegetation goes to 0 no matter what was there.
         if len(fireprob) > 0:
-            #If there was a fire, vegetation goes to 0 no matter what was there.
-            e = '''${outlcov} = if(isnull(${natural_fires}), ${outlcov}, 0)'''
-            grass.mapcalc(e, quiet = "True", overwrite = True,
-                          outlcov = outlcov,
-                          natural_fires = natural_fires)
-
-        # Make a rainfall excess map to send to r.landcape.evol. This is a
-        # logarithmic regression (R^2=0.99.) for the data
-        # pairs: 0,90;3,85;8,70;13,60;19,45;38,30;50,20. These are the same
-        # succession cutoffs that are used in the c-factor coding.
-        e = '''${outxs} = 193.522 - (42.3272 * log(${lcov} + 10.9718))'''
-        grass.mapcalc(e, quiet = True,
-                      outxs = outxs,
-                      lcov = outlcov)
+            fires = ~numpy.isnan(zonal.readmap(natural_fires))
+        else:
+            fires = None
+        lcovarr = landcover.update(zonal.readmap(oldlcov), growthrate, grazearr, fieldsarr, farmval, maxlcovarr, fires)[0]
 
-        # If rules set exists, create reclassed landcover labels map
-        try:
-#SEEMS LIKE THERE SHOULD BE A BETTER WAY TO DO THIS
-
-            temp_reclass = "%stemporary_reclassed_landcover" %pid
-            grass.run_command('r.reclass', quiet = True,
-                                           input = outlcov,
-                                           output = temp_reclass,
-                                           rules = lc_rules)
-
-            grass.mapcalc('${out} = ${input}', quiet = True,
-                                             overwrite = True,
-                                             out = outlcov,
-                                             input = temp_reclass)
-        except:
-            grass.warning("No landcover labling rules found at path \"%s\"\nOutput landcover map will not have text labels in queries" % lc_rules)
+        # Make a rainfall excess array to send to the landscape evolution.
+        # This is a logarithmic regression (R^2=0.99.) for the data
+        # pairs: 0,90;3,85;8,70;13,60;19,45;38,30;50,20. These are the same
+        # succession cutoffs that are used in the c-factor coding. It is
+        # looked up from the table of the landcover classes when the
+        # landcover is in whole classes, and only written out as a map if the
+        # maps are to be kept.
+        excess = landcover.rainfallexcess(lcovarr, xstable)
+        if use_flags['c'] is True:
+            zonal.writemap(outxs, excess)
+
+        # If rules set exists, reclass the landcover with its labels (in
+        # memory, where it is kept for the c-factor map), and write it in the
+        # background
+        if lcrules is not None:
+            lcovarr = lcrules(lcovarr)
+            output.submit(zonal.writemaps, [(outlcov, lcovarr)], integer = [outlcov], labels = {outlcov: lclabels.name}, colors = {outlcov: lccolors.name}, env = output.env)
+        else:
+            output.submit(zonal.writemaps, [(outlcov, lcovarr)], colors = {outlcov: lccolors.name}, env = output.env)
 
-        lccolors = ['0 grey', '10 red', '20 orange', '30 brown', '40 yellow', '%s green' % maxval]
-        lcc = grass.feed_command('r.colors', quiet = True, map = outlcov, rules = "-")
-        lcc.stdin.write('\n'.join(lccolors))
-        lcc.stdin.close()
+        # Creating c-factor array (from the landcover classes in memory)
+        # while they are written. It is only written out as a map if the maps
+        # are to be kept
+        grass.message('Creating C-factor map for r.landscape.evol')
+        cfactor = cfactrules(lcovarr)
+        if use_flags['c'] is True:
+            zonal.writemap(outcfact, cfactor)
+            cfcolors = ['0.1 grey', '0.05 red', '0.03 orange', '0.01 brown', '0.008 yellow', '0.005 green']
+            cfc = grass.feed_command('r.colors', quiet = True, map = outcfact, rules = "-")
+            cfc.stdin.write('\n'.join(cfcolors))
+            cfc.stdin.close()
+
+        # The landcover and fertility maps have to be written before their
+        # stats are taken
+        output.wait()
 
         # Collect and write landcover and fertiltiy temporal matrices
         grass.message('Collecting some landcover and fertility stats from this year....')
@@ -1431,31 +1399,27 @@ def main():
                 f.write("Landcover and Soil Fertility Stats\nNote that these stats are collected within the grazing catchment (landcover) and agricultural catchment (fertility) ONLY. Rest of the map is ignored.\n\n,,Basic Stats,,,,Extended Stats\nYear,,Mean Landcover,Standard Deviation Landcover,Mean Soil Fertility,Standard Deviation Soil Fertility,,Minimum Landcover,First Quartile Landcover,Median Landcover,Third Quartile Landcover,Maximum Landcover,,Minimum Soil Fertility,First Quartile Soil Fertility,Median Soil Fertility,Third Quartile Soil Fertility,Maximum Soil Fertility")
             f.write('\n%s' % o + ',,' + lcovstats['mean'] + ',' + lcovstats['stddev'] + ',' + fertstats['mean'] + ',' + fertstats['stddev'] + ',,' + lcovstats['max'] + ',' + lcovstats['third_quartile'] + ',' + lcovstats['median'] + ',' + lcovstats['first_quartile'] + ',' + lcovstats['min'] + ',,' + fertstats['min'] + ',' + fertstats['first_quartile'] + ',' + fertstats['median'] + ',' + fertstats['third_quartile'] + ',' + fertstats['max'])
 
-        # Creating c-factor map
-        grass.message('Creating C-factor map for r.landscape.evol')
-        try:
-            grass.run_command('r.recode', quiet = True, input = outlcov, output = outcfact, rules = cfact_rules)
-        except:
-            grass.fatal("NO CFACTOR RECLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
-            sys.exit(1)
-
-        cfcolors = ['0.1 grey', '0.05 red', '0.03 orange', '0.01 brown', '0.008 yellow', '0.005 green']
-        cfc = grass.feed_command('r.colors', quiet = True, map = outcfact, rules = "-")
-        cfc.stdin.write('\n'.join(cfcolors))
-        cfc.stdin.close()
-
         # Run r.landscape.evol with this years' cfactor map
-        landEvolve(m, outcfact, outxs, r, rain, storms, stormlength, statsout, levol_flags)
+        landEvolve(m, evolution, cfactor, excess, r, rain, storms, stormlength)
 
         #clean up temporary maps
-        #delete C-factor map, unless asked to save it
-        if use_flags['c'] is False:
-            grass.run_command("g.remove", quiet = True, flags = 'f', type = "rast", name = "%s,%s" %  (outcfact,outxs))
-        else:
-            pass
         grass.run_command('g.remove', quiet = True, flags = 'f', type = "rast", pattern = '%s*' % pid)
+
+        # Last year's maps are not needed anymore, so remove them unless they
+        # are to be kept (the Elevation and Soil Depth maps are overwritten
+        # every year, so are always kept)
+        if m > 0 and m % outinterval != 0:
+            names = ["Landcover", "Soil_Fertilty", "Farming_Impacts", "Gazing_Impacts", "Tenured_Fields", "Natural_Fires", "Cfactor", "Rainfall_Excess"]
+            grass.run_command('g.remove', quiet = True, flags = 'fe', type = "rast", pattern = "^%s(%s)_Map%04d$" % (p, "|".join(names), m))
         grass.message('Completed year %s of the simulation' % o)
 
+    output.close()
+    evolution.close()
+    lccolors.close()
+    fertcolors.close()
+    if lcrules is not None:
+        lclabels.close()
+
     return(grass.message(".........................SIMULATION COMPLETE...........................\nCheck in the current mapset for farming/grazing yields, landcover, fertility, and erosion/depostion stats files from this run."))
 
 
@@ -1607,21 +1571,9 @@ def luStrategy(m, o, p, pid, tempfields, numfields, tenuredcells, tempcerealretu
 
     return tenuredcells, droppedcells, newcells, tempfields
 
-def landEvolve(m, outcfact, outxs, r, rain, storms, stormlength, statsout, levol_flags):
+def landEvolve(m, evolution, cfactor, excess, r, rain, storms, stormlength):
         p = options['prefx'] + "_"
         elev = options["elev"]
-        initbdrk = options["initbdrk"]
-        k = options["k"]
-        sdensity = options["sdensity"]
-        kappa = options["kappa"]
-        manningn = options["manningn"]
-        cutoff1 = options["cutoff1"]
-        cutoff2 = options["cutoff2"]
-        cutoff3 = options["cutoff3"]
-        speed = options["speed"]
-        kt = options["kt"]
-        loadexp = options["loadexp"]
-        smoothing = options["smoothing"]
 
         grass.message('Running landscape evolution for this year....')
 
@@ -1632,9 +1584,9 @@ def landEvolve(m, outcfact, outxs, r, rain, storms, stormlength, statsout, levol
             inelev = "%sElevation_Map0001" % (p)
 
         try:
-            grass.run_command('r.landscape.evol2', quiet = True, number = 1, prefx = options["prefx"], c = outcfact, elev = inelev, initbdrk = initbdrk, outdem = "Elevation_Map", outsoil = "Soil_Depth_Map", r = r, k = k, sdensity = sdensity, kappa = kappa, manningn = manningn, flowcontrib = outxs, cutoff1 = cutoff1, cutoff2 = cutoff2, cutoff3 = cutoff3, rain = rain, storms = storms, stormlength = stormlength, speed = speed, kt = kt, loadexp = loadexp, smoothing = smoothing, statsout = statsout, flags = ''.join(levol_flags))
+            evolution.step(p, inelev, cfactor, r, rain, storms, stormlength, flowcontrib = excess)
         except:
-            grass.fatal("Something is wrong with the values you sent to r.landscape.evol. Did you forget something? Check the values and try again...\nSimulation terminated with an error at time step %s" % o)
+            grass.fatal("Something is wrong with the values you sent to r.landscape.evol. Did you forget something? Check the values and try again...\nSimulation terminated with an error at time step %s" % (m + 1))
             sys.exit(1)
 
 
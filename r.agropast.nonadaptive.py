@@ -259,7 +259,7 @@
 #%option
 #% key: Kt
 #% type: double
-#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate)
+#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate) (ignored: not used by the landscape evolution anymore)
 #% answer: 0.0001
 #% options: 0.001,0.0001,0.00001,0.000001
 #% guisection: Landscape Evolution
@@ -267,7 +267,7 @@
 #%option
 #% key: loadexp
 #% type: double
-#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport)
+#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport) (ignored: not used by the landscape evolution anymore)
 #% answer: 1.5
 #% options: 1.5,2.5
 #% guisection: Landscape Evolution
@@ -275,7 +275,7 @@
 #%option
 #% key: kappa
 #% type: double
-#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr]
+#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr] (ignored: not used by the landscape evolution anymore)
 #% answer: 1
 #% guisection: Landscape Evolution
 #%end
@@ -311,28 +311,28 @@
 #%option
 #% key: speed
 #% type: double
-#% description: Average velocity of flowing water in the drainage [m/s]
+#% description: Average velocity of flowing water in the drainage [m/s] (ignored: not used by the landscape evolution anymore)
 #% answer: 1.4
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff1
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow
+#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow (ignored: not used by the landscape evolution anymore)
 #% answer: 0.65
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff2
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 2.25
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff3
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 7
 #% guisection: Landscape Evolution
 #%end
@@ -381,10 +381,15 @@
 #%end
 
 
+import sys
 import os
 import tempfile
 import grass.script as grass
 
+# The mmllite package is installed in the same directory as this script
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from mmllite import agropast, rules, zonal
+
 #main block of code starts here
 def main():
     grass.message("Setting up Simulation........")
@@ -418,14 +423,10 @@ def main():
     initbdrk = options["initbdrk"]
     K = options["K"]
     sdensity = options["sdensity"]
-    kappa = options["kappa"]
-    cutoff1 = options["cutoff1"]
-    cutoff2 = options["cutoff2"]
-    cutoff3 = options["cutoff3"]
-    speed = options["speed"]
-    Kt = options["Kt"]
-    loadexp = options["loadexp"]
     smoothing = options["smoothing"]
+    #kappa, cutoff1-3, speed, kt, and loadexp were options of the old r.landscape.evol, and the landscape evolution does not use them anymore
+    for key in agropast.ignoredoptions(options, {"kappa": 1, "cutoff1": 0.65, "cutoff2": 2.25, "cutoff3": 7, "speed": 1.4, "Kt": 0.0001, "loadexp": 1.5}):
+        grass.warning("%s=%s is ignored, as the landscape evolution does not use it anymore" % (key, options[key]))
     #these values could be read in from a climate file, so check that, and act accordingly
     rain2 = []
     try:
@@ -514,9 +515,24 @@ def main():
     fertcolors = tempfile.NamedTemporaryFile()
     fertcolors.write('0 white\n20 grey\n40 yellow\n60 orange\n80 brown\n100 black')
     fertcolors.flush()
+    #read the c-factor and landcover label rules once, into lookup tables of the landcover classes
+    try:
+        cfactrules = rules.Recode(cfact_rules)
+    except:
+        grass.message("NO CFACTOR RELCLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
+        exit(1)
+    try:
+        lcrules = rules.Reclass(lc_rules)
+        lclabels = tempfile.NamedTemporaryFile(mode = "w")
+        lcrules.categories(lclabels.name)
+    except:
+        grass.message("No landcover labling rules found at path \"%s\"\nOutput landcover map will not have text labels in queries" % lc_rules)
+        lcrules = None
     #Figure out the number of cells per hectare and per square meter to use as conversion factors for yields
     region = grass.region()
     cellperhectare = 100000 / (float(region['nsres']) * float(region['ewres']))
+    #run the landscape evolution of each year in this process, with the common agropast engine
+    evolution = agropast.Evolution(statsout, region['nsres'], {"elev": elev, "initbdrk": initbdrk, "k": K, "sdensity": sdensity, "smoothing": smoothing, "outdem": "Elevation_Map", "outsoil": "Soil_Depth_Map"}, levol_flags)
     #cellpersqm = 1 / (float(region['nsres']) * float(region['ewres']))
     #find out number of digits in 'years' for zero padding
     digits = len(str(abs(years)))
@@ -625,13 +641,12 @@ def main():
         grass.mapcalc('${growthrate}=eval(x=if(${sdepth} <= 1.0, ( -0.000118528 * (exp((100*${sdepth}),2.0))) + (0.0215056 * (100*${sdepth})) + 0.0237987, 1), y=if(${precip} <= 1.0, ( -0.000118528 * (exp((100*${precip}),2.0))) + (0.0215056 * (100*${precip})) + 0.0237987, 1), z=(-0.000118528 * (exp(${sfertil},2.0))) + (0.0215056 * ${sfertil}) + 0.0237987, if(x <= 0 && y <= 0 && z <= 0, 0, (x+y+z)/3) )', quiet = "True", growthrate = growthrate,  sdepth = oldsdepth,  sfertil = outfert, precip = precip)
         #Calculate this year's landcover impacts and regrowth
         grass.mapcalc("${outlcov}=eval(a=if(isnull(${fields}), ${oldlcov} - ${grazeimpacts} + ${growthrate}, ${farmval}) ,if(${oldlcov} < (${maxlcov} - ${growthrate}) && isnull(a), ${oldlcov} + ${growthrate}, if(isnull(a), ${maxlcov}, a) ))", quiet = "True", outlcov = outlcov, oldlcov = oldlcov, maxlcov = maxlcov, growthrate = growthrate, fields = fields, farmval = farmval, grazeimpacts = grazeimpacts)
-        #if rules set exists, create reclassed landcover labels map
-        try:
-            temp_reclass = "%stemporary_reclassed_landcover" %pid
-            grass.run_command('r.reclass', quiet = "True",  input = outlcov,  output = temp_reclass,  rules = lc_rules)
-            grass.mapcalc('${out}=${input}', quiet = "True", overwrite = "True", out = outlcov, input = temp_reclass)
-        except:
-            grass.message("No landcover labling rules found at path \"%s\"\nOutput landcover map will not have text labels in queries" % lc_rules)
+        #if rules set exists, reclass the landcover with its labels (in memory, where it is kept for the c-factor map)
+        lcovarr = zonal.readmap(outlcov)
+        if lcrules is not None:
+            lcovarr = lcrules(lcovarr)
+            zonal.writemap(outlcov, lcovarr, integer = True)
+            grass.run_command('r.category', quiet = True, map = outlcov, rules = lclabels.name, separator = ':')
         grass.run_command('r.colors',  quiet = "True",  map = outlcov, rules = lccolors.name)
         #collect and write landcover and fertiltiy temporal matrices
         grass.message('Collecting some landcover and fertility stats from this year....')
@@ -666,14 +681,12 @@ def main():
         if os.path.getsize(textout4) == 0:
             f.write("Landcover and Soil Fertility Stats\nNote that these stats are collected within the grazing catchment (landcover) and agricultural catchment (fertility) ONLY. Rest of the map is ignored.\n\nYear,,Mean Landcover,Standard Deviation Landcover,Minimum Landcover,First Quartile Landcover,Median Landcover,Third Quartile Landcover,Maximum Landcover,,Mean Soil Fertility,Standard Deviation Soil Fertility,Minimum Soil Fertility,First Quartile Soil Fertility,Median Soil Fertility,Third Quartile Soil Fertility,Maximum Soil Fertility")
         f.write('\n%s' % now + ',,' + lcovstats['mean'] + ',' + lcovstats['stddev'] + ',' + lcovstats['max'] + ',' + lcovstats['third_quartile'] + ',' + lcovstats['median'] + ',' + lcovstats['first_quartile'] + ',' + lcovstats['min'] + ',,' + fertstats['mean'] + ',' + fertstats['stddev'] + ',' + fertstats['min'] + ',' + fertstats['first_quartile'] + ',' + fertstats['median'] + ',' + fertstats['third_quartile'] + ',' + fertstats['max'])
-        #creating c-factor map
+        #creating c-factor array (from the landcover classes in memory), which is only written out as a map if the maps are to be kept
         grass.message('Creating C-factor map for r.landscape.evol')
-        try:
-            grass.run_command('r.recode', quiet = True, input = outlcov, output = outcfact, rules = cfact_rules)
-        except:
-            grass.message("NO CFACTOR RELCLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
-            exit(1)
-        grass.run_command('r.colors',  quiet = True, map = outcfact, rules = cfcolors.name)
+        cfactor = cfactrules(lcovarr)
+        if c_flag['c'] is True:
+            zonal.writemap(outcfact, cfactor)
+            grass.run_command('r.colors',  quiet = True, map = outcfact, rules = cfcolors.name)
         #Run r.landscape.evol with this years' cfactor map
         grass.message('Running landscape evolution for this year....')
         #set the prefix for r.landscape.evol output files
@@ -685,21 +698,19 @@ def main():
             inelev = "%s_Year_%s_Elevation_Map" % (prfx, then)
         #grass.message('Year %s\norig elev map: %s\nusing elevation map: \"%s\"' % (now, elev, inelev)) #a  debugging message
         try:
-            capture = grass.run_command('r.landscape.evol.py', quiet = "True", number = 1, prefx = prefix, C = outcfact, elev = inelev, initbdrk = initbdrk, outdem = "Elevation_Map", outsoil = "Soil_Depth_Map", R = R, K = K, sdensity = sdensity, kappa = kappa, cutoff1 = cutoff1, cutoff2 = cutoff2, cutoff3 = cutoff3, rain = rain, storms = storms, stormlength = stormlength, speed = speed, Kt = Kt, loadexp = loadexp, smoothing = smoothing, statsout = statsout, flags = ''.join(levol_flags))
+            evolution.step(prefix, inelev, cfactor, R, rain, storms, stormlength)
         except:
             grass.message("Something is wrong with the values you sent to r.landscape.evol. Did you forget something? Check the values and try again...\nSimulation terminated with an error at time step %s" % now)
             exit(1)
-        #delete C-factor map, unless asked to save it
-        if c_flag['c'] is False:
-            grass.run_command("g.remove", quiet = "True", rast = outcfact)
-        else:
-            pass
         #clean up temporary maps
         grass.run_command('g.mremove', quiet = "True", flags = 'f', rast = '%s*' % pid)
         grass.message('Completed year %s of the simulation' % now)
+    evolution.close()
     lccolors.close()
     cfcolors.close()
     fertcolors.close()
+    if lcrules is not None:
+        lclabels.close()
     return(grass.message(".........................SIMULATION COMPLETE...........................\nCheck in the current mapset for farming/grazing yields, landcover, fertility, and erosion/depostion stats files from this run."))
 
 
@@ -76,6 +76,27 @@
 #% guisection: Landcover Dynamics
 #%END
 #%option
+#% key: fireseed
+#% type: integer
+#% description: Seed for the random draws of natural fire ignitions (a new random seed is used for every run if not given)
+#% required: no
+#% guisection: Landcover Dynamics
+#%END
+#%option
+#% key: burntime
+#% type: double
+#% description: Minutes that natural fires spread from their ignitions before they go out, at rates set by the fuel in last year's landcover and by the slope (0 burns only the ignition cells)
+#% answer: 0
+#% guisection: Landcover Dynamics
+#%END
+#%option
+#% key: replicates
+#% type: integer
+#% description: Number of replicate runs to make at once. Replicates share the same starting landscape and only differ in their random fires, and their landcover is updated for all of them together in memory. Each replicate's maps and stats files are named with its own prefix (PREFIX_Rep1, PREFIX_Rep2, etc.)
+#% answer: 1
+#% guisection: Simulation Control
+#%END
+#%option
 #% key: maxlcov
 #% type: string
 #% gisprompt: old,cell,raster
@@ -142,7 +163,7 @@
 #%option
 #% key: kt
 #% type: double
-#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate)
+#% description: Stream transport efficiency variable (0.001 for a soft substrate, 0.0001 for a normal substrate, 0.00001 for a hard substrate, 0.000001 for a very hard substrate) (ignored: not used by the landscape evolution anymore)
 #% answer: 0.0001
 #% options: 0.001,0.0001,0.00001,0.000001
 #% guisection: Landscape Evolution
@@ -150,7 +171,7 @@
 #%option
 #% key: loadexp
 #% type: double
-#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport)
+#% description: Stream transport type variable (1.5 for mainly bedload transport, 2.5 for mainly suspended load transport) (ignored: not used by the landscape evolution anymore)
 #% answer: 1.5
 #% options: 1.5,2.5
 #% guisection: Landscape Evolution
@@ -167,7 +188,7 @@
 #%option
 #% key: kappa
 #% type: double
-#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr]
+#% description: Hillslope diffusion (Kappa) rate map or constant [m/kyr] (ignored: not used by the landscape evolution anymore)
 #% answer: 1
 #% guisection: Landscape Evolution
 #%end
@@ -203,28 +224,28 @@
 #%option
 #% key: speed
 #% type: double
-#% description: Average velocity of flowing water in the drainage [m/s]
+#% description: Average velocity of flowing water in the drainage [m/s] (ignored: not used by the landscape evolution anymore)
 #% answer: 1.4
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff1
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow
+#% description: Flow accumulation breakpoint value for shift from diffusion to overland flow (ignored: not used by the landscape evolution anymore)
 #% answer: 0
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff2
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from overland flow to rill/gully flow (if value is the same as cutoff1, no sheetwash procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 100
 #% guisection: Landscape Evolution
 #%end
 #%option
 #% key: cutoff3
 #% type: double
-#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled)
+#% description: Flow accumulation breakpoint value for shift from rill/gully flow to stream flow (if value is the same as cutoff2, no rill procesess will be modeled) (ignored: not used by the landscape evolution anymore)
 #% answer: 100
 #% guisection: Landscape Evolution
 #%end
@@ -275,8 +296,13 @@
 import sys
 import os
 import tempfile
+import numpy
 import grass.script as grass
 
+# The mmllite package is installed in the same directory as this script
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from mmllite import agropast, fire, rules, zonal
+
 
 #main block of code starts here
 def main():
@@ -294,15 +320,11 @@ def main():
     initbdrk = options["initbdrk"]
     k = options["k"]
     sdensity = options["sdensity"]
-    kappa = options["kappa"]
     manningn = options["manningn"]
-    cutoff1 = options["cutoff1"]
-    cutoff2 = options["cutoff2"]
-    cutoff3 = options["cutoff3"]
-    speed = options["speed"]
-    kt = options["kt"]
-    loadexp = options["loadexp"]
     smoothing = options["smoothing"]
+    #kappa, cutoff1-3, speed, kt, and loadexp were options of the old r.landscape.evol, and the landscape evolution does not use them anymore
+    for key in agropast.ignoredoptions(options, {"kappa": 1, "cutoff1": 0, "cutoff2": 100, "cutoff3": 100, "speed": 1.4, "kt": 0.0001, "loadexp": 1.5}):
+        grass.warning("%s=%s is ignored, as the landscape evolution does not use it anymore" % (key, options[key]))
     #these values could be read in from a climate file, so check that, and act accordingly
     rain2 = []
     try:
@@ -406,7 +428,106 @@ def main():
     cfcolors.flush()
     #find out number of digits in 'years' for zero padding
     digits = len(str(abs(years)))
+    #find the cells of each fire probability stratum once, for drawing the natural fire ignitions every year
+    if options['fireseed']:
+        fireseed = int(options['fireseed'])
+    else:
+        fireseed = None
+    strata = fire.FireStrata(zonal.readmap(fireprob), seed = fireseed)
+    burntime = float(options['burntime'])
+    region = grass.region()
+    #options of the landscape evolution of each year, which is run in this process with the common agropast engine
+    levol_options = {"elev": elev, "initbdrk": initbdrk, "k": k, "sdensity": sdensity, "manningn": manningn, "smoothing": smoothing, "outdem": "Elevation_Map", "outsoil": "Soil_Depth_Map"}
     grass.message('Simulation will run for %s iterations.\n\n............................STARTING SIMULATION...............................' % years)
+    #if asked for, run several replicates at once, keeping their landcover in memory as one stack of arrays
+    replicates = int(options['replicates'])
+    try:
+        maxlcovval = float(maxlcov)
+    except:
+        maxlcovval = zonal.readmap(maxlcov)
+    #landcover is reclassed with the landcover labels every year, if there are any
+    try:
+        lcrules = rules.Reclass(lc_rules)
+        lclabels = tempfile.NamedTemporaryFile(mode = "w")
+        lcrules.categories(lclabels.name)
+    except:
+        grass.warning("No landcover labling rules found at path \"%s\"\nOutput landcover map will not have text labels in queries" % lc_rules)
+        lcrules = None
+    #the c-factors are looked up from the landcover classes in memory
+    try:
+        cfactrules = rules.Recode(cfact_rules)
+    except:
+        grass.fatal("NO CFACTOR RECLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
+    if replicates > 1:
+        #each replicate gets its own prefix for its maps and stats files
+        reps = ["%s_Rep%s" % (prfx, str(i + 1).zfill(len(str(replicates)))) for i in range(replicates)]
+        batch = fire.FireBatch(zonal.readmap(inlcov), zonal.readmap(infert), maxlcovval, strata, replicates, seed = fireseed, reclass = lcrules)
+        sdepth = numpy.repeat((zonal.readmap(elev) - zonal.readmap(initbdrk))[numpy.newaxis], replicates, axis = 0)
+        cellarea = float(region['nsres']) * float(region['ewres'])
+        #each replicate has its own erosion/deposition stats file
+        evolutions = [agropast.Evolution(statsdir + os.sep + rep + '_erdep_stats.txt', region['nsres'], levol_options, levol_flags) for rep in reps]
+        for year in range(int(years)):
+            now = str(year + 1).zfill(digits)
+            then = str(year).zfill(digits)
+            rain = rain2[year]
+            r = R2[year]
+            storms = storms2[year]
+            stormlength = stormlength2[year]
+            precip = 0.001 * (float(rain) * float(storms))
+            grass.message('_____________________________\nSIMULATION YEAR: %s\n--------------------------' % now)
+            #draw (and spread) the fires, and update the landcover of all the replicates together
+            if burntime > 0:
+                if (year + 1) == 1:
+                    elevs = [zonal.readmap(elev)] * replicates
+                else:
+                    elevs = [zonal.readmap("%s_Year_%s_Elevation_Map" % (rep, then)) for rep in reps]
+            else:
+                elevs = None
+            burned = batch.fires(elevs, (region['nsres'], region['ewres']), burntime)
+            excess = batch.step(sdepth, precip, burned)
+            cfactor = cfactrules(batch.lcov)
+            #then write out each replicate's maps and stats, and run its landscape evolution (with its c-factors and rainfall excess in memory, which are only written out as maps if they are to be kept)
+            for i, rep in enumerate(reps):
+                outlcov = "%s_Year_%s_Landcover_Map" % (rep, now)
+                fire.writefires("%s_Year_%s_Natural_Fires_map" % (rep, now), burned[i])
+                zonal.writemap(outlcov, batch.lcov[i], integer = lcrules is not None)
+                if lcrules is not None:
+                    grass.run_command('r.category', quiet = True, map = outlcov, rules = lclabels.name, separator = ':')
+                grass.run_command('r.colors',  quiet = "True",  map = outlcov, rules = lccolors.name)
+                if use_flags['c'] is True:
+                    outcfact = "%s_Year_%s_Cfactor_Map" % (rep, now)
+                    zonal.writemap(outcfact, cfactor[i])
+                    zonal.writemap("%s_Year_%s_Rainfall_Excess_Map" % (rep, now), excess[i])
+                    grass.run_command('r.colors',  quiet = True, map = outcfact, rules = cfcolors.name)
+                #landcover temporal matrix, with the area of each whole landcover class
+                textout = statsdir + os.sep + rep + '_landcover_temporal_matrix.txt'
+                f = open(textout, 'a')
+                if os.path.getsize(textout) == 0:
+                    f.write("Temporal Matrix of Landcover\n\nYear," + ",".join(str(i) for i in range(maxval + 1)) + "\n")
+                lcov = batch.lcov[i][~numpy.isnan(batch.lcov[i])].astype(int)
+                areas = numpy.bincount(lcov[(lcov >= 0) & (lcov <= maxval)], minlength = maxval + 1) * cellarea
+                f.write("%s," % now + "".join("%f," % area for area in areas) + "\n")
+                f.close()
+                if (year + 1) == 1:
+                    inelev = elev
+                else:
+                    inelev = "%s_Year_%s_Elevation_Map" % (rep, then)
+                try:
+                    evolutions[i].step(rep + "_Year_%s_" % now, inelev, cfactor[i], r, rain, storms, stormlength, flowcontrib = excess[i])
+                except:
+                    grass.fatal("Something is wrong with the values you sent to r.landscape.evol. Did you forget something? Check the values and try again...\nSimulation terminated with an error at time step %s" % now)
+                sdepth[i] = zonal.readmap("%s_Year_%s_Soil_Depth_Map" % (rep, now))
+            grass.message('Completed year %s of the simulation' % now)
+        for evolution in evolutions:
+            evolution.close()
+        lccolors.close()
+        cfcolors.close()
+        if lcrules is not None:
+            lclabels.close()
+        return(grass.message(".........................SIMULATION COMPLETE...........................\nCheck in the current mapset for the landcover and erosion/depostion stats files of each replicate."))
+    evolution = agropast.Evolution(statsout, region['nsres'], levol_options, levol_flags)
+    #the landcover is kept in memory, and regrown, burned, and reclassed as that of a batch of one replicate (with the fires drawn as before)
+    batch = fire.FireBatch(zonal.readmap(inlcov), zonal.readmap(infert), maxlcovval, strata, 1, reclass = lcrules)
     #Set up loop
     for year in range(int(years)):
         now = str(year + 1).zfill(digits)
@@ -428,47 +549,34 @@ def main():
         natural_fires = "%s_Year_%s_Natural_Fires_map" % (prfx, now)
         #check if this is year one, use the starting landcover and soilfertily and calculate soildepths
         if (year + 1) == 1:
-            oldlcov = inlcov
             oldsdepth = "%s_Year_%s_Soil_Depth_Map" % (prfx, then)
             grass.mapcalc("${sdepth}=(${elev}-${bdrk})", quiet ="True", sdepth = oldsdepth, elev = elev, bdrk = initbdrk)
         else:
-            oldlcov = "%s_Year_%s_Landcover_Map" % (prfx, then)
             oldsdepth = "%s_Year_%s_Soil_Depth_Map" % (prfx, then)
             
         # Calculate natural (lightning-caused) fire ignition on the landscape
-        # parse fire probability map into three with mapcalc:
-        lowprobmap = "%stemp_fireprob_low" % pid
-        medprobmap = "%stemp_fireprob_med" % pid
-        hiprobmap = "%stemp_fireprob_hi" % pid
-        # Hardcoding cutoffs for no, low, medium, high probability based on histogram of spanish fire probability map.
-        grass.mapcalc("${lowprobmap}=if(${fireprob} <= 0.2, 1, null())", quiet = "True", fireprob=fireprob, lowprobmap=lowprobmap)
-        grass.mapcalc("${medprobmap}=if(${fireprob} > 0.2 || ${fireprob} <= 0.6, 1, null())", quiet = "True", fireprob=fireprob, medprobmap=medprobmap)
-        grass.mapcalc("${hiprobmap}=if(${fireprob} > 0.6, 1, null())", quiet = "True", fireprob=fireprob, hiprobmap=hiprobmap)
-        # randomly sample each of these maps at different densities (find out actual densities from Grant):
-        fires1 = "%sfires_low" % pid
-        fires2 = "%sfires_med" % pid
-        fires3 = "%sfires_hi" % pid
-        grass.run_command('r.random', quiet = 'True', input=lowprobmap, raster=fires1, npoints="5%")
-        grass.run_command('r.random', quiet = 'True', input=medprobmap, raster=fires2, npoints="10%")
-        grass.run_command('r.random', quiet = 'True', input=hiprobmap, raster=fires3, npoints="15%")
-        # patch those back to make final map of fire locations
-        grass.run_command('r.patch', input="%s,%s,%s" % (fires1,fires2,fires3), output=natural_fires)
+        # by drawing a share of the cells of each fire probability stratum
+        ignitions = strata.ignitions()
+        # if asked to, spread the fires from there through last year's landcover, over last year's landscape
+        if burntime > 0:
+            if (year + 1) == 1:
+                lastelev = elev
+            else:
+                lastelev = "%s_Year_%s_Elevation_Map" % (prfx, then)
+            rates = fire.fuelrates(batch.lcov[0])
+            ignitions, arrivals = fire.spread(ignitions, rates, zonal.readmap(lastelev), (region['nsres'], region['ewres']), burntime)
+        burned = strata.mask(ignitions)
+        fire.writefires(natural_fires, burned)
         #update landcover
-        # calculating rate of regrowth based on current soil fertility, spil depths, and precipitation. Recoding fertility (0 to 100%), depth (0 to >= 1m), and precip (0 to >= 1000mm) with a power regression curve from 0 to 1, then taking the mean of the two as the regrowth rate
-        growthrate = "%stemporary_vegetation_regrowth_map" % pid
-        grass.mapcalc('${growthrate}=eval(x=if(${sdepth} <= 1.0, ( -0.000118528 * (exp((100*${sdepth}),2.0))) + (0.0215056 * (100*${sdepth})) + 0.0237987, 1), y=if(${precip} <= 1.0, ( -0.000118528 * (exp((100*${precip}),2.0))) + (0.0215056 * (100*${precip})) + 0.0237987, 1), z=(-0.000118528 * (exp(${outfert},2.0))) + (0.0215056 * ${outfert}) + 0.0237987, a=if(x <= 0 || z <= 0, 0, (x+y+z)/3), if(a < 0, 0, a) )', quiet = "True", growthrate = growthrate,  sdepth = oldsdepth, outfert = infert, precip = precip)
-        #Calculate this year's landcover impacts and regrowth
-        #If there was a fire, vegetation goes to 0 no matter what was there, otherwise regrow at calculated rate.
-        grass.mapcalc("${outlcov}=eval(a=if(${oldlcov} + ${growthrate} >= ${maxlcov}, ${maxlcov}, ${oldlcov} + ${growthrate}), b=if(isnull(${natural_fires}), a, 0))", quiet = "True", overwrite = "True", outlcov = outlcov, oldlcov=oldlcov, growthrate=growthrate, maxlcov=maxlcov, natural_fires = natural_fires)
-        #Make a rainfall excess map to send to r.landcape.evol. This is a logarithmic regression (R^2=0.99.) for the data pairs: 0,90;3,85;8,70;13,60;19,45;38,30;50,20. These are the same succession cutoffs that are used in the c-factor coding.
-        grass.mapcalc("${outxs}=193.522 - (42.3272 * log(${lcov} + 10.9718))", quiet = "True", outxs = outxs, lcov = outlcov)
-        #if rules set exists, create reclassed landcover labels map
-        try:
-            temp_reclass = "%stemporary_reclassed_landcover" %pid
-            grass.run_command('r.reclass', quiet = "True",  input = outlcov,  output = temp_reclass,  rules = lc_rules)
-            grass.mapcalc('${out}=${input}', quiet = "True", overwrite = "True", out = outlcov, input = temp_reclass)
-        except:
-            grass.warning("No landcover labling rules found at path \"%s\"\nOutput landcover map will not have text labels in queries" % lc_rules)
+        # calculating rate of regrowth based on current soil fertility, spil depths, and precipitation, and regrowing last year's landcover at that rate. If there was a fire, vegetation goes to 0 no matter what was there.
+        #The rainfall excess to send to the landscape evolution comes from the same step (from the landcover before it is reclassed with the labels, if there are any). It is only written out as a map if the maps are to be kept.
+        excess = batch.step(zonal.readmap(oldsdepth)[numpy.newaxis], precip, burned[numpy.newaxis])[0]
+        lcovarr = batch.lcov[0]
+        if use_flags['c'] is True:
+            zonal.writemap(outxs, excess)
+        zonal.writemap(outlcov, lcovarr, integer = lcrules is not None)
+        if lcrules is not None:
+            grass.run_command('r.category', quiet = True, map = outlcov, rules = lclabels.name, separator = ':')
         grass.run_command('r.colors',  quiet = "True",  map = outlcov, rules = lccolors.name)
         #collect and write landcover temporal matrix
         grass.message('Collecting some landcover and fertility stats from this year....')
@@ -484,14 +592,12 @@ def main():
                 f.write("0,")
         f.write("\n")
         f.close()
-        #creating c-factor map
+        #creating c-factor array, which is only written out as a map if the maps are to be kept
         grass.message('Creating C-factor map for r.landscape.evol')
-        try:
-            grass.run_command('r.recode', quiet = True, input = outlcov, output = outcfact, rules = cfact_rules)
-        except:
-            grass.fatal("NO CFACTOR RECLASS RULES WERE FOUND AT PATH \"%s\"\nPLEASE ENSURE THAT THE CFACTOR RECODE RULES EXIST AND ARE WRITTEN PROPERLY, AND THEN TRY AGAIN" % cfact_rules)
-            sys.exit(1)
-        grass.run_command('r.colors',  quiet = True, map = outcfact, rules = cfcolors.name)
+        cfactor = cfactrules(lcovarr)
+        if use_flags['c'] is True:
+            zonal.writemap(outcfact, cfactor)
+            grass.run_command('r.colors',  quiet = True, map = outcfact, rules = cfcolors.name)
         #Run r.landscape.evol with this years' cfactor map
         grass.message('Running landscape evolution for this year....')
         #set the prefix for r.landscape.evol output files
@@ -502,20 +608,18 @@ def main():
         else:
             inelev = "%s_Year_%s_Elevation_Map" % (prfx, then)
         try:
-            grass.run_command('r.landscape.evol', quiet = "True", number = 1, prefx = prefix, c = outcfact, elev = inelev, initbdrk = initbdrk, outdem = "Elevation_Map", outsoil = "Soil_Depth_Map", r = r, k = k, sdensity = sdensity, kappa = kappa, manningn = manningn, flowcontrib = outxs, cutoff1 = cutoff1, cutoff2 = cutoff2, cutoff3 = cutoff3, rain = rain, storms = storms, stormlength = stormlength, speed = speed, kt = kt, loadexp = loadexp, smoothing = smoothing, statsout = statsout, flags = ''.join(levol_flags))
+            evolution.step(prefix, inelev, cfactor, r, rain, storms, stormlength, flowcontrib = excess)
         except:
             grass.fatal("Something is wrong with the values you sent to r.landscape.evol. Did you forget something? Check the values and try again...\nSimulation terminated with an error at time step %s" % now)
             sys.exit(1)
-        #delete C-factor map, unless asked to save it
-        if use_flags['c'] is False:
-            grass.run_command("g.remove", quiet = "True", flags = 'f', type = "rast", name = "%s,%s" %  (outcfact,outxs))
-        else:
-            pass
         #clean up temporary maps
         grass.run_command('g.remove', quiet = "True", flags = 'f', type = "rast", pattern = '%s*' % pid)
         grass.message('Completed year %s of the simulation' % now)
+    evolution.close()
     lccolors.close()
     cfcolors.close()
+    if lcrules is not None:
+        lclabels.close()
     return(grass.message(".........................SIMULATION COMPLETE...........................\nCheck in the current mapset for farming/grazing yields, landcover, fertility, and erosion/depostion stats files from this run."))
         
 